@@ -0,0 +1,95 @@
+"""
+Harness for the Balancer: start a few in-process servers, some slower
+than others, throw calls at them, and see how the load spreads, next to
+plain round-robin over the same servers.
+
+    cd bench
+    python balance.py [n_calls] [window] [delays]
+
+delays is a comma-separated list of per-call server delays in seconds,
+one server each (default: 0.001,0.001,0.001,0.01).  window is the number
+of calls kept in flight at once.
+"""
+
+import sys
+sys.path.append("../")
+import itertools
+import threading
+import time
+import fmprpc
+import fmprpc.log as log
+import fmprpc.server as server
+from fmprpc.balancer import Balancer
+
+log.Levels.setDefault(log.Levels.ERROR)
+BASE_PORT = 50110
+
+##=======================================================================
+
+class P_v1 (server.Handler):
+    def h_work (self, b):
+        time.sleep(self.server.delay)
+        b.reply(self.server.port)
+
+def startServer (port, delay):
+    srv = server.ContextualServer(
+        bindto = fmprpc.OpenServerAddress(port = port),
+        classes = { "P.1" : P_v1 })
+    srv.port = port
+    srv.delay = delay
+    c = threading.Condition()
+    c.acquire()
+    t = threading.Thread(target = srv.listenRetry, args = (1, c))
+    t.daemon = True
+    t.start()
+    c.wait()
+    c.release()
+    return srv
+
+##=======================================================================
+
+class RoundRobin (object):
+    """What we'd do by hand: one Transport per server, taking turns."""
+    def __init__ (self, remotes):
+        self._ts = [ fmprpc.Transport(remote = r) for r in remotes ]
+        self._turn = itertools.count()
+    def connect (self):
+        return all([ t.connect() for t in self._ts ])
+    def invokeAsync (self, **kwargs):
+        t = self._ts[next(self._turn) % len(self._ts)]
+        return t.invokeAsync(**kwargs)
+    def close (self):
+        for t in self._ts: t.close()
+
+def run (name, t, ports, n, window):
+    t.connect()
+    c = fmprpc.Client(t, "P.1")
+    counts = dict([ (p, 0) for p in ports ])
+    lat = []
+    start = time.time()
+    for i in range(0, n, window):
+        calls = []
+        for j in range(min(window, n - i)):
+            calls.append((time.time(), c.invokeAsync("work", None)))
+        for (st, f) in calls:
+            counts[f.result()] += 1
+            lat.append(time.time() - st)
+    dur = time.time() - start
+    t.close()
+    lat.sort()
+    print("{0}: {1:.0f} calls/s, latency p50 {2:.4f}s p99 {3:.4f}s".format(
+        name, n / dur, lat[len(lat) / 2], lat[int(len(lat) * 0.99)]))
+    print("    calls per server: {0}".format(
+        " ".join([ "{0}".format(counts[p]) for p in ports ])))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 4000
+    window = int(sys.argv[2]) if len(sys.argv) > 2 else 32
+    delays = [ float(d) for d in (sys.argv[3] if len(sys.argv) > 3
+                                  else "0.001,0.001,0.001,0.01").split(",") ]
+    ports = [ BASE_PORT + i for i in range(len(delays)) ]
+    servers = [ startServer(p, d) for (p, d) in zip(ports, delays) ]
+    print("servers (delay): {0}".format(" ".join([ str(d) for d in delays ])))
+    remotes = [ fmprpc.InternetAddress(port = p) for p in ports ]
+    run("round-robin", RoundRobin(remotes), ports, n, window)
+    run("balancer", Balancer(remotes), ports, n, window)
@@ -0,0 +1,83 @@
+"""
+Harness for the BatchingClient: make lots of tiny calls through a plain
+Client, through BatchingClients with various windows, and in wire-level
+BATCH frames (Client.invokeBatch), and compare.
+
+    cd bench
+    python batching.py [n_calls] [in_flight]
+
+in_flight is the number of calls kept outstanding at once, which caps
+how big a batch can get.
+"""
+
+import sys
+sys.path.append("../")
+import threading
+import time
+import fmprpc
+import fmprpc.log as log
+import fmprpc.server as server
+from fmprpc import batching
+
+log.Levels.setDefault(log.Levels.ERROR)
+PORT = 50120
+
+##=======================================================================
+
+class P_v1 (server.Handler):
+    def h_get (self, b):
+        b.reply(b.arg + 1)
+    @batching.batchHook
+    def h_get_batch (self, args):
+        return [ a + 1 for a in args ]
+
+def startServer ():
+    srv = server.ContextualServer(
+        bindto = fmprpc.OpenServerAddress(port = PORT),
+        classes = { "P.1" : P_v1 })
+    c = threading.Condition()
+    c.acquire()
+    t = threading.Thread(target = srv.listenRetry, args = (1, c))
+    t.daemon = True
+    t.start()
+    c.wait()
+    c.release()
+    return srv
+
+##=======================================================================
+
+class WireBatch (object):
+    """Each window of calls goes out in one BATCH frame."""
+    def __init__ (self, c):
+        self._c = c
+    def invokeAll (self, args):
+        return self._c.invokeBatch([ ("get", a) for a in args ])
+
+def run (name, c, n, in_flight):
+    start = time.time()
+    for i in range(0, n, in_flight):
+        args = range(i, min(n, i + in_flight))
+        if isinstance(c, WireBatch):
+            fs = c.invokeAll(args)
+        else:
+            fs = [ c.invokeAsync("get", j) for j in args ]
+        for (j, f) in zip(range(i, n), fs):
+            assert f.result() == j + 1
+    dur = time.time() - start
+    print("{0:<28} {1:>8.0f} calls/s".format(name, n / dur))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    in_flight = int(sys.argv[2]) if len(sys.argv) > 2 else 256
+    srv = startServer()
+    t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = PORT))
+    t.connect()
+    run("plain client", fmprpc.Client(t, "P.1"), n, in_flight)
+    run("wire BATCH", WireBatch(fmprpc.Client(t, "P.1")), n, in_flight)
+    for (window, max_batch) in [ (0.0005, 16), (0.0005, 64), (0.001, 64),
+                                 (0.001, 256), (0.005, 256) ]:
+        c = batching.BatchingClient(t, "P.1", window = window, max_batch = max_batch)
+        run("batched {0}s / {1}".format(window, max_batch), c, n, in_flight)
+        c.close()
+    t.close()
+    srv.close()
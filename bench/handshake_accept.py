@@ -0,0 +1,105 @@
+"""
+Benchmark for the accept path under handshake load: while some clients
+dawdle over their handshakes, how fast does the server accept and start
+up everyone else?
+
+    cd bench
+    python handshake_accept.py [n_good] [n_slow] [slow_secs] [pool]
+
+Each slow client takes slow_secs to send its handshake.  With pool=1, the
+listener does handshakes on a worker pool (Listener.setHandshakePool);
+with pool=0, it does them right on the accept loop, as by default.
+"""
+
+import sys
+sys.path.append("../")
+import socket
+import threading
+import time
+import fmprpc
+import fmprpc.log as log
+import fmprpc.server as server
+import fmprpc.transport as transport
+from fmprpc.pool import WorkerPool
+
+log.Levels.setDefault(log.Levels.ERROR)
+PORT = 50101
+
+##=======================================================================
+
+class HelloServerWrapper (transport.ClearStreamWrapper):
+    """A stand-in for a TLS or SSH handshake: wait for the client's hello."""
+    def start (self):
+        if self._socket.recv(5) != "hello":
+            return False
+        return transport.ClearStreamWrapper.start(self)
+
+class HelloServerTransport (transport.Transport):
+    def __init__ (self, **kwargs):
+        transport.Transport.__init__(self, **kwargs)
+        self.setWrapperClass(HelloServerWrapper)
+
+class P_v1 (server.Handler):
+    def h_ping (self, b):
+        b.reply(b.arg)
+
+##=======================================================================
+
+def slowClient (secs):
+    s = socket.create_connection(("127.0.0.1", PORT))
+    time.sleep(secs)
+    try:
+        s.sendall("hello")
+    except socket.error:
+        pass
+    return s
+
+def goodClient (times):
+    start = time.time()
+    s = socket.create_connection(("127.0.0.1", PORT))
+    s.sendall("hello")
+    t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = PORT), stream = s)
+    fmprpc.Client(t, "P.1").invoke("ping", 1)
+    times.append(time.time() - start)
+    t.close()
+
+def run (n_good, n_slow, slow_secs, use_pool):
+    srv = server.ContextualServer(
+        bindto = fmprpc.OpenServerAddress(port = PORT),
+        classes = { "P.1" : P_v1 },
+        TransportClass = HelloServerTransport)
+    if use_pool:
+        srv.setHandshakePool(WorkerPool(n_workers = 64), deadline = 10)
+    c = threading.Condition()
+    c.acquire()
+    t = threading.Thread(target = srv.listenRetry, args = (1, c))
+    t.daemon = True
+    t.start()
+    c.wait()
+    c.release()
+
+    threads = []
+    for i in range(n_slow):
+        threads.append(threading.Thread(target = slowClient, args = (slow_secs, )))
+    times = []
+    for i in range(n_good):
+        threads.append(threading.Thread(target = goodClient, args = (times, )))
+    start = time.time()
+    for x in threads:
+        x.daemon = True
+        x.start()
+    for x in threads[n_slow:]:
+        x.join()
+    dur = time.time() - start
+    times.sort()
+    print("pool={0} good={1} slow={2}x{3}s".format(use_pool, n_good, n_slow, slow_secs))
+    print("good clients served in {0:.3f}s ({1:.0f} accepts/s)".format(dur, n_good / dur))
+    print("connect+call latency: median {0:.3f}s, max {1:.3f}s".format(
+        times[len(times) / 2], times[-1]))
+
+if __name__ == "__main__":
+    n_good = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    n_slow = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+    slow_secs = float(sys.argv[3]) if len(sys.argv) > 3 else 0.1
+    use_pool = int(sys.argv[4]) if len(sys.argv) > 4 else 1
+    run(n_good, n_slow, slow_secs, use_pool)
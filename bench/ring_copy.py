@@ -0,0 +1,56 @@
+"""
+Micro-benchmark for the packetizer's input path: stuff a stream of
+small frames into a Packetizer in recv()-sized chunks, and report how
+many bytes the Ring had to copy per decoded frame.
+
+    cd bench
+    python ring_copy.py [n_frames] [chunk_size] [engine]
+
+With engine=unpacker, the Ring isn't used at all, so only the decode
+rate is interesting.
+"""
+
+import sys
+sys.path.append("../")
+import time
+import msgpack
+import fmprpc.log as log
+from fmprpc.packetizer import Packetizer
+
+##=======================================================================
+
+class Sink (Packetizer):
+    def __init__ (self, engine):
+        Packetizer.__init__(self, log.newDefaultLogger())
+        self.setEngine(engine)
+        self.n = 0
+    def dispatch (self, msg): self.n += 1
+    def packetizeError (self, e): raise Exception(e)
+
+##=======================================================================
+
+def makeStream (n):
+    frames = []
+    for i in range(n):
+        body = msgpack.packb([ 1, i, None, { "y" : i * 2, "s" : "x" * (i % 40) } ])
+        frames.append(msgpack.packb(len(body)) + body)
+    return "".join(frames)
+
+def run (n, chunk, engine):
+    data = makeStream(n)
+    p = Sink(engine)
+    start = time.time()
+    for i in range(0, len(data), chunk):
+        p.packetizeData(data[i:i+chunk])
+    dur = time.time() - start
+    copied = p._ring.bytesCopied()
+    print("engine={0} frames={1} stream={2}B chunk={3}B".format(
+        engine, p.n, len(data), chunk))
+    print("bytes copied: {0} total, {1:.2f} per frame".format(copied, float(copied) / p.n))
+    print("decode time: {0:.3f}s ({1:.0f} frames/s)".format(dur, p.n / dur))
+
+if __name__ == "__main__":
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    chunk = int(sys.argv[2]) if len(sys.argv) > 2 else 0x1000
+    engine = sys.argv[3] if len(sys.argv) > 3 else Packetizer.FRAME_ENGINE
+    run(n, chunk, engine)
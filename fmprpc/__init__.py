@@ -2,6 +2,7 @@
 from server import Server, SimpleServer
 from client import Client
 from transport import Transport, RobustTransport, createTransport
+from transport_pool import TransportPool
 from log import Logger
 import address
 from address import InternetAddress, OpenServerAddress, ClosedServerAddress
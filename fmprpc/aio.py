@@ -0,0 +1,329 @@
+import socket
+import errno
+import threading
+import collections
+import log
+import ilist
+import address
+import dispatch
+import pool
+import listener
+import server
+import reactor
+import util
+
+##=======================================================================
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+##=======================================================================
+
+class AioTransport (dispatch.Dispatch):
+    """
+    A transport that lives on a reactor.Reactor, rather than on threads
+    of its own.  Its socket is non-blocking: the reactor reads from it as
+    data arrives, and writes drain from an output buffer as the socket
+    has room.  It speaks the same framing as Transport, so either kind of
+    peer can talk to the other.
+
+    Incoming calls run right on the reactor thread, and should reply
+    whenever they like instead of blocking, for instance from the
+    callback of a future they're waiting on.  Hooks that have to block
+    should go to a pool.WorkerPool (see setHandlerPool).
+
+    Outgoing calls are best made with invokeAsync(), which returns a
+    future.Future.  invoke() still works from other threads, but it
+    blocks, so never call it from the reactor thread.
+
+    tcp_opts takes the same options as Transport's, where they make
+    sense, plus:
+
+    reactor -- the reactor.Reactor to run on, or a reactor.ReactorGroup
+        to pick one from; the process-wide one from reactor.getDefault()
+        if not given.
+    """
+
+    def __init__ (self, remote=None, tcp_opts={}, stream=None, log_obj=None,
+                  parent=None, dbgr=None):
+        dispatch.Dispatch.__init__(self, log_obj=None)
+        self._remote = remote
+        self._tcp_opts = tcp_opts
+        if tcp_opts.get("engine"):
+            self.setEngine(tcp_opts["engine"])
+        self._reactor = reactor.choose(tcp_opts.get("reactor"))
+        self._parent = parent
+        self._dbgr = dbgr
+        self._socket = None
+        self._fd = None
+        self._explicit_close = False
+
+        # Output waiting for the socket.  Other threads append to it under
+        # the lock; only the reactor thread ever writes it to the socket,
+        # and takes it off the front.  _out_off is how much of the first
+        # buffer has already gone.
+        self._out = collections.deque()
+        self._out_off = 0
+        self._out_lock = threading.Lock()
+        self._flushing = False
+        self._want_write = False
+
+        self.setLogger(log_obj)
+        if self._parent:
+            self._node = ilist.Node(self)
+        if stream:
+            self.activateStream(stream)
+
+    ##-----------------------------------------
+
+    def serverListNode (self): return self._node
+    def remote (self): return self._remote
+    def isConnected (self): return not not self._socket
+    def getReactor (self): return self._reactor
+    def authenticatedUsername (self): return None
+
+    ##-----------------------------------------
+
+    def setLogger (self, o):
+        if not o:
+            o = log.newDefaultLogger()
+        log.Base.setLogger(self, o)
+        o.setRemote(self.remote())
+
+    ##-----------------------------------------
+
+    def connect (self):
+        """
+        Connect to the remote address, and start reading on the reactor.
+        The connect itself blocks, so don't call this from the reactor
+        thread.
+        """
+        if self.isConnected():
+            return True
+        s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            s.connect(tuple(self._remote))
+        except socket.error as e:
+            self.warn("Error in connection to {0}: {1}".format(str(self._remote), e))
+            s.close()
+            return False
+        return self.activateStream(s)
+
+    ##-----------------------------------------
+
+    def activateStream (self, s):
+        self.info("connection established in activateStream")
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        s.setblocking(False)
+        self._socket = s
+        self._fd = s.fileno()
+        self._reactor.register(self._fd, self, reactor.Reactor.READ)
+        return True
+
+    ##-----------------------------------------
+
+    def close (self):
+        """Close the connection, from any thread."""
+        self._explicit_close = True
+        self._reactor.callSoon(self.__close)
+
+    ##-----------------------------------------
+
+    def __close (self):
+        s = self._socket
+        if not s:
+            return
+        self._socket = None
+        self._reactor.unregister(self._fd)
+        self._out_lock.acquire()
+        self._out = collections.deque()
+        self._out_off = 0
+        self._out_lock.release()
+        try:
+            s.close()
+        except socket.error:
+            pass
+        self.dispatchReset()
+        self.packetizerReset()
+        if self._parent and self._node:
+            self._parent.removeChild(self)
+            self._node.clear()
+            self._node = None
+
+    ##-----------------------------------------
+
+    def onReadable (self):
+        """Called on the reactor thread when the socket has data (or EOF)."""
+        s = self._socket
+        if not s:
+            return
+        asm = self.packetizeTarget()
+        arena = self._reactor.arena
+        buf = asm.target() if asm else arena.target()
+        try:
+            n = s.recv_into(buf)
+        except socket.error as e:
+            if e.errno in _WOULD_BLOCK:
+                return
+            self.error("Error on read: {0}".format(e))
+            n = 0
+        if not n:
+            if not self._explicit_close:
+                self.info("EOF on transport")
+            self.__close()
+        elif asm:
+            self.packetizeAssembled(asm, n)
+        else:
+            self.packetizeData(buf[0:n], borrowed = True)
+            arena.adapt(n)
+
+    ##-----------------------------------------
+
+    def onWritable (self):
+        self.__flush()
+
+    ##-----------------------------------------
+
+    def rawWritev (self, bufs):
+        """
+        Queue up the buffers and have the reactor write them out; return
+        False if we're not connected.  Never blocks, so it's fine from
+        any thread.  Whatever piles up before the reactor gets around to
+        it goes out in one send.
+        """
+        self._out_lock.acquire()
+        ok = self.isConnected()
+        kick = False
+        if ok:
+            self._out.extend(bufs)
+            kick = not self._flushing
+            self._flushing = True
+        self._out_lock.release()
+        if kick:
+            self._reactor.callSoon(self.__flush)
+        elif not ok:
+            self.warn("write attempt with no active stream")
+        return ok
+
+    def rawWrite (self, msg):
+        return self.rawWritev([ msg ])
+
+    # About the most we join up from small buffers for one send
+    SEND_CHUNK = 0x40000
+
+    ##-----------------------------------------
+
+    def __flush (self):
+        s = self._socket
+        if not s:
+            return
+        self._out_lock.acquire()
+        out = self._out
+        data = util.nextSend(out, self._out_off, self.SEND_CHUNK) if out else None
+        self._out_lock.release()
+
+        n = 0
+        if data is not None:
+            try:
+                n = s.send(data)
+            except socket.error as e:
+                if e.errno not in _WOULD_BLOCK:
+                    self.error("Error on write: {0}".format(e))
+                    self.__close()
+                    return
+
+        self._out_lock.acquire()
+        if out is self._out:
+            self._out_off = util.consumeSent(out, self._out_off, n)
+        more = not not self._out
+        self._flushing = more
+        self._out_lock.release()
+
+        # Wait for room in the socket before sending whatever's left
+        if more != self._want_write:
+            self._want_write = more
+            ev = reactor.Reactor.READ
+            if more:
+                ev |= reactor.Reactor.WRITE
+            self._reactor.modify(self._fd, ev)
+
+    ##-----------------------------------------
+
+    def packetizeError (self, e):
+        self.error("In packetizer: {0}".format(e))
+        self.__close()
+
+    ##-----------------------------------------
+
+    def runHandler (self, handler, bundle):
+        """Hooks run right on the reactor thread, unless there's a
+        pool to send them to."""
+        if self._handler_pool or pool.processTarget(handler):
+            dispatch.Dispatch.runHandler(self, handler, bundle)
+        else:
+            self._runHook(handler, bundle)
+
+##=======================================================================
+
+class AioListener (listener.Listener):
+    """
+    A Listener that accepts on a reactor.Reactor, and makes an
+    AioTransport for each new connection.  listen() returns as soon as
+    it's listening, rather than running an accept loop.  Pass the
+    reactor in tcp_opts, as for AioTransport.
+    """
+
+    def defaultTransportClass (self):
+        return AioTransport
+
+    def listen (self, cond=None, queue_len=1000):
+        s = self._bindAndListen(queue_len)
+        if not s:
+            return False
+        s.setblocking(False)
+        self._tcp_server = s
+        self._reactor = reactor.choose(self._tcp_opts.get("reactor"))
+        self._reactor.register(s.fileno(), self, reactor.Reactor.READ)
+        if cond:
+            cond.acquire()
+            cond.notify()
+            cond.release()
+        return True
+
+    def onReadable (self):
+        while self._tcp_server:
+            try:
+                (sock, addr) = self._tcp_server.accept()
+            except socket.error as e:
+                if e.errno not in _WOULD_BLOCK:
+                    self.warn("Accept error: {0}".format(e))
+                break
+            self._gotNewConnection(sock, address.InternetAddress(tup=addr))
+
+    def onWritable (self):
+        pass
+
+    def close (self):
+        # Stop polling the socket before we close it, on the reactor thread
+        s = self._tcp_server
+        if s:
+            r = self._reactor
+            def op():
+                r.unregister(s.fileno())
+                listener.Listener.close(self)
+            r.callSoon(op)
+
+##=======================================================================
+
+class AioServer (AioListener, server.Server):
+    """A server.Server on a reactor."""
+    pass
+
+class AioSimpleServer (AioListener, server.SimpleServer):
+    """A server.SimpleServer on a reactor."""
+    pass
+
+class AioContextualServer (AioListener, server.ContextualServer):
+    """A server.ContextualServer on a reactor."""
+    pass
+
+##=======================================================================
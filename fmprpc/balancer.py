@@ -0,0 +1,129 @@
+import random
+import time
+import log
+import transport
+import future
+
+##=======================================================================
+
+class Endpoint (object):
+    """One of a Balancer's backends, and what we know about how it's doing."""
+
+    def __init__ (self, t, alpha):
+        self.transport = t
+        self.latency = 0.0
+        self.n_calls = 0
+        self._alpha = alpha
+
+    def isUp (self):
+        # A RobustTransport off in its reconnect loop isn't connected
+        return self.transport.isConnected()
+
+    def record (self, dur):
+        self.n_calls += 1
+        if self.n_calls == 1:
+            self.latency = dur
+        else:
+            self.latency += self._alpha * (dur - self.latency)
+
+    def cost (self, floor):
+        return (self.transport.outstanding() + 1) * max(self.latency, floor)
+
+##=======================================================================
+
+class Balancer (log.Base):
+    """
+    Spreads calls over several replicas of a service, one RobustTransport
+    apiece.  Hand it to a Client wherever a transport goes.
+
+    Each call picks two of the endpoints that are up at random, and goes
+    to the one with the lower cost: its calls outstanding (plus one) times
+    its average latency.  The average is an EWMA over replies, weighted by
+    alpha.  Endpoints that are down, or reconnecting, get no calls until
+    they're back.  If a call can't even be sent, it fails over to another
+    endpoint; calls that were sent are never retried, since the server
+    might have acted on them.
+
+    remotes -- a list of InternetAddresses.
+
+    Other keyword arguments go to the RobustTransports.
+    """
+
+    # Latency assumed for an endpoint that hasn't replied yet, or that's
+    # implausibly fast, so its cost still goes up with its load.
+    MIN_LATENCY = 0.0001
+
+    def __init__ (self, remotes, alpha=0.2, tcp_opts={}, log_obj=None, **kwargs):
+        if not log_obj:
+            log_obj = log.newDefaultLogger()
+        log.Base.__init__(self, log_obj)
+        self._endpoints = [ Endpoint(transport.RobustTransport(remote = r,
+                                tcp_opts = tcp_opts, **kwargs), alpha)
+                            for r in remotes ]
+
+    ##-----------------------------------------
+
+    def endpoints (self): return list(self._endpoints)
+
+    def isConnected (self):
+        return any([ e.isUp() for e in self._endpoints ])
+
+    def connect (self):
+        """Connect to all the endpoints; return True if any are up.
+        Those that aren't keep trying in the background."""
+        for e in self._endpoints:
+            e.transport.connect()
+        return self.isConnected()
+
+    def close (self):
+        for e in self._endpoints:
+            e.transport.close()
+
+    ##-----------------------------------------
+
+    def __pick (self, exclude):
+        up = [ e for e in self._endpoints if e.isUp() and e not in exclude ]
+        if len(up) > 2:
+            up = random.sample(up, 2)
+        if not up:
+            return None
+        return min(up, key = lambda e: e.cost(self.MIN_LATENCY))
+
+    ##-----------------------------------------
+
+    def invokeAsync (self, program=None, method=None, arg=None, notify=False,
+                     timeout=None):
+        """Like Transport.invokeAsync(), on a well-chosen endpoint."""
+        tried = []
+        ret = None
+        while not ret:
+            e = self.__pick(tried)
+            if not e:
+                ret = future.Future()
+                ret.complete(error = "no endpoints available")
+                break
+            tried.append(e)
+            start = time.time()
+            # Don't wait on one that's just gone down; there are others
+            f = e.transport.invokeAsync(program = program, method = method,
+                                        arg = arg, notify = notify, timeout = timeout,
+                                        queue = False)
+            # A call that couldn't be sent fails right away; try elsewhere
+            if f.done() and not f.wasSent():
+                self.info("Failing over from {0}: {1}".format(e.transport.remote(),
+                                                              f.error()))
+            else:
+                if not notify:
+                    f.addCallback(lambda f, e=e, start=start:
+                                  e.record(time.time() - start))
+                ret = f
+        return ret
+
+    ##-----------------------------------------
+
+    def invoke (self, program=None, method=None, arg=None, notify=False,
+                timeout=None):
+        return self.invokeAsync(program = program, method = method,
+                                arg = arg, notify = notify, timeout = timeout).result()
+
+##=======================================================================
@@ -0,0 +1,259 @@
+import threading
+import time
+import log
+import future
+import timer
+
+##=======================================================================
+
+# A batch of calls to method m goes out as one call to m + BATCH_SUFFIX
+BATCH_SUFFIX = "_batch"
+
+def batchMethod (method):
+    return method + BATCH_SUFFIX
+
+##=======================================================================
+
+def batchHook (fn):
+    """
+    Make a server hook that answers a whole batch of calls at once, for
+    the BatchingClient below.  fn gets the list of the calls' args, and
+    returns a list of results in the same order; an Exception in place
+    of a result fails just that call, with the exception's message as its
+    error.  If fn raises, the whole batch fails.  Name the hook after the
+    method, plus BATCH_SUFFIX:
+
+        @batching.batchHook
+        def h_get_batch (self, keys):
+            return [ self.lookup(k) for k in keys ]
+
+    Decorates plain functions and methods alike.
+    """
+    def hook (*args):
+        b = args[-1]
+        try:
+            res = fn(*(args[:-1] + (b.arg,)))
+            if len(res) != len(b.arg):
+                raise ValueError("batch of {0} got {1} results".format(
+                    len(b.arg), len(res)))
+            out = []
+            for r in res:
+                if isinstance(r, Exception):
+                    out.append([ str(r), None ])
+                else:
+                    out.append([ None, r ])
+        except Exception as e:
+            b.error(str(e))
+        else:
+            b.reply(out)
+    hook.__name__ = fn.__name__
+    hook.__doc__ = fn.__doc__
+    return hook
+
+##=======================================================================
+
+class _Batch (object):
+    """Calls that went out together, and how many still want the reply."""
+
+    def __init__ (self, calls):
+        self.calls = calls
+        self.left = len(calls)
+        self.inner = None
+
+##=======================================================================
+
+class BatchingClient (log.Base):
+    """
+    Like a Client, but gathers up calls to the same method and sends them
+    as one batched call, which saves a frame, a write and a server-side
+    dispatch per call.  Good for lots of tiny lookups.  The server needs a
+    batchHook (above) for each method called this way.
+
+    A method's batch goes out once it has max_batch calls in it, or window
+    seconds after its first call, whichever comes first.  With window=None,
+    only a full batch, or flush(), sends it.  Each call still gets its own
+    Future, with its own result or error.  Cancelling one takes the call
+    out of its batch if it hasn't gone yet; a batch that's out is only
+    cancelled once all of its calls are.  A call's timeout works the
+    same way, and a batch whose calls all have one carries the latest of
+    them to the server as its own.
+    """
+
+    def __init__ (self, transport, program=None, window=0.001, max_batch=64,
+                  log_obj=None):
+        self._transport = transport
+        self._program = program
+        self._window = window
+        self._max_batch = max_batch
+        self._pending = {}
+        self._deadlines = {}
+        self._cond = threading.Condition()
+        self._flusher = None
+        self._closed = False
+        if not log_obj:
+            log_obj = log.newDefaultLogger()
+        log.Base.__init__(self, log_obj)
+
+    ##-----------------------------------------
+
+    def invokeAsync (self, method, arg, timeout=None):
+        """Queue up a call, and return a future.Future for its reply."""
+        f = future.Future()
+        full = None
+        self._cond.acquire()
+        if self._closed:
+            self._cond.release()
+            f.complete(error = "client closed")
+            return f
+        # [ arg, future, the _Batch it went out in, deadline, timer entry ]
+        call = [ arg, f, None, None, None ]
+        f.setCanceller(lambda: self.__leave(method, call, "cancelled"))
+        if timeout is not None:
+            call[3] = time.time() + timeout
+            call[4] = timer.schedule(timeout, lambda: self.__leave(method, call,
+                "timed out after {0}s".format(timeout)))
+        calls = self._pending.setdefault(method, [])
+        calls.append(call)
+        if len(calls) >= self._max_batch:
+            full = self.__take(method)
+        elif len(calls) == 1 and self._window is not None:
+            self._deadlines[method] = time.time() + self._window
+            self.__startFlusher()
+            self._cond.notify()
+        self._cond.release()
+        if full:
+            self.__send(method, full)
+        return f
+
+    def invoke (self, method, arg, timeout=None):
+        return self.invokeAsync(method, arg, timeout).result()
+
+    ##-----------------------------------------
+
+    def flush (self):
+        """Send everything that's queued up, right now."""
+        self._cond.acquire()
+        batches = [ (m, self.__take(m)) for m in self._pending.keys() ]
+        self._cond.release()
+        for (m, calls) in batches:
+            self.__send(m, calls)
+
+    def close (self):
+        """Send what's queued, and stop taking new calls.  Doesn't close
+        the transport."""
+        self._cond.acquire()
+        self._closed = True
+        self._cond.notify()
+        flusher = self._flusher
+        self._cond.release()
+        if flusher and flusher is not threading.currentThread():
+            flusher.join()
+        self.flush()
+
+    ##-----------------------------------------
+
+    def __take (self, method):
+        # Call with the lock held
+        self._deadlines.pop(method, None)
+        b = _Batch(self._pending.pop(method, []))
+        for c in b.calls:
+            c[2] = b
+        return b
+
+    def __leave (self, method, call, error):
+        """
+        One caller stops waiting: its call comes out of its batch if that
+        hasn't gone yet.  Once the last of a batch that's out leaves, give
+        up on the batch, too.
+        """
+        if call[4]:
+            call[4].cancel()
+        if not call[1].complete(error = error):
+            return
+        inner = None
+        self._cond.acquire()
+        b = call[2]
+        if b is None:
+            calls = self._pending[method]
+            calls[:] = [ c for c in calls if c is not call ]
+            if not calls:
+                self._pending.pop(method)
+                self._deadlines.pop(method, None)
+        else:
+            b.left -= 1
+            if not b.left:
+                inner = b.inner
+        self._cond.release()
+        if inner:
+            inner.cancel()
+
+    def __startFlusher (self):
+        # Call with the lock held
+        if not self._flusher:
+            self._flusher = threading.Thread(target = self.__flushLoop)
+            self._flusher.daemon = True
+            self._flusher.start()
+
+    def __flushLoop (self):
+        self._cond.acquire()
+        while not self._closed:
+            now = time.time()
+            due = [ m for (m, d) in self._deadlines.items() if d <= now ]
+            if due:
+                batches = [ (m, self.__take(m)) for m in due ]
+                self._cond.release()
+                for (m, calls) in batches:
+                    self.__send(m, calls)
+                self._cond.acquire()
+            elif self._deadlines:
+                self._cond.wait(min(self._deadlines.values()) - now)
+            else:
+                self._cond.wait()
+        self._cond.release()
+
+    ##-----------------------------------------
+
+    def __send (self, method, b):
+        if not b.calls:
+            return
+        # Good until the last of its callers gives up, if they all will
+        deadlines = [ c[3] for c in b.calls ]
+        timeout = None
+        if None not in deadlines:
+            timeout = max(max(deadlines) - time.time(), 0)
+        f = self._transport.invokeAsync(program = self._program,
+                                        method = batchMethod(method),
+                                        arg = [ c[0] for c in b.calls ],
+                                        notify = False, timeout = timeout)
+        self._cond.acquire()
+        b.inner = f
+        gone = not b.left
+        self._cond.release()
+        if gone:
+            f.cancel()
+        f.addCallback(lambda f, b=b: self.__fanOut(f, b.calls))
+
+    def __fanOut (self, f, calls):
+        (e, res) = f.pair()
+        if not e and not self.__wellFormed(res, len(calls)):
+            e = "bad batch reply"
+        for c in calls:
+            if c[4]:
+                c[4].cancel()
+        if e:
+            for c in calls:
+                c[1].complete(error = e)
+        else:
+            for (c, (ce, cr)) in zip(calls, res):
+                c[1].complete(error = ce, result = cr)
+
+    def __wellFormed (self, res, n):
+        """Is res n [ error, result ] pairs, as a batchHook sends back?"""
+        if not isinstance(res, (list, tuple)) or len(res) != n:
+            return False
+        for r in res:
+            if not isinstance(r, (list, tuple)) or len(r) != 2:
+                return False
+        return True
+
+##=======================================================================
@@ -0,0 +1,265 @@
+import collections
+import threading
+import time
+import msgpack
+import log
+import pool
+from future import Future
+from util import canonicalPack
+
+##=======================================================================
+
+def cached (hook=None, ttl=None):
+    """
+    Mark a handler hook as a pure function of its arg, whose replies can
+    be served from the ResponseCache (see Listener.setResponseCache).  Use
+    it bare, or as cached(ttl=secs) to override the cache's TTL for this
+    method.  Only successful replies are cached.  Like pool.inline,
+    decorate the function itself, not a bound method.
+    """
+    if hook is None:
+        return lambda h: cached(h, ttl)
+    hook.fmprpc_cached = True
+    hook.fmprpc_cache_ttl = ttl
+    return hook
+
+def isCached (hook):
+    return getattr(hook, "fmprpc_cached", False)
+
+def cacheTtl (hook):
+    return getattr(hook, "fmprpc_cache_ttl", None)
+
+##=======================================================================
+
+class ResponseCache (log.Base):
+    """
+    The already-encoded replies to calls of cached hooks, keyed on the
+    method and the call's arg, so that a repeat call goes right back out
+    without running the hook or packing its result again.  Entries expire
+    after ttl seconds; past max_bytes of replies, or max_entries of them,
+    the least recently used go first.  Many listeners can share one.
+
+    The counters (see stats()) are hits, misses, evictions (for room) and
+    expirations.  CachingClient, below, keeps its results in one too.
+    """
+
+    def __init__ (self, max_bytes=64*1024*1024, max_entries=None, ttl=60,
+                  log_obj=None):
+        self._max_bytes = max_bytes
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        if not log_obj:
+            log_obj = log.newDefaultLogger()
+        log.Base.__init__(self, log_obj)
+
+    ##-----------------------------------------
+
+    def get (self, key):
+        """The packed reply for key, or None."""
+        now = time.time()
+        self._lock.acquire()
+        e = self._entries.pop(key, None)
+        if e is None:
+            self.misses += 1
+            ret = None
+        elif e[0] <= now:
+            self.__forget(key, e)
+            self.expirations += 1
+            self.misses += 1
+            ret = None
+        else:
+            # Back in at the most recently used end
+            self._entries[key] = e
+            self.hits += 1
+            ret = e[1]
+        self._lock.release()
+        return ret
+
+    def put (self, key, packed, ttl=None):
+        if ttl is None:
+            ttl = self._ttl
+        size = len(key) + len(packed)
+        if size > self._max_bytes:
+            return
+        self._lock.acquire()
+        old = self._entries.pop(key, None)
+        if old:
+            self.__forget(key, old)
+        self._entries[key] = (time.time() + ttl, packed)
+        self._bytes += size
+        while (self._bytes > self._max_bytes or
+               (self._max_entries and len(self._entries) > self._max_entries)):
+            (k, e) = self._entries.popitem(last = False)
+            self.__forget(k, e)
+            self.evictions += 1
+        self._lock.release()
+
+    def invalidate (self, key):
+        self._lock.acquire()
+        e = self._entries.pop(key, None)
+        if e:
+            self.__forget(key, e)
+        self._lock.release()
+
+    def invalidatePrefix (self, prefix):
+        """Drop all the entries whose keys start with prefix."""
+        self._lock.acquire()
+        for k in [ k for k in self._entries.keys() if k.startswith(prefix) ]:
+            self.__forget(k, self._entries.pop(k))
+        self._lock.release()
+
+    def __forget (self, key, e):
+        # Call with the lock held, once the entry is out of the table
+        self._bytes -= len(key) + len(e[1])
+
+    ##-----------------------------------------
+
+    def clear (self):
+        self._lock.acquire()
+        self._entries.clear()
+        self._bytes = 0
+        self._lock.release()
+
+    def stats (self):
+        self._lock.acquire()
+        ret = { "hits" : self.hits, "misses" : self.misses,
+                "evictions" : self.evictions, "expirations" : self.expirations,
+                "entries" : len(self._entries), "bytes" : self._bytes }
+        self._lock.release()
+        return ret
+
+##=======================================================================
+
+# The notification a server sends to a CachingClient to drop entries
+INVALIDATE_METHOD = "fmprpc.invalidate"
+
+def cacheKey (method, arg):
+    return method + "\0" + canonicalPack(arg)
+
+def pushInvalidation (transport, program=None, method=None, arg=None):
+    """
+    On the server, tell the CachingClient on the other end of transport
+    to drop its cached result for the given call, or for all calls to
+    method if arg is None, or everything for program if method is None
+    too.
+    """
+    transport.invoke(method = INVALIDATE_METHOD, notify = True, arg = {
+        "program" : program, "method" : method, "arg" : arg })
+
+##=======================================================================
+
+class CachingClient (log.Base):
+    """
+    Like a Client, but remembers the results of calls to the methods given
+    in ttls (a dict of method to seconds), by arg, and answers repeat calls
+    without a round trip until they expire.  The results are kept packed,
+    in a ResponseCache bounded by max_bytes and max_entries, so each
+    caller gets a fresh copy.  Errors aren't cached.
+
+    The server can drop entries early with pushInvalidation(), above,
+    which arrives as a notify on the transport; we handle it right on the
+    reader thread.  Use one CachingClient per transport.  Invalidations
+    sent while the transport was down are lost, so with a RobustTransport
+    the TTL is the bound on staleness.
+    """
+
+    def __init__ (self, transport, program=None, ttls={}, max_bytes=16*1024*1024,
+                  max_entries=None, log_obj=None):
+        self._transport = transport
+        self._program = program
+        self._ttls = dict(ttls)
+        if not log_obj:
+            log_obj = log.newDefaultLogger()
+        log.Base.__init__(self, log_obj)
+        self._cache = ResponseCache(max_bytes = max_bytes, max_entries = max_entries,
+                                    log_obj = log_obj)
+        # Bumped on each invalidation, so a reply to a call made before
+        # one doesn't go into the cache after it.  The lock makes the
+        # bump and its evictions atomic with a reply's check and put.
+        self._generation = 0
+        self._gen_lock = threading.Lock()
+        transport.addHandler(method = INVALIDATE_METHOD, hook = self.__onInvalidate)
+
+    ##-----------------------------------------
+
+    def setTtl (self, method, ttl):
+        """Cache the given method's results for ttl seconds; None to stop."""
+        if ttl is None:
+            self._ttls.pop(method, None)
+            self._cache.invalidatePrefix(method + "\0")
+        else:
+            self._ttls[method] = ttl
+
+    def stats (self):
+        return self._cache.stats()
+
+    ##-----------------------------------------
+
+    def invokeAsync (self, method, arg, timeout=None):
+        """Like Client.invokeAsync(); a hit comes back already done."""
+        ttl = self._ttls.get(method)
+        if ttl is None:
+            return self._transport.invokeAsync(program = self._program,
+                                               method = method, arg = arg,
+                                               timeout = timeout)
+        key = cacheKey(method, arg)
+        packed = self._cache.get(key)
+        if packed is not None:
+            ret = Future()
+            ret.complete(result = msgpack.unpackb(packed))
+            return ret
+        gen = self._generation
+        ret = Future()
+        inner = self._transport.invokeAsync(program = self._program,
+                                            method = method, arg = arg,
+                                            timeout = timeout)
+        ret.setCanceller(inner.cancel)
+        inner.addCallback(lambda f: self.__landed(f, ret, key, ttl, gen))
+        return ret
+
+    def invoke (self, method, arg, timeout=None):
+        return self.invokeAsync(method, arg, timeout).result()
+
+    def notify (self, method, arg):
+        return self._transport.invoke(program = self._program, method = method,
+                                      arg = arg, notify = True)
+
+    ##-----------------------------------------
+
+    def __landed (self, inner, ret, key, ttl, gen):
+        # Into the cache before the caller sees it, so a repeat call hits
+        (e, res) = inner.pair()
+        if not e:
+            packed = msgpack.packb(res)
+            self._gen_lock.acquire()
+            if gen == self._generation:
+                self._cache.put(key, packed, ttl)
+            self._gen_lock.release()
+        ret.complete(error = e, result = res)
+
+    @pool.inline
+    def __onInvalidate (self, b):
+        a = b.arg if isinstance(b.arg, dict) else {}
+        if a.get("program") not in (None, self._program):
+            return
+        method = a.get("method")
+        self._gen_lock.acquire()
+        try:
+            self._generation += 1
+            if method is None:
+                self._cache.clear()
+            elif a.get("arg") is None:
+                self._cache.invalidatePrefix(method + "\0")
+            else:
+                self._cache.invalidate(cacheKey(method, a["arg"]))
+        finally:
+            self._gen_lock.release()
+
+##=======================================================================
@@ -1,15 +1,126 @@
+import threading
+import timer
+from future import Future
+from util import canonicalPack
 
+class _Coalesced (object):
+	"""One call out on the wire, and the callers waiting on its reply."""
+	def __init__ (self):
+		self.inner = None
+		# [ future, timer entry ] for each
+		self.waiters = []
+		# Everyone left before the call even went out
+		self.abandoned = False
 
 class Client (object):
 
 	def __init__ (self, transport, program = None):
 		self._transport = transport
 		self._program = program
+		self._coalesced = set()
+		self._inflight = {}
+		self._lock = threading.Lock()
 
-	def invoke (self, method, arg):
-		return self._transport.invoke(program=self._program, 
-			method=method, arg=arg, notify=False)
+	def setCoalescing (self, method, on = True):
+		"""
+		Coalesce calls to the given method: while a call is out, another with
+		an equal arg doesn't go out on its own, but shares the first one's
+		reply.  Only for methods without side-effects, whose callers can
+		live with a reply to a call made a little before theirs.  Callers
+		share the very same result object, so they mustn't change it.
+		Each caller's timeout is its own, so the shared call goes out
+		without a deadline.
+		"""
+		if on:
+			self._coalesced.add(method)
+		else:
+			self._coalesced.discard(method)
+
+	def invoke (self, method, arg, timeout = None):
+		"""
+		Call method with arg, and wait for the reply.  With a timeout (in
+		seconds), give up after that long with an RpcCallError; the server
+		won't start on a call that's already timed out.
+		"""
+		return self.invokeAsync(method, arg, timeout).result()
+
+	def invokeAsync (self, method, arg, timeout = None):
+		"""Like invoke(), but return a future.Future rather than waiting."""
+		if method in self._coalesced:
+			return self.__coalesce(method, arg, timeout)
+		return self._transport.invokeAsync(program=self._program,
+			method=method, arg=arg, notify=False, timeout=timeout)
+
+	def invokeBatch (self, calls):
+		"""Send a list of (method, arg) calls all at once, and return a list
+		of futures for them; see Dispatch.invokeBatch()."""
+		return self._transport.invokeBatch(program=self._program, calls=calls)
 
 	def notify (self, method, arg):
-		return self._transport.invoke(program=self._program, 
+		return self._transport.invoke(program=self._program,
 			method=method, arg=arg, notify=True)
+
+	def __coalesce (self, method, arg, timeout):
+		key = (method, canonicalPack(arg))
+		f = Future()
+		w = [ f, None ]
+		self._lock.acquire()
+		c = self._inflight.get(key)
+		first = not c
+		if first:
+			c = self._inflight[key] = _Coalesced()
+		c.waiters.append(w)
+		self._lock.release()
+		f.setCanceller(lambda: self.__leave(key, c, w, "cancelled"))
+		if timeout is not None:
+			w[1] = timer.schedule(timeout, lambda: self.__leave(key, c, w,
+				"timed out after {0}s".format(timeout)))
+		if first:
+			inner = self._transport.invokeAsync(program=self._program,
+				method=method, arg=arg, notify=False)
+			self._lock.acquire()
+			c.inner = inner
+			abandoned = c.abandoned
+			self._lock.release()
+			if abandoned:
+				inner.cancel()
+			inner.addCallback(lambda i: self.__landed(key, c, i))
+		return f
+
+	def __leave (self, key, c, w, error):
+		"""
+		One caller stops waiting; the shared call carries on for the rest.
+		Once the last one leaves, give up on the shared call, too.
+		"""
+		inner = None
+		self._lock.acquire()
+		there = w in c.waiters
+		if there:
+			c.waiters.remove(w)
+			if not c.waiters:
+				# Nobody's left for it, so don't let new callers join it
+				if self._inflight.get(key) is c:
+					del self._inflight[key]
+				inner = c.inner
+				c.abandoned = True
+		self._lock.release()
+		if there:
+			if w[1]:
+				w[1].cancel()
+			w[0].complete(error=error)
+		if inner:
+			inner.cancel()
+
+	def __landed (self, key, c, inner):
+		# Out of the table first, so that calls from now on go out afresh
+		self._lock.acquire()
+		if self._inflight.get(key) is c:
+			del self._inflight[key]
+		waiters = c.waiters
+		c.waiters = []
+		self._lock.release()
+		(e, res) = inner.pair()
+		for (f, t) in waiters:
+			if t:
+				t.cancel()
+			f.complete(error=e, result=res)
@@ -21,6 +21,10 @@ class SshStreamWrapper (transport.ClearStreamWrapper):
         self._ssh_channel = None
     def stream (self):
         return self._ssh_channel
+    def supportsRecvInto (self):
+        return False
+    def readableFd (self):
+        return None
     def shutdownStream (self, x, force):
         try:
             if self._ssh_channel:
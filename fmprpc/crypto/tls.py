@@ -15,6 +15,10 @@ class TlsStreamWrapper (transport.ClearStreamWrapper):
     # Read and write to the TLS stream, and not the underlying TCP socket
     def stream (self):
         return self._tls_transport
+    def supportsRecvInto (self):
+        return False
+    def readableFd (self):
+        return None
     def shutdownStream (self, x, force):
         if self._tls_transport:
             self._tls_transport.close()
@@ -2,8 +2,16 @@
 import debug
 from packetizer import Packetizer
 import threading
+import time
 import types
+import itertools
+import weakref
 import err
+import pool
+import cache
+import msgpack
+import timer
+from future import Future
 
 ##=======================================================================
 
@@ -12,12 +20,20 @@ class Bundle (object):
 	An object that is good for just one RPC response on the server-side
 	"""
 
-	def __init__ (self, dispatch, seqid=None, arg={}, method=None):
+	def __init__ (self, dispatch, seqid=None, arg={}, method=None, batch=None,
+			deadline=None):
 		self.dispatch = dispatch
 		self.seqid = seqid
 		self.method = method
 		self.arg = arg
 		self.debug_msg = None
+		self.batch = batch
+		self.deadline = deadline
+		self._cancelled = False
+		self._on_cancel = []
+		self.cache = None
+		self.cache_key = None
+		self.cache_ttl = None
 
 	def reply(self, res): self.__reply(None, res)
 	def error(self, err): self.__reply(err, None)
@@ -27,36 +43,126 @@ class Bundle (object):
 
 	def isCall(self): return not not self.seqid
 
+	def remaining(self):
+		"""Seconds until the caller gives up on us, or None if it won't.
+		Good for passing along as the timeout of calls we make in turn."""
+		if self.deadline is None:
+			return None
+		return self.deadline - time.time()
+
+	def expired(self):
+		return self.deadline is not None and self.deadline <= time.time()
+
+	def isCancelled(self):
+		"""
+		True once the caller has given up on this call, or hung up.  Long
+		hooks can check every so often, and stop early; any reply they
+		make after that goes nowhere.
+		"""
+		return self._cancelled
+
+	def onCancel(self, cb):
+		"""Call cb(bundle) if the call gets cancelled, or right now if it
+		already has been.  It runs on the reader thread, so be quick."""
+		if self._cancelled:
+			self.__runCallback(cb)
+		else:
+			self._on_cancel.append(cb)
+
+	def cancel(self):
+		if self._cancelled:
+			return
+		self._cancelled = True
+		cbs = self._on_cancel
+		self._on_cancel = []
+		for cb in cbs:
+			self.__runCallback(cb)
+		if self.batch:
+			# The rest of its batch still wants an answer
+			self.batch.add(self.seqid, "cancelled", None)
+
+	def __runCallback(self, cb):
+		try:
+			cb(self)
+		except Exception as e:
+			self.dispatch.error("Uncaught exception in cancel callback for {0}: {1}"
+				.format(self.method, e))
+
 	def __reply(self, err, res):
+		# Whichever of us and a cancel gets it out of the table first
+		# has the last word on the call
+		if self.isCall() and not self.dispatch.doneServing(self.seqid):
+			return
 		if self.debug_msg:
 			self.debug_msg.reply(err, res).call()
-		if self.isCall():
+		if not self.isCall():
+			pass
+		elif self.cache and err is None:
+			# Pack it just the once, for the cache and the wire
+			packed = msgpack.packb(res)
+			self.cache.put(self.cache_key, packed, self.cache_ttl)
+			if self.batch:
+				self.batch.add(self.seqid, err, res)
+			else:
+				self.dispatch.replyPacked(self.seqid, packed)
+		elif self.batch:
+			self.batch.add(self.seqid, err, res)
+		else:
 			self.dispatch.reply(self.seqid, err, res)
 
 ##=======================================================================
 
+class BatchReply (object):
+	"""
+	Gathers up the replies to the calls in an incoming BATCH, and sends
+	them back in one BATCH of their own once they're all in.  So a slow
+	call holds up the replies to the rest of its batch.
+	"""
+
+	def __init__ (self, dispatch, n):
+		self.dispatch = dispatch
+		self.n = n
+		self.replies = []
+		self.lock = threading.Lock()
+
+	def add (self, seqid, err, res):
+		self.lock.acquire()
+		self.replies.append([ Dispatch.REPLY, seqid, err, res ])
+		done = (len(self.replies) == self.n)
+		self.lock.release()
+		if done:
+			self.dispatch.sendBatch(self.replies)
+
+##=======================================================================
+
 class Invocation (object):
+	"""
+	An outgoing RPC on the client-side.  start() sends it off, and the
+	reply completes its Future, right on the reader thread.
+	"""
 
-	def __init__ (self, dispatch, seqid, msg, debug_msg, notify):
+	def __init__ (self, dispatch, seqid, msg, debug_msg, notify, timeout=None):
 		self.dispatch = dispatch
 		self.seqid = seqid
 		self.msg = msg
 		self.debug_msg = debug_msg
 		self.notify = notify
-		self.result = None
-		self.error = None
-		self.complete = False
-
-	def lock(self): return self.dispatch._lock
+		self.future = Future()
+		self.itab = None
+		self.timeout = timeout
+		self.timer = None
 
-	def invoke(self):
+	def start(self):
+		"""
+		Send the RPC and return a Future for its reply.  Notifications are
+		done as soon as they're sent.  Note that we don't take the dispatch's
+		lock here; the reader thread needs it, and we'd only slow it down.
+		"""
 		d = self.dispatch
-		self.lock().acquire()
+		d.waitForRoom()
 
 		if self.debug_msg: self.debug_msg.call()
 
-		d.send(self.msg)
-
 		if not self.notify:
 
 			# This is important, to hold onto this _invocations table!
@@ -64,37 +170,80 @@ class Invocation (object):
 			# below), we go through and move the old table out of the way,
 			# reset _invocations in the dispatch object, and THEN cancel all guys
 			# within the original table. Thus, we have to hold onto the original
-			# table, and not the new table, otherwise we'll fail to call del
-			# below.
-			itab = d._invocations
+			# table, and not the new table, otherwise we'll fail to remove
+			# ourselves in reply() below.
+			self.itab = d.registerInvocation(self)
+			self.armCanceller(d)
 
-			itab[self.seqid] = self
-			self.condition = threading.Condition(self.lock())
-			while not self.complete:
-				self.condition.wait()
+		error = None
+		try:
+			if not d.send(self.msg):
+				error = "not connected"
+		except IOError as e:
+			error = "send failed: {0}".format(e)
 
-			# See the comment above, this was the cause of a subtle bug
-			del itab[self.seqid]
+		self.dispatch = None
 
-		if self.debug_msg:
-			self.debug_msg.reply(self.error, self.result).call()
+		if error:
+			self.future.setUnsent()
+		if error or self.notify:
+			self.reply(error = error)
+		return self.future
+
+	def armCanceller(self, d):
+		"""Set up the ways to give up on the call: future.cancel(), and
+		our timeout, if any.  Call once it's registered."""
+		# Don't keep the dispatch alive on account of these
+		dref = weakref.ref(d)
+		abandoned = d._abandoned
+		self.future.setCanceller(
+			lambda: self.__giveUp(dref, abandoned, "cancelled"))
+		if self.timeout is not None:
+			self.timer = timer.schedule(self.timeout, lambda: self.__giveUp(
+				dref, abandoned, "timed out after {0}s".format(self.timeout),
+				on_timer = True))
 
-		self.lock().release()
-		self.dispatch = None
-		return (self.error, self.result)
+	def invoke(self):
+		"""Send the RPC, and block until we get back an (error, result) pair."""
+		return self.start().pair()
 
 	def reply(self, error=None, result=None):
-		self.complete = True
-		self.error = error
-		self.result = result
-		self.condition.notify()
+		# See the comment above, this was the cause of a subtle bug
+		if self.itab is not None:
+			self.itab.pop(self.seqid, None)
+		if self.timer:
+			self.timer.cancel()
+		if self.future.complete(error, result) and self.debug_msg:
+			self.debug_msg.reply(error, result).call()
 
 	##-----------------------------------------
 
 	def cancel (self):
-		self.lock().acquire()
 		self.reply(error = "cancelled")
-		self.lock().release()
+
+	def __giveUp (self, dref, abandoned, error, on_timer=False):
+		"""Stop waiting on the reply, and ask the peer not to bother."""
+		if self.itab is not None and self.seqid in self.itab:
+			# So that the reply, if it ever comes, isn't a surprise
+			abandoned[self.seqid] = True
+			d = dref()
+			if d and on_timer:
+				# The send might block, and the timer thread is everyone's
+				t = threading.Thread(target = self.__cancelRemote,
+					args = (d, abandoned))
+				t.daemon = True
+				t.start()
+			elif d:
+				self.__cancelRemote(d, abandoned)
+			self.reply(error = error)
+
+	def __cancelRemote (self, d, abandoned):
+		seqid = self.seqid
+		# A peer that gets the CANCEL won't reply, unless it already had,
+		# so don't remember the call for long; others might yet reply.
+		# Either way, the reply mustn't hold its place for ever.
+		ttl = d.CANCEL_GRACE if d.sendCancel(seqid) else d.ABANDONED_TTL
+		timer.schedule(ttl, lambda: abandoned.pop(seqid, None))
 
 ##=======================================================================
 
@@ -106,16 +255,42 @@ class Dispatch (Packetizer):
 	INVOKE = 0
 	REPLY = 1
 	NOTIFY = 2
+	BATCH = 3
+	CANCEL = 4
+
+	# Peers say what they speak with a call to HELLO_METHOD when we first
+	# need to know; peers that don't have it don't speak any extensions.
+	HELLO_METHOD = "fmprpc.hello"
+	VERSION = 2
+	FEATURES = [ "batch", "deadline", "cancel" ]
+
+	# How many seconds to keep expecting a late reply to a call we gave
+	# up on: one we sent a CANCEL for, and one we couldn't
+	CANCEL_GRACE = 5
+	ABANDONED_TTL = 300
+
+	# How long peerFeatures() waits for the peer to say
+	HELLO_TIMEOUT = 10
 
 	##-----------------------------------------
 
 	def __init__ (self, log_obj):
 		Packetizer.__init__(self, log_obj)
 		self._invocations = {}
+		self._itab_lock = threading.Lock()
 		self._handlers = {}
-		self._seqid = 1
+		self._seqids = itertools.count(1)
 		self._dbgr = None
 		self._lock = threading.RLock()
+		self._handler_pool = None
+		self._process_pool = None
+		self._peer_features = None
+		self._hello = None
+		self._response_cache = None
+		self._abandoned = {}
+		self._serving = {}
+		# Unbound, so we don't hold a reference to ourselves; see getHandler()
+		self.addHandler(self.HELLO_METHOD, Dispatch.__hello)
 
 	##-----------------------------------------
 
@@ -123,10 +298,55 @@ class Dispatch (Packetizer):
 
 	##-----------------------------------------
 
+	def setHandlerPool (self, p):
+		"""
+		Run incoming calls on the given pool.WorkerPool, rather than on
+		a new thread apiece.
+		"""
+		self._handler_pool = p
+
+	##-----------------------------------------
+
+	def setProcessPool (self, p):
+		"""
+		Run hooks made with pool.inProcess() on the given pool.ProcessPool.
+		"""
+		self._process_pool = p
+
+	##-----------------------------------------
+
+	def setResponseCache (self, c):
+		"""
+		Serve calls to hooks marked with cache.cached() from the given
+		cache.ResponseCache, when we can.
+		"""
+		self._response_cache = c
+
+	##-----------------------------------------
+
 	def __nextSeqid (self):
-		ret = self._seqid
-		self._seqid += 1
-		return ret
+		# Callers on different threads mustn't ever get the same seqid;
+		# next() on an itertools.count is atomic, so no lock is needed.
+		return next(self._seqids)
+
+	##-----------------------------------------
+
+	def registerInvocation (self, i):
+		"""
+		Put the Invocation i into the table of outstanding calls, and return
+		that table.  The lock is just so we can't race with dispatchReset().
+		"""
+		self._itab_lock.acquire()
+		itab = self._invocations
+		itab[i.seqid] = i
+		self._itab_lock.release()
+		return itab
+
+	##-----------------------------------------
+
+	def outstanding (self):
+		"""The number of our calls still waiting on a reply."""
+		return len(self._invocations)
 
 	##-----------------------------------------
 
@@ -144,21 +364,55 @@ class Dispatch (Packetizer):
 
 		if len(msg) < 2:
 			self.warn("Bad input packet: len={0}".format(len(msg)))
+		elif msg[0] is self.BATCH:
+			self.__dispatchBatch(msg[1])
 		else:
-			typ = msg.pop(0)
-			if typ is self.INVOKE:
-				[ seqid, method, arg ] = msg
-				bundle = Bundle (dispatch = self, seqid = seqid, arg = arg, method = method)
-				self.__serve (bundle)
-			elif typ is self.NOTIFY:
-				[ method, arg ] = msg
-				bundle = Bundle (dispatch = self, arg = arg, method = method)
-				self.__serve (bundle)
-			elif typ is self.REPLY:
-				[ seqid, error, result ] = msg
-				self.__awaken(seqid = seqid, error = error, result = result)
-			else:
-				self.warn("Unknown message type: {0}".format(typ))
+			self.__dispatchOne(msg, None)
+
+	##-----------------------------------------
+
+	def __dispatchOne (self, msg, batch):
+		typ = msg.pop(0)
+		if typ is self.INVOKE:
+			# An optional 4th field is how many ms the caller will wait
+			[ seqid, method, arg ] = msg[0:3]
+			deadline = None
+			if len(msg) > 3 and msg[3] is not None:
+				deadline = time.time() + msg[3] / 1000.0
+			bundle = Bundle (dispatch = self, seqid = seqid, arg = arg,
+				method = method, batch = batch, deadline = deadline)
+			self._serving[seqid] = bundle
+			self.__serve (bundle)
+		elif typ is self.NOTIFY:
+			[ method, arg ] = msg
+			bundle = Bundle (dispatch = self, arg = arg, method = method)
+			self.__serve (bundle)
+		elif typ is self.REPLY:
+			[ seqid, error, result ] = msg
+			self.__awaken(seqid = seqid, error = error, result = result)
+		elif typ is self.CANCEL:
+			b = self._serving.pop(msg[0], None)
+			if b:
+				self.debug("Call to {0} cancelled".format(b.method))
+				b.cancel()
+		else:
+			self.warn("Unknown message type: {0}".format(typ))
+
+	##-----------------------------------------
+
+	def __dispatchBatch (self, msgs):
+		"""
+		A BATCH carries a list of INVOKEs and NOTIFYs, or a list of REPLYs to
+		them.  The replies to the calls in a batch go back in one BATCH too.
+		"""
+		if not isinstance(msgs, (list, tuple)):
+			self.warn("Bad batch: {0}".format(type(msgs)))
+			return
+		msgs = [ m for m in msgs if isinstance(m, list) and len(m) >= 2 ]
+		n_calls = len([ m for m in msgs if m[0] is self.INVOKE ])
+		batch = BatchReply(self, n_calls) if n_calls else None
+		for m in msgs:
+			self.__dispatchOne(m, batch)
 
 	##-----------------------------------------
 
@@ -167,16 +421,42 @@ class Dispatch (Packetizer):
 		For the RPC with the given seqid, respond with the (err,res) pair.
 		"""
 		msg = [ self.REPLY, seqid, err, res ]
-		self._lock.acquire()
+		self.waitForRoom()
 		self.send(msg)
-		self._lock.release()
+
+	def replyPacked (self, seqid, packed):
+		"""Reply to seqid with a result that's already packed."""
+		self.waitForRoom()
+		self.sendPrepacked([ self.REPLY, seqid, None ], packed)
+
+	def sendCancel (self, seqid):
+		"""Ask the peer to stop work on our call seqid, if it can; return
+		True if we did."""
+		if self.__peerKnows("cancel"):
+			try:
+				return self.send([ self.CANCEL, seqid ])
+			except IOError:
+				pass
+		return False
+
+	def doneServing (self, seqid):
+		"""Forget about the peer's call seqid, and say if it was still on."""
+		return self._serving.pop(seqid, None) is not None
+
+	def sendBatch (self, msgs):
+		"""Send the given messages all in one BATCH frame."""
+		self.waitForRoom()
+		return self.send([ self.BATCH, msgs ])
 
 	##-----------------------------------------
 
 	def __awaken (self, seqid, error = None, result = None):
-		try:
-			self._invocations[seqid].reply(error, result)
-		except KeyError:
+		i = self._invocations.get(seqid)
+		if i:
+			i.reply(error, result)
+		elif self._abandoned.pop(seqid, None):
+			self.debug("Reply to {0} came after we gave up on it".format(seqid))
+		else:
 			self.warn("Unknow seqid in awaken: {0}".format(seqid))
 
 	##-----------------------------------------
@@ -186,19 +466,21 @@ class Dispatch (Packetizer):
 
 	##-----------------------------------------
 	
-	def newInvocation(self, program=None, method=None, arg=None, notify=False):
+	def newInvocation(self, program=None, method=None, arg=None, notify=False,
+			timeout=None):
 
 		method = self.makeMethod(program, method)
 		seqid = self.__nextSeqid()
 
 		if notify:
-			typ = dispatch.NOTIFY
+			msg = [ self.NOTIFY, method, arg ]
 			dtyp = debug.Type.CLIENT_NOTIFY
+			timeout = None
 		else:
-			typ = self.INVOKE
+			msg = [ self.INVOKE, seqid, method, arg ]
 			dtyp = debug.Type.CLIENT_CALL
-
-		msg = [ typ, seqid, method, arg ]
+			if timeout is not None and self.__peerKnows("deadline"):
+				msg.append(int(timeout * 1000))
 
 		if self._dbgr:
 			debug_msg = self._dbgr.newMessage(
@@ -213,25 +495,146 @@ class Dispatch (Packetizer):
 		else:
 			debug_msg = None
 
-		return Invocation(self, seqid, msg, debug_msg, notify)
+		return Invocation(self, seqid, msg, debug_msg, notify, timeout)
 
 	##-----------------------------------------
 	
-	def invoke (self, program=None, method=None, arg=None, notify=False):
-		i = self.newInvocation(program=program, method=method, arg=arg, notify=notify)
-		e,res = i.invoke()
-		if e: raise err.RpcCallError(e)
-		return res
+	def invokeAsync (self, program=None, method=None, arg=None, notify=False,
+			timeout=None):
+		"""
+		Send off an RPC without waiting for it, and return a future.Future
+		for its reply.  With a timeout (in seconds), the future fails if
+		there's no reply in that long, and the peer, if it speaks deadlines,
+		doesn't bother to serve a call that's waited longer than that.
+		"""
+		i = self.newInvocation(program=program, method=method, arg=arg,
+			notify=notify, timeout=timeout)
+		return i.start()
+
+	##-----------------------------------------
+	
+	def invoke (self, program=None, method=None, arg=None, notify=False,
+			timeout=None):
+		f = self.invokeAsync(program=program, method=method, arg=arg,
+			notify=notify, timeout=timeout)
+		return f.result()
+
+	##-----------------------------------------
+
+	def invokeBatch (self, program=None, calls=[], notify=False):
+		"""
+		Send off a list of (method, arg) calls in one BATCH frame, and return
+		a list of Futures for their replies, in the same order.  If the peer
+		doesn't speak BATCH, or we're still asking it, send them one at a
+		time instead.  It never waits on the peer, so it's fine to call
+		from a callback or an inline hook.
+		"""
+		if not self.__peerKnows("batch"):
+			return [ self.invokeAsync(program=program, method=m, arg=a, notify=notify)
+				for (m, a) in calls ]
+		invs = [ self.newInvocation(program=program, method=m, arg=a, notify=notify)
+			for (m, a) in calls ]
+		if not notify:
+			# One trip through the lock for the whole batch
+			self._itab_lock.acquire()
+			itab = self._invocations
+			for i in invs:
+				itab[i.seqid] = i
+				i.itab = itab
+			self._itab_lock.release()
+			for i in invs:
+				i.armCanceller(self)
+		for i in invs:
+			if i.debug_msg: i.debug_msg.call()
+		error = None
+		try:
+			if not self.sendBatch([ i.msg for i in invs ]):
+				error = "not connected"
+		except IOError as e:
+			error = "send failed: {0}".format(e)
+		for i in invs:
+			i.dispatch = None
+			if error:
+				i.future.setUnsent()
+			if error or notify:
+				i.reply(error = error)
+		return [ i.future for i in invs ]
+
+	##-----------------------------------------
+
+	@pool.inline
+	def __hello (self, bundle):
+		bundle.reply({ "version" : self.VERSION, "features" : self.FEATURES })
+
+	def __sayHello (self):
+		return self.invokeAsync(method=self.HELLO_METHOD, arg={
+			"version" : self.VERSION, "features" : self.FEATURES })
+
+	def __probe (self):
+		"""The Future for our hello to the peer, sending it if it isn't
+		already out."""
+		f = self._hello
+		if not f:
+			f = self._hello = self.__sayHello()
+			f.addCallback(self.__heardHello)
+		return f
+
+	def __heardHello (self, f):
+		if self._hello is f:
+			self._hello = None
+		(e, res) = f.pair()
+		if not e and isinstance(res, dict):
+			self._peer_features = list(res.get("features", []))
+		elif isinstance(e, basestring) and e.startswith("unknown method"):
+			# An older peer
+			self._peer_features = []
+		# Otherwise we couldn't ask; maybe next time
+
+	def peerFeatures (self):
+		"""
+		The protocol extensions the peer speaks, as a list of strings.  We
+		ask it the first time we need to know, and remember what it said
+		for as long as we're connected.  If the peer takes more than
+		HELLO_TIMEOUT seconds to say, we go with none for now.  Don't
+		call this on the reader thread, which the answer comes in on.
+		"""
+		if self._peer_features is None:
+			f = self.__probe()
+			if f.wait(self.HELLO_TIMEOUT):
+				self.__heardHello(f)
+		return self._peer_features or []
+
+	def peerSupports (self, feature):
+		return feature in self.peerFeatures()
+
+	def __peerKnows (self, feature):
+		"""
+		Like peerSupports(), but if we haven't asked yet, start asking and
+		say no for now, rather than wait.
+		"""
+		if self._peer_features is None:
+			self.__probe()
+			return False
+		return feature in self._peer_features
 
 	##-----------------------------------------
 
 	def dispatchReset (self):	
 		"""
 		Reset the dispatcher to its original state.  This cancels all outstanding
-		RPCs.
+		RPCs, ours and the peer's.
 		"""
+		self._itab_lock.acquire()
 		invs = self._invocations
 		self._invocations = {}
+		self._itab_lock.release()
+		self._peer_features = None
+		self._hello = None
+		self._abandoned = {}
+		serving = self._serving
+		self._serving = {}
+		for b in serving.values():
+			b.cancel()
 		for i in invs.values():
 			i.cancel()
 
@@ -256,11 +659,95 @@ class Dispatch (Packetizer):
 				)
 			bundle.setDebugMessage(debug_msg)
 			debug_msg.call()
-		if handler:
+		if not handler:
+			if bundle.isCall():
+				bundle.error("unknown method: {0}".format(bundle.method))
+		elif bundle.expired():
+			self.__dropExpired(bundle)
+		elif not (self._response_cache and cache.isCached(handler) and
+				bundle.isCall() and self.__serveFromCache(handler, bundle)):
+			self.runHandler(handler, bundle)
+
+	##-----------------------------------------
+
+	def __serveFromCache (self, handler, bundle):
+		"""
+		Reply to the call from the response cache, and return True; or,
+		on a miss, set the bundle up to fill in the cache, and return False.
+		"""
+		c = self._response_cache
+		key = cache.cacheKey(bundle.method, bundle.arg)
+		packed = c.get(key)
+		if packed is None:
+			bundle.cache = c
+			bundle.cache_key = key
+			bundle.cache_ttl = cache.cacheTtl(handler)
+			return False
+		self.doneServing(bundle.seqid)
+		if bundle.debug_msg:
+			bundle.debug_msg.reply(None, msgpack.unpackb(packed)).call()
+		if bundle.batch:
+			bundle.batch.add(bundle.seqid, None, msgpack.unpackb(packed))
+		else:
+			self.replyPacked(bundle.seqid, packed)
+		return True
+
+	##-----------------------------------------
+
+	def runHandler(self, handler, bundle):
+		"""
+		Run the hook for an incoming call.  By default, inline hooks run
+		right here on the reader thread, and the rest go to the handler
+		pool, or get a new thread apiece if there's no pool.  Hooks made with
+		pool.inProcess() go to the process pool, if we have one.
+		"""
+		target = pool.processTarget(handler)
+		if target and self._process_pool:
+			if not self._process_pool.submit(target, bundle):
+				self.warn("Process pool is full; rejecting {0}".format(bundle.method))
+				if bundle.isCall():
+					bundle.error("server busy: {0}".format(bundle.method))
+			return
+		if pool.isInline(handler):
+			# Cheap handlers run right here on the reader thread
+			self._runHook(handler, bundle)
+			return
+
+		# It might wait a while for a thread; look again before we start
+		handler = lambda b, h=handler: self.__runIfWanted(h, b)
+		if not self._handler_pool:
 			# Run the handler in a new thread so it can block, etc...
 			threading.Thread(target = handler, args = (bundle, )).start()
-		elif bundle.isCall():
-			bundle.error("unknown method: {0}".format(bundle.method))
+		elif not self._handler_pool.submit(handler, bundle):
+			self.warn("Handler pool is full; rejecting {0}".format(bundle.method))
+			if bundle.isCall():
+				bundle.error("server busy: {0}".format(bundle.method))
+
+	def __runIfWanted (self, handler, bundle):
+		if bundle.isCancelled():
+			pass
+		elif bundle.expired():
+			self.__dropExpired(bundle)
+		else:
+			self._runHook(handler, bundle)
+
+	def _runHook (self, handler, bundle):
+		"""
+		Run a hook, but don't let a broken one take the reader (or a
+		worker) down with it, nor leave its caller waiting.
+		"""
+		try:
+			handler(bundle)
+		except Exception as e:
+			self.error("Uncaught exception in {0}: {1}".format(bundle.method, e))
+			if bundle.isCall():
+				bundle.error("uncaught exception in {0}".format(bundle.method))
+
+	def __dropExpired (self, bundle):
+		# The caller has given up, so it won't miss the reply
+		self.debug("Dropping call to {0}; its deadline passed".format(bundle.method))
+		if self.doneServing(bundle.seqid) and bundle.batch:
+			bundle.batch.add(bundle.seqid, "deadline passed", None)
 
 	##-----------------------------------------
 
@@ -9,6 +9,7 @@ class Error(Exception):
 class RingError (Error): pass
 class UnpackTypeError(Error): pass
 class RpcCallError(Error): pass
+class RpcTimeoutError(Error): pass
 class PipelinerError(Error): pass
 class AuthenticationError(Error): pass
 class DeadTransportError(Error): pass
@@ -0,0 +1,119 @@
+import threading
+import err
+import log
+
+##=======================================================================
+
+class Future (object):
+    """
+    The (error, result) pair of an RPC that might not have come back yet.
+    The connection's reader thread completes the future as soon as the
+    reply arrives, and then runs any callbacks right there, so callbacks
+    should be quick and must not block.  One that raises is logged, and
+    doesn't hold up the rest, nor the reader.
+    """
+
+    def __init__ (self):
+        self._cond = threading.Condition(threading.Lock())
+        self._done = False
+        self._error = None
+        self._result = None
+        self._callbacks = []
+        self._canceller = None
+        self._sent = True
+
+    def done (self):
+        return self._done
+
+    def complete (self, error=None, result=None):
+        """
+        Fill in the outcome, wake up any waiters, and run the callbacks.
+        Only the first call counts; return True if it was this one.
+        """
+        self._cond.acquire()
+        if self._done:
+            cbs = None
+        else:
+            self._done = True
+            self._error = error
+            self._result = result
+            cbs = self._callbacks
+            self._callbacks = []
+            self._cond.notifyAll()
+        self._cond.release()
+        if cbs is None:
+            return False
+        for cb in cbs:
+            self.__runCallback(cb)
+        return True
+
+    def addCallback (self, cb):
+        """
+        Call cb(future) once the future completes, or right now if it
+        already has.
+        """
+        self._cond.acquire()
+        now = self._done
+        if not now:
+            self._callbacks.append(cb)
+        self._cond.release()
+        if now:
+            self.__runCallback(cb)
+
+    def __runCallback (self, cb):
+        try:
+            cb(self)
+        except Exception as e:
+            log.newDefaultLogger().error(
+                "Uncaught exception in future callback: {0}".format(e))
+
+    def wait (self, timeout=None):
+        """Wait for the future to complete; return whether it did."""
+        self._cond.acquire()
+        if not self._done:
+            self._cond.wait(timeout)
+        ret = self._done
+        self._cond.release()
+        return ret
+
+    def pair (self, timeout=None):
+        """Wait for the future, and return its (error, result) pair."""
+        if not self.wait(timeout):
+            raise err.RpcTimeoutError("no reply after {0}s".format(timeout))
+        return (self._error, self._result)
+
+    def error (self): return self._error
+
+    def setUnsent (self):
+        self._sent = False
+
+    def wasSent (self):
+        """
+        False if the call failed before any of it went out, so it's safe
+        to try it again elsewhere.  True otherwise, even if it failed.
+        """
+        return self._sent
+
+    def setCanceller (self, fn):
+        self._canceller = fn
+
+    def cancel (self):
+        """
+        Give up on the RPC, if it's still out: it fails right away with a
+        "cancelled" error, and the peer is asked to stop work on it.
+        Return True if it was still out.
+        """
+        fn = self._canceller
+        if self._done or not fn:
+            return False
+        fn()
+        return True
+
+    def result (self, timeout=None):
+        """Wait for the future, and either return its result, or raise an
+        RpcCallError if the RPC failed."""
+        (e, res) = self.pair(timeout)
+        if e: raise err.RpcCallError(e)
+        return res
+
+##=======================================================================
@@ -28,6 +28,9 @@ class List (object):
 		self._head = None
 		self._tail = None
 
+	def isEmpty (self):
+		return not self._head
+
 	def push (self, o):
 		o.setPrev(self._tail)
 		o.setNext(None)
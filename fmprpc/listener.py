@@ -1,4 +1,5 @@
 import socket
+import threading
 import transport
 import log
 import debug
@@ -7,21 +8,69 @@ import time
 import util
 import sys
 import address
+import prefork
+import timer
+
+##=======================================================================
+
+class _Deadline (object):
+    """
+    Shut a socket down if a handshake on it isn't done in time, which makes
+    whatever read the handshake is blocked in fail right away.  It waits on
+    the shared timer thread, not a thread of its own.
+    """
+
+    def __init__ (self, sock, secs):
+        self._sock = sock
+        self._lock = threading.Lock()
+        self._over = False
+        self._timer = timer.schedule(secs, self.__expire)
+
+    def __expire (self):
+        self._lock.acquire()
+        if not self._over:
+            self._over = True
+            try:
+                self._sock.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+        self._lock.release()
+
+    def finish (self):
+        """Call when the handshake is done; return False if it expired first."""
+        self._timer.cancel()
+        self._lock.acquire()
+        ret = not self._over
+        self._over = True
+        self._lock.release()
+        return ret
 
 ##=======================================================================
 
 class Listener (log.Base):
 
-    def __init__(self, bindto, TransportClass=None, log_obj=None):
+    def __init__(self, bindto, TransportClass=None, log_obj=None, tcp_opts={}):
         self.bindto = bindto
-        self._transport_klass = TransportClass if TransportClass else transport.Transport
+        self._transport_klass = TransportClass if TransportClass else self.defaultTransportClass()
+        self._tcp_opts = tcp_opts
 
         if not log_obj:
             log_obj = self.__defaultLogger()
         log.Base.__init__(self, log_obj)
 
+        # Pushed to from the handshake pool, and removed from on any
+        # connection's thread, so it needs a lock
         self._children = ilist.List()
+        self._children_lock = threading.Lock()
         self._dbgr = None
+        self._handler_pool = None
+        self._process_pool = None
+        self._response_cache = None
+        self._handshake_pool = None
+        self._handshake_deadline = None
+        self._tcp_server = None
+        self._workers = None
+        self._reuse_port = False
 
     def __defaultLogger(self):
         l = log.newDefaultLogger()
@@ -32,13 +81,63 @@ class Listener (log.Base):
     def setDebugger (self, d) :
         self._dbgr = d
 
+    def defaultTransportClass(self):
+        """The class of transport to use if none was given.  Subclasses
+        that need a different kind of transport can override."""
+        return transport.Transport
+
     def setTransportClass(self, klass):
         self._transport_klass = klass
 
+    def setHandlerPool (self, p):
+        """
+        Run the calls that come in on all new connections on the given
+        pool.WorkerPool.  Many listeners can share one pool.
+        """
+        self._handler_pool = p
+
+    def setHandshakePool (self, p, deadline=10):
+        """
+        Start up new connections (and so do their TLS or SSH handshakes)
+        on the given pool.WorkerPool, so that the accept loop can get right
+        back to accepting, and one slow client can't hold up the rest.  A
+        handshake that isn't done within deadline seconds is cut off; a
+        connection that the pool rejects is just closed.
+        """
+        self._handshake_pool = p
+        self._handshake_deadline = deadline
+
+    def setProcessPool (self, p):
+        """
+        Run hooks made with pool.inProcess() on the given pool.ProcessPool,
+        for all new connections.
+        """
+        self._process_pool = p
+
+    def setResponseCache (self, c):
+        """
+        Serve calls to hooks marked with cache.cached() from the given
+        cache.ResponseCache, for all new connections.
+        """
+        self._response_cache = c
+
+    def setWorkers (self, n, reuse_port=None, grace=10):
+        """
+        Make listen() fork n worker processes, each running the accept
+        loop, and look after them until it's told to stop.  See
+        prefork.Supervisor for the options.
+        """
+        self._workers = prefork.Supervisor(self, n, reuse_port=reuse_port, grace=grace)
+
     def setDebugFlags (self, f, apply_to_children):
         self.setDebugger(debug.makeDebugger(f, self.getLogger()))
         if apply_to_children:
-            self._children.walk(lambda x: x.setDebugFlags(f))
+            kids = []
+            self._children_lock.acquire()
+            self._children.walk(kids.append)
+            self._children_lock.release()
+            for x in kids:
+                x.setDebugFlags(f)
 
     def makeNewTransport (self, c, remote):
         """
@@ -51,17 +150,46 @@ class Listener (log.Base):
         # we don't activate until after we install the handlers....
         x = self._transport_klass(
             remote = remote,
+            tcp_opts = self._tcp_opts,
             parent = self,
             log_obj = self.makeNewLogObject(remote),
             dbgr = self._dbgr
             )
-        self._children.push(x.serverListNode()) 
+        if self._handler_pool:
+            x.setHandlerPool(self._handler_pool)
+        if self._process_pool:
+            x.setProcessPool(self._process_pool)
+        if self._response_cache:
+            x.setResponseCache(self._response_cache)
+        self._children_lock.acquire()
+        self._children.push(x.serverListNode())
+        self._children_lock.release()
         return x
 
-    def __gotNewConnection(self, c, remote):
+    def _gotNewConnection(self, c, remote):
+        if not self._handshake_pool:
+            x = self.makeNewTransport(c, remote)
+            self.gotNewConnection(x)
+            x.activateStream(c)
+        elif not self._handshake_pool.submit(self.__handshake, (c, remote)):
+            self.warn("Handshake pool is full; dropping connection from {0}".format(remote))
+            c.close()
+
+    def __handshake(self, args):
+        (c, remote) = args
         x = self.makeNewTransport(c, remote)
         self.gotNewConnection(x)
-        x.activateStream(c)
+        d = _Deadline(c, self._handshake_deadline)
+        try:
+            ok = x.activateStream(c)
+        except Exception as e:
+            self.warn("Handshake with {0} failed: {1}".format(remote, e))
+            ok = False
+        if not d.finish():
+            self.warn("Handshake with {0} took over {1}s".format(remote, self._handshake_deadline))
+            ok = False
+        if not ok:
+            x.close()
 
     def gotNewConnection(self, c):
         raise NotImplementedError("Listener::gotNewConnection is pure virtual")
@@ -70,7 +198,9 @@ class Listener (log.Base):
         return self.getLogger().makeChild(remote=remote)
 
     def removeChild (self, c):
+        self._children_lock.acquire()
         self._children.remove(c.serverListNode())
+        self._children_lock.release()
 
     def close(self):
         if self._tcp_server:
@@ -80,7 +210,7 @@ class Listener (log.Base):
 
     def setPort (self, p): self.port = p
 
-    def __bindAndListen(self, ql):
+    def _bindAndListen(self, ql):
         # This code taken: from http://docs.python.org/2/library/socket.html
         # The idea is to work properly in an IPv6 environment, but only
         # if that's preferred.
@@ -98,6 +228,8 @@ class Listener (log.Base):
                 try:
                     # Make it so that we can kill this guy and then restart it!
                     s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+                    if self._reuse_port:
+                        s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
                     s.bind(sa)
                     s.listen(ql)
                     return s
@@ -111,9 +243,12 @@ class Listener (log.Base):
     def listen (self, cond=None, queue_len=1000):
         """
         Bind to the host/port given in the object's constructor, and set up a listen
-        queue of the given size.
+        queue of the given size.  With workers (see setWorkers), this
+        runs the supervisor instead.
         """
-        s = self.__bindAndListen(queue_len)
+        if self._workers:
+            return self._workers.run(cond=cond, queue_len=queue_len)
+        s = self._bindAndListen(queue_len)
         ok = False
         if s:
             ok = True
@@ -122,16 +257,20 @@ class Listener (log.Base):
                 cond.acquire()
                 cond.notify()
                 cond.release()
-            self.__listenLoop()
+            self._listenLoop()
         return ok
 
-    def __listenLoop (self):
-        while True:
+    def _listenLoop (self):
+        while self._tcp_server:
             try:
                 sock, addr = self._tcp_server.accept()
-                self.__gotNewConnection(sock, address.InternetAddress(tup=addr))
+                self._gotNewConnection(sock, address.InternetAddress(tup=addr))
+            except socket.timeout:
+                # Only if someone set a timeout on the socket, to poll
+                pass
             except socket.error as e:
-                self.warn("Accept error: {0}".format(e))
+                if self._tcp_server:
+                    self.warn("Accept error: {0}".format(e))
         self.info("Leaving listen loop")
 
     def listenRetry (self, delay, cond=None, queue_len=1000):
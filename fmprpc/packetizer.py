@@ -1,6 +1,6 @@
 
 import msgpack
-from msgpack.exceptions import UnpackValueError
+from msgpack.exceptions import UnpackValueError, OutOfData
 from ring import Ring
 from err import UnpackTypeError
 import log
@@ -30,13 +30,75 @@ def msgpackFrameLen (byt) :
 
 ##=======================================================================
 
+def packFrame (msg):
+	"""
+	Pack msg into a frame, returned as a list of two buffers: the
+	length prefix and then the payload.
+	"""
+	b = msgpack.packb(msg)
+	return [ msgpack.packb(len(b)), b ]
+
+def packFramePrepacked (head, tail):
+	"""
+	Like packFrame(head + [ x ]), where tail is x, already packed.  The
+	tail goes out as is, with no copy.
+	"""
+	p = msgpack.Packer(autoreset=False)
+	p.pack_array_header(len(head) + 1)
+	for x in head:
+		p.pack(x)
+	b = p.bytes()
+	return [ msgpack.packb(len(b) + len(tail)), b, tail ]
+
+##=======================================================================
+
+class Assembly (object):
+	"""
+	A preallocated buffer for exactly one large incoming frame.  Once
+	we know how long the frame is, incoming data is written straight
+	into here (ideally by recv_into), rather than piling up in the Ring
+	and getting concatenated over and over again.
+	"""
+
+	def __init__ (self, n):
+		self._buf = bytearray(n)
+		self._view = memoryview(self._buf)
+		self._filled = 0
+
+	def remaining (self): return len(self._buf) - self._filled
+	def isFull (self): return self._filled == len(self._buf)
+	def buffer (self): return self._buf
+
+	def target (self):
+		"""The writable part of the buffer that's still waiting for data."""
+		return self._view[self._filled:]
+
+	def advance (self, n):
+		"""Mark n more bytes as filled, after writing into target()."""
+		self._filled += n
+
+	def fill (self, b):
+		"""Copy as much of b as fits; return the number of bytes taken."""
+		n = min(len(b), self.remaining())
+		self._view[self._filled:self._filled + n] = b[0:n]
+		self._filled += n
+		return n
+
+##=======================================================================
+
 class Packetizer (log.Base):
 	"""
 	A packetizer that is used to read and write to an underlying
 	stream (like a Transport). Should be inherited by such a class.
 	The subclass should implement:
 
-		rawWrite(msg) --- write this msg to the stream.
+		rawWritev(bufs) --- write this list of buffers to the stream,
+		   in as few writes as possible; return False if there's no
+		   stream to write to.  Must be safe to call from any thread.
+		   Typically handled at the Transport level (2 classes higher)
+
+		waitForRoom() --- optionally, block until the stream has room
+		   for more outgoing data; call it before taking any locks.
 		   Typically handled at the Transport level (2 classes higher)
 
 		packetizeError(e) --- report an error with the stream.
@@ -47,36 +109,92 @@ class Packetizer (log.Base):
 
 	The subclass should call packetizeData(m) whenever it has
 	data to stuff in to the packetizer's input path, and call
-	send(m) whenever it wants to stuff data into the packetizer's
-	output path.
+	send(m) (or sendMany(ms)) whenever it wants to stuff data into
+	the packetizer's output path.
+
+	Frames of at least ASSEMBLY_MIN bytes that haven't fully arrived
+	yet are collected in a preallocated Assembly buffer.  While one
+	is pending, packetizeTarget() returns it, so the reader can
+	recv_into it directly and then call packetizeAssembled().
+
+	That's the default FRAME_ENGINE.  With setEngine(UNPACKER_ENGINE),
+	incoming data is instead fed to one long-lived msgpack.Unpacker,
+	which pulls out (length, payload) pairs in C; all messages that
+	were completed by one packetizeData() call are then dispatched
+	as a batch.
 	"""
 
 	#-------------------------------
 
-	# The two states we can be in
+	# The three states we can be in
 	FRAME = 1
 	DATA = 2
+	ASSEMBLE = 3
+
+	# Frames this big or bigger get a preallocated buffer
+	ASSEMBLY_MIN = 0x10000
 
 	# Results of getting
 	OK = 0
 	WAIT = 1
 	ERR = -1
 
+	# The two decoding engines
+	FRAME_ENGINE = "frame"
+	UNPACKER_ENGINE = "unpacker"
+
 	#-------------------------------
 
 	def __init__ (self, log_obj):
 		self._ring = Ring()
 		self._state = self.FRAME
 		self._next_msg_len = 0
+		self._asm = None
+		self._engine = self.FRAME_ENGINE
+		self._unpacker = None
+		self._payload_end = 0
 		log.Base.__init__(self, log_obj)
 
 	#-------------------------------
 
+	def setEngine (self, e):
+		"""
+		Pick the FRAME_ENGINE or the UNPACKER_ENGINE for decoding
+		incoming data.  Should be called before any data arrives.
+		"""
+		if e not in (self.FRAME_ENGINE, self.UNPACKER_ENGINE):
+			raise ValueError("unknown packetizer engine: {0}".format(e))
+		self._engine = e
+		self.packetizerReset()
+
+	#-------------------------------
+
 	def send (self, msg):
-		b2 = msgpack.packb(msg)
-		b1 = msgpack.packb(len(b2))
-		self.rawWrite(b1)
-		self.rawWrite(b2)
+		"""Send msg; return False if there was no stream to send it on."""
+		return self.rawWritev(packFrame(msg))
+
+	#-------------------------------
+
+	def sendPrepacked (self, head, tail):
+		"""Send head + [ x ], where tail is x, already packed; see
+		packFramePrepacked()."""
+		return self.rawWritev(packFramePrepacked(head, tail))
+
+	#-------------------------------
+
+	def waitForRoom (self):
+		pass
+
+	#-------------------------------
+
+	def sendMany (self, msgs):
+		"""
+		Send all of the given msgs with just one (vectored) write.
+		"""
+		bufs = []
+		for msg in msgs:
+			bufs.extend(packFrame(msg))
+		return self.rawWritev(bufs)
 
 	#-------------------------------
 
@@ -89,7 +207,7 @@ class Packetizer (log.Base):
 		f0 = self._ring.grab(1)
 		if not f0: return self.WAIT
 
-		frame_len = msgpackFrameLen(ord(f0))
+		frame_len = msgpackFrameLen(ord(f0[0]))
 		if not frame_len:
 			self.packetizeError("Bad frame header received")
 			return self.ERR
@@ -119,40 +237,165 @@ class Packetizer (log.Base):
 		Internal method: get the msg part of the stream.
 		"""
 		l = self._next_msg_len
-		if l > len(self._ring): return self.WAIT
+		if l > len(self._ring):
+			if l >= self.ASSEMBLY_MIN:
+				self.__startAssembly(l)
+			return self.WAIT
 		buf = self._ring.grab(l)
 		if not buf: return self.WAIT
+		return self.__decodePayload(buf, lambda : self._ring.consume(l))
+
+	#-------------------------------
+
+	def __startAssembly(self, l):
+		"""
+		Internal method: switch into length-aware mode for a big frame,
+		moving whatever part of it we already have out of the ring.
+		"""
+		self._asm = Assembly(l)
+		for b in self._ring.release():
+			self._asm.fill(b)
+		self._state = self.ASSEMBLE
 
+	#-------------------------------
+
+	def __getAssembled(self):
+		"""
+		Internal method: decode the big frame once its Assembly is full.
+		"""
+		def done():
+			self._asm = None
+		return self.__decodePayload(self._asm.buffer(), done)
+
+	#-------------------------------
+
+	def __decodePayload(self, buf, consume):
 		try:
 			msg = unpackType(buf, list)
-			self._ring.consume(l)
+			consume()
 			self._state = self.FRAME
 			self.dispatch(msg)
 			return self.OK
 		except UnpackValueError:
 			self.packetizeError("Bad encoding found in data; len={0}"
-				.format(l))
+				.format(len(buf)))
 		except UnpackTypeError as e:
 			self.packetizeError("In data: {0}".format(e))
 		return self.ERR
 
 	#-------------------------------
 
-	def packetizeData(self, msg):
+	def __pump(self):
+		"""
+		Internal method: fetch as many messages as possible from the
+		ring, stopping if either there's a wait condition or if an
+		error occurred.
+		"""
+		go = self.OK
+		while go is self.OK:
+			if self._state is self.FRAME:
+				go = self.__getFrame()
+			elif self._state is self.DATA:
+				go = self.__getPayload()
+			else:
+				go = self.WAIT
+
+	#-------------------------------
+
+	def packetizeData(self, msg, borrowed=False):
 		"""
 		To be called wheneve new data arrives on the transport.
 		This method will stuff the new data into the bufffer ring
 		and then attempt to fetch as many messages as possible
 		from the stream, stopping if either there's a wait condition
 		or if an error occurred.
+
+		If borrowed, the caller is going to reuse msg's memory after
+		we return, so we copy out whatever part of it we still need.
 		"""
+		if self._unpacker:
+			self.__unpackStream(msg)
+			return
+		if self._state is self.ASSEMBLE:
+			n = self._asm.fill(msg)
+			if not self._asm.isFull():
+				return
+			msg = memoryview(msg)[n:]
+			if self.__getAssembled() is not self.OK:
+				return
 		self._ring.buffer(msg)
-		go = self.OK
-		while go is self.OK:
-			if self._state is self.FRAME:
-				go = self.__getFrame()
-			else:
-				go = self.__getPayload()
+		self.__pump()
+		if borrowed:
+			self._ring.own()
+
+	#-------------------------------
+
+	def __unpackStream(self, msg):
+		"""
+		Internal method: the UNPACKER_ENGINE's version of packetizeData.
+		Pull as many (length, payload) pairs out of the unpacker as we
+		can, checking each length against the payload that followed it.
+		"""
+		u = self._unpacker
+		u.feed(msg)
+		batch = []
+		e = None
+		try:
+			while e is None:
+				if self._state is self.FRAME:
+					l = u.unpack()
+					if type(l) not in (int, long):
+						e = "Bad data type in frame header: {0}".format(type(l))
+					else:
+						# Note where the payload should end; the unpacker's
+						# tell() isn't reliable after an OutOfData.
+						self._next_msg_len = l
+						self._payload_end = u.tell() + l
+						self._state = self.DATA
+				else:
+					m = u.unpack()
+					if u.tell() != self._payload_end:
+						e = "Frame length mismatch: got {0}; wanted {1}".format(
+							u.tell() - self._payload_end + self._next_msg_len,
+							self._next_msg_len)
+					elif type(m) is not list:
+						e = "In data: wrong type: got {0}; wanted {1}".format(
+							type(m), list)
+					else:
+						batch.append(m)
+						self._state = self.FRAME
+		except OutOfData:
+			pass
+		except UnpackValueError:
+			e = "Bad encoding found in data"
+
+		for m in batch:
+			self.dispatch(m)
+		if e:
+			self.packetizeError(e)
+
+	#-------------------------------
+
+	def packetizeTarget(self):
+		"""
+		If we're in the middle of assembling a big frame, return its
+		Assembly, so that the caller can read straight into target().
+		Otherwise, return None, and the caller should use packetizeData().
+		"""
+		return self._asm
+
+	#-------------------------------
+
+	def packetizeAssembled(self, asm, n):
+		"""
+		To be called after n bytes were read into asm.target().  If
+		the packetizer was reset in the meantime, the data is dropped.
+		"""
+		if asm is not self._asm:
+			return
+		asm.advance(n)
+		if asm.isFull() and self.__getAssembled() is self.OK:
+			self.__pump()
 
 	#-------------------------------
 
@@ -163,5 +406,10 @@ class Packetizer (log.Base):
 		"""
 		self._state = self.FRAME
 		self._ring = Ring()
+		self._asm = None
+		if self._engine == self.UNPACKER_ENGINE:
+			self._unpacker = msgpack.Unpacker()
+		else:
+			self._unpacker = None
 
 ##=======================================================================
@@ -0,0 +1,273 @@
+import threading
+import Queue
+import multiprocessing
+import multiprocessing.queues
+import cPickle
+import itertools
+import errno
+import os
+import time
+import log
+
+##=======================================================================
+
+def inline (hook):
+    """
+    Mark a handler hook as cheap enough to run right on the reader thread,
+    with no hand-off to a worker at all.  Such a hook must not block, since
+    nothing else is read off its connection while it runs.  Decorate the
+    function itself, not a bound method.
+    """
+    hook.fmprpc_inline = True
+    return hook
+
+def isInline (hook):
+    return getattr(hook, "fmprpc_inline", False)
+
+class ProcessHook (object):
+    """
+    A hook that runs fn(arg) for a call, made with inProcess() below.  Given
+    a ProcessPool, the Dispatch runs fn there; otherwise, calling the hook
+    runs fn right here, like any other hook.
+    """
+    def __init__ (self, fn):
+        self.fn = fn
+
+    def __call__ (self, bundle):
+        (e, res) = _runInProcess(self.fn, bundle.arg)
+        if e: bundle.error(e)
+        else: bundle.reply(res)
+
+def inProcess (fn):
+    """
+    Make a hook that runs the CPU-heavy fn(arg) on a ProcessPool (see
+    Listener.setProcessPool), out from under the GIL.  fn gets the call's
+    already-decoded arg, and returns the result or raises an exception,
+    whose message becomes the error.  Since it's pickled over to another
+    process, fn must be a module-level function.
+    """
+    return ProcessHook(fn)
+
+def processTarget (hook):
+    return hook.fn if isinstance(hook, ProcessHook) else None
+
+def _runInProcess (fn, arg):
+    try:
+        return (None, fn(arg))
+    except Exception as e:
+        return (str(e), None)
+
+# In a ProcessPool's processes, where to say which calls we've started
+_started = None
+
+def _initWorker (started):
+    global _started
+    _started = started
+
+def _runInWorker (token, fn, arg):
+    # Module-level, so the pool can pickle it
+    _started.put((token, os.getpid()))
+    (e, res) = _runInProcess(fn, arg)
+    if e:
+        return (e, None)
+    # Pickle it here, so that a result that won't go is an error for the
+    # call, rather than lost in the pool's machinery
+    try:
+        return (None, cPickle.dumps(res, cPickle.HIGHEST_PROTOCOL))
+    except Exception as e:
+        return ("can't send the result back: {0}".format(e), None)
+
+def _pidGone (pid):
+    try:
+        os.kill(pid, 0)
+        return False
+    except OSError as e:
+        return e.errno == errno.ESRCH
+
+##=======================================================================
+
+class WorkerPool (log.Base):
+    """
+    A fixed set of worker threads that run handler hooks, fed by a bounded
+    queue.  One pool can be shared by as many transports and listeners as
+    you like (see Listener.setHandlerPool).
+
+    n_workers -- the number of worker threads.
+
+    queue_max -- the most calls that can wait for a worker.
+
+    overflow -- what to do with a call when the queue is full:
+        REJECT it (the Dispatch replies with an error), or run it INLINE
+        on the submitting thread (typically a connection's reader, which
+        then stops reading from the wire until the call is done).
+    """
+
+    REJECT = "reject"
+    INLINE = "inline"
+
+    def __init__ (self, n_workers=16, queue_max=1000, overflow=REJECT,
+                  log_obj=None):
+        if overflow not in (self.REJECT, self.INLINE):
+            raise ValueError("unknown overflow policy: {0}".format(overflow))
+        self._overflow = overflow
+        self._queue = Queue.Queue(queue_max)
+        self._workers = []
+        log.Base.__init__(self, log_obj if log_obj else log.newDefaultLogger())
+        for i in range(n_workers):
+            t = threading.Thread(target = self.__work)
+            t.daemon = True
+            t.start()
+            self._workers.append(t)
+
+    def __work (self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                break
+            (fn, arg) = job
+            try:
+                fn(arg)
+            except Exception as e:
+                self.error("Uncaught exception in handler: {0}".format(e))
+
+    def submit (self, fn, arg):
+        """
+        Run fn(arg) on a worker.  Return True if it was queued (or run
+        inline, due to overflow), and False if it was rejected.
+        """
+        try:
+            self._queue.put_nowait((fn, arg))
+            ret = True
+        except Queue.Full:
+            if self._overflow is self.INLINE:
+                try:
+                    fn(arg)
+                except Exception as e:
+                    self.error("Uncaught exception in handler: {0}".format(e))
+                ret = True
+            else:
+                ret = False
+        return ret
+
+    def close (self):
+        """Let the workers finish what's queued, and then exit."""
+        for t in self._workers:
+            self._queue.put(None)
+
+##=======================================================================
+
+class ProcessPool (log.Base):
+    """
+    A multiprocessing.Pool for hooks made with inProcess().  It forks its
+    processes right away, so make it before starting any threads.
+
+    n_procs -- the number of processes; one per CPU by default.
+
+    max_tasks_per_child -- if set, replace each process after it has run
+        this many calls, to keep leaks in check.
+
+    queue_max -- the most calls that can be outstanding at once; past
+        that, calls are rejected, and the Dispatch replies with an error.
+
+    Every call gets exactly one reply.  One whose fn or result can't be
+    pickled fails with an error, as does one whose process dies under
+    it, within a couple of WATCH_POLLs.
+    """
+
+    # How often to look for calls that failed in the pool, or were lost
+    # with their process
+    WATCH_POLL = 0.2
+
+    def __init__ (self, n_procs=None, max_tasks_per_child=None, queue_max=1000,
+                  log_obj=None):
+        self._started = multiprocessing.queues.SimpleQueue()
+        self._pool = multiprocessing.Pool(n_procs, initializer=_initWorker,
+                                          initargs=(self._started, ),
+                                          maxtasksperchild=max_tasks_per_child)
+        self._queue_max = queue_max
+        # token -> [ ApplyResult, bundle, pid, suspect ]
+        self._outstanding = {}
+        self._tokens = itertools.count()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._lost = 0
+        log.Base.__init__(self, log_obj if log_obj else log.newDefaultLogger())
+        self._watcher = threading.Thread(target = self.__watch)
+        self._watcher.daemon = True
+        self._watcher.start()
+
+    def outstanding (self):
+        """How many calls are in the pool now."""
+        return len(self._outstanding)
+
+    def submit (self, fn, bundle):
+        """
+        Run fn(bundle.arg) in a process, and reply to the bundle with the
+        outcome.  Return False if the call was rejected.
+        """
+        self._lock.acquire()
+        ret = len(self._outstanding) < self._queue_max
+        if ret:
+            token = next(self._tokens)
+            job = self._outstanding[token] = [ None, bundle, None, False ]
+        self._lock.release()
+        if ret:
+            # The callback only comes on success; the watcher sees to the rest
+            job[0] = self._pool.apply_async(_runInWorker, (token, fn, bundle.arg),
+                callback = lambda pair: self.__finish(token, *pair))
+        return ret
+
+    def __finish (self, token, e, packed):
+        # Whoever takes the call out of the table replies to it
+        self._lock.acquire()
+        job = self._outstanding.pop(token, None)
+        self._lock.release()
+        if not job:
+            return
+        bundle = job[1]
+        if not e:
+            try:
+                res = cPickle.loads(packed)
+            except Exception as ex:
+                e = "can't load the result: {0}".format(ex)
+        if e: bundle.error(e)
+        else: bundle.reply(res)
+
+    def __watch (self):
+        while not self._closed:
+            time.sleep(self.WATCH_POLL)
+            while not self._started.empty():
+                (token, pid) = self._started.get()
+                job = self._outstanding.get(token)
+                if job:
+                    job[2] = pid
+            for (token, job) in self._outstanding.items():
+                r = job[0]
+                if r is None:
+                    continue
+                if r.ready():
+                    if not r.successful():
+                        try:
+                            r.get()
+                        except Exception as e:
+                            self.__finish(token, str(e), None)
+                elif job[2] is not None and _pidGone(job[2]):
+                    # Twice running, lest its result is just in flight
+                    if job[3]:
+                        self.warn("Process {0} died in a call".format(job[2]))
+                        self._lost += 1
+                        self.__finish(token, "worker process died", None)
+                    job[3] = True
+
+    def close (self):
+        """Finish the outstanding calls, and shut the processes down."""
+        self._pool.close()
+        while self._outstanding:
+            time.sleep(self.WATCH_POLL)
+        if self._lost:
+            # The pool still waits on what the dead took with them
+            self._pool.terminate()
+        self._pool.join()
+        self._closed = True
+
+##=======================================================================
@@ -0,0 +1,196 @@
+import os
+import errno
+import signal
+import socket
+import time
+import log
+
+##=======================================================================
+
+class Supervisor (log.Base):
+    """
+    Runs a Listener's accept loop in n_workers forked processes, so that
+    decoding and handlers can use more than one core.  Don't make one of
+    these directly; call Listener.setWorkers() and then listen() as usual.
+
+    reuse_port -- if True, each worker binds its own socket with
+        SO_REUSEPORT, and the kernel spreads connections across them.  If
+        False, the supervisor binds one socket and the workers share it.
+        By default, use SO_REUSEPORT where the platform has it.
+
+    grace -- on a rolling restart or a shutdown, how many seconds an old
+        worker gets to finish up with its open connections.
+
+    The supervisor restarts workers that die.  Send it SIGHUP for a
+    rolling restart: each worker in turn is replaced with a fresh one,
+    and only then told to stop accepting and wind down.  SIGTERM or
+    SIGINT winds everything down and makes listen() return.
+
+    Fork before starting any threads of your own in the parent (a
+    reactor, a worker pool, and so on); the children won't have them.
+    """
+
+    # Don't restart a worker more often than this, lest we spin on a
+    # worker that's crashing right on startup.
+    RESTART_DELAY = 1
+
+    # How often a worker's accept() wakes up to see if it's been told to
+    # stop.  The signal might land on any of its threads, but the handler
+    # only runs on the main thread, which is stuck in accept().
+    ACCEPT_POLL = 0.5
+
+    def __init__ (self, listener, n_workers, reuse_port=None, grace=10):
+        self._listener = listener
+        self._n_workers = n_workers
+        if reuse_port is None:
+            reuse_port = hasattr(socket, "SO_REUSEPORT")
+        self._reuse_port = reuse_port
+        self._grace = grace
+        self._workers = {}
+        self._sock = None
+        self._stopping = False
+        self._restart = False
+        log.Base.__init__(self, listener.getLogger())
+
+    ##-----------------------------------------
+
+    def workers (self):
+        """The pids of the workers that are running now."""
+        return self._workers.keys()
+
+    ##-----------------------------------------
+
+    def run (self, cond=None, queue_len=1000):
+        """
+        Start the workers and look after them until we're told to stop.
+        Return False if we couldn't bind the shared socket.
+        """
+        if not self._reuse_port:
+            self._sock = self._listener._bindAndListen(queue_len)
+            if not self._sock:
+                return False
+        self._queue_len = queue_len
+        self._pid = os.getpid()
+
+        signal.signal(signal.SIGTERM, self.__onStop)
+        signal.signal(signal.SIGINT, self.__onStop)
+        signal.signal(signal.SIGHUP, self.__onRestart)
+
+        for i in range(self._n_workers):
+            self.__spawn()
+        if cond:
+            cond.acquire()
+            cond.notify()
+            cond.release()
+
+        while self._workers:
+            if self._restart:
+                self._restart = False
+                self.__rollingRestart()
+            try:
+                (pid, status) = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            started = self._workers.pop(pid, None)
+            if started is None or self._stopping:
+                continue
+            self.warn("Worker {0} exited with status {1}; restarting".format(pid, status))
+            if time.time() - started < self.RESTART_DELAY:
+                time.sleep(self.RESTART_DELAY)
+            if not self._stopping:
+                self.__spawn()
+
+        if self._sock:
+            self._sock.close()
+        self.info("All workers are done")
+        return True
+
+    ##-----------------------------------------
+
+    def __onStop (self, signum, frame):
+        if os.getpid() != self._pid:
+            # A worker that was just forked, and hasn't set up its own
+            # handlers yet; it hasn't done anything worth winding down
+            os._exit(0)
+        self._stopping = True
+        for pid in self._workers.keys():
+            self.__kill(pid)
+
+    def __onRestart (self, signum, frame):
+        self._restart = True
+
+    ##-----------------------------------------
+
+    def __kill (self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError as e:
+            if e.errno != errno.ESRCH:
+                raise
+
+    ##-----------------------------------------
+
+    def __rollingRestart (self):
+        self.info("Rolling restart of {0} workers".format(len(self._workers)))
+        for pid in self._workers.keys():
+            if self._stopping:
+                break
+            self.__spawn()
+            self.__kill(pid)
+            self._workers.pop(pid, None)
+            while True:
+                try:
+                    os.waitpid(pid, 0)
+                    break
+                except OSError as e:
+                    if e.errno != errno.EINTR:
+                        break
+
+    ##-----------------------------------------
+
+    def __spawn (self):
+        pid = os.fork()
+        if pid:
+            self._workers[pid] = time.time()
+            if self._stopping:
+                # We were told to stop while forking, and missed this one
+                self.__kill(pid)
+            return
+        status = 1
+        try:
+            self.__runWorker()
+            status = 0
+        except BaseException as e:
+            self.error("Worker {0} failed: {1}".format(os.getpid(), e))
+        finally:
+            os._exit(status)
+
+    ##-----------------------------------------
+
+    def __runWorker (self):
+        l = self._listener
+        l._workers = None
+
+        # Only the supervisor handles ^C; it'll pass it along to us
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGHUP, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, lambda signum, frame: l.close())
+
+        s = self._sock
+        if not s:
+            l._reuse_port = True
+            s = l._bindAndListen(self._queue_len)
+            if not s:
+                raise socket.error("could not bind to {0}".format(l.bindto))
+        s.settimeout(self.ACCEPT_POLL)
+        l._tcp_server = s
+        l._listenLoop()
+
+        # Done accepting; give the open connections a chance to finish
+        deadline = time.time() + self._grace
+        while not l._children.isEmpty() and time.time() < deadline:
+            time.sleep(0.1)
+
+##=======================================================================
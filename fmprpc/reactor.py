@@ -0,0 +1,229 @@
+import os
+import errno
+import fcntl
+import select
+import threading
+import itertools
+from collections import deque
+import log
+import ring
+
+##=======================================================================
+
+class Reactor (threading.Thread, log.Base):
+    """
+    One thread that multiplexes many sockets, with epoll where we have it,
+    and poll otherwise.  Register an object with onReadable() and
+    onWritable() methods for a file descriptor, and the reactor calls them
+    as the descriptor becomes ready.
+
+    All the registered objects run on this one thread, so they mustn't
+    block.  In return, they can share the reactor's read arena, since only
+    one of them is ever reading at a time.
+
+    Anything that touches the poller goes through callSoon() when it comes
+    from another thread, so all methods are safe to call from anywhere.
+    """
+
+    READ = select.POLLIN
+    WRITE = select.POLLOUT
+    ERR = select.POLLERR | select.POLLHUP
+
+    def __init__ (self, log_obj=None, read_min=0x1000, read_max=0x40000):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        log.Base.__init__(self, log_obj if log_obj else log.newDefaultLogger())
+        if hasattr(select, "epoll"):
+            self._poller = select.epoll()
+        else:
+            self._poller = select.poll()
+        self._handlers = {}
+        self._pending = deque()
+        self._stopped = False
+        self.arena = ring.Arena(read_min, read_max)
+
+        # A self-pipe, so other threads can wake us out of poll()
+        (self._wake_r, self._wake_w) = os.pipe()
+        for fd in (self._wake_r, self._wake_w):
+            fl = fcntl.fcntl(fd, fcntl.F_GETFL)
+            fcntl.fcntl(fd, fcntl.F_SETFL, fl | os.O_NONBLOCK)
+        self._poller.register(self._wake_r, self.READ)
+
+    #-----------------------------------------
+
+    def inLoop (self):
+        return threading.current_thread() is self
+
+    def numHandlers (self):
+        return len(self._handlers)
+
+    def pick (self):
+        """A lone reactor is its own group of one (see ReactorGroup)."""
+        return self
+
+    #-----------------------------------------
+
+    def callSoon (self, fn):
+        """Run fn() on the reactor thread, after the current round of events."""
+        self._pending.append(fn)
+        if not self.inLoop():
+            try:
+                os.write(self._wake_w, "x")
+            except OSError as e:
+                # A full pipe is fine, we're getting woken up anyway
+                if e.errno != errno.EAGAIN:
+                    raise
+
+    def __inLoop (self, fn):
+        if self.inLoop():
+            fn()
+        else:
+            self.callSoon(fn)
+
+    #-----------------------------------------
+
+    def register (self, fd, handler, events=READ):
+        # Count the handler right away, so that a ReactorGroup picking the
+        # least loaded reactor sees it, even before the poller does.
+        self._handlers[fd] = handler
+        self.__inLoop(lambda : self._poller.register(fd, events))
+
+    def modify (self, fd, events):
+        def op():
+            if fd in self._handlers:
+                self._poller.modify(fd, events)
+        self.__inLoop(op)
+
+    def unregister (self, fd):
+        def op():
+            if self._handlers.pop(fd, None):
+                self._poller.unregister(fd)
+        self.__inLoop(op)
+
+    #-----------------------------------------
+
+    def stop (self):
+        self._stopped = True
+        self.callSoon(lambda : None)
+
+    #-----------------------------------------
+
+    def __poll (self):
+        # Don't block if there's more work already queued up
+        block = not self._pending
+        if isinstance(self._poller, select.epoll):
+            return self._poller.poll(-1 if block else 0)
+        else:
+            return self._poller.poll(None if block else 0)
+
+    def __drainWakeups (self):
+        try:
+            while os.read(self._wake_r, 0x1000):
+                pass
+        except OSError as e:
+            if e.errno != errno.EAGAIN:
+                raise
+
+    def __runPending (self):
+        # Only run what's here now; anything these queue up waits for
+        # the next round, so we don't starve the sockets.
+        for i in range(len(self._pending)):
+            fn = self._pending.popleft()
+            try:
+                fn()
+            except Exception as e:
+                self.error("Uncaught exception in reactor callback: {0}".format(e))
+
+    def run (self):
+        while not self._stopped:
+            try:
+                events = self.__poll()
+            except (IOError, select.error) as e:
+                if e.args[0] == errno.EINTR:
+                    continue
+                raise
+            for (fd, ev) in events:
+                if fd == self._wake_r:
+                    self.__drainWakeups()
+                    continue
+                h = self._handlers.get(fd)
+                try:
+                    if h and (ev & (self.READ | self.ERR)):
+                        h.onReadable()
+                    if h and (ev & self.WRITE) and fd in self._handlers:
+                        h.onWritable()
+                except Exception as e:
+                    self.error("Uncaught exception in reactor handler: {0}".format(e))
+            self.__runPending()
+        self.info("leave reactor loop")
+
+##=======================================================================
+
+class ReactorGroup (object):
+    """
+    N reactors, each on its own thread, sharing out the connections.  Pass
+    a group wherever a reactor goes in tcp_opts, and each new connection
+    gets one reactor from pick(), which keeps its reads, writes and buffers
+    for as long as it's open.
+
+    policy -- how pick() chooses: ROUND_ROBIN, or LEAST_CONNECTIONS for
+        the reactor with the fewest registered sockets.
+    """
+
+    ROUND_ROBIN = "round_robin"
+    LEAST_CONNECTIONS = "least_connections"
+
+    def __init__ (self, n, policy=ROUND_ROBIN, log_obj=None,
+                  read_min=0x1000, read_max=0x40000):
+        if policy not in (self.ROUND_ROBIN, self.LEAST_CONNECTIONS):
+            raise ValueError("unknown reactor policy: {0}".format(policy))
+        self._policy = policy
+        self._turn = itertools.count()
+        self.reactors = [ Reactor(log_obj, read_min, read_max) for i in range(n) ]
+
+    def start (self):
+        for r in self.reactors:
+            r.start()
+
+    def stop (self):
+        for r in self.reactors:
+            r.stop()
+
+    def join (self, timeout=None):
+        for r in self.reactors:
+            r.join(timeout)
+
+    def pick (self):
+        if self._policy is self.LEAST_CONNECTIONS:
+            return min(self.reactors, key = lambda r: r.numHandlers())
+        else:
+            return self.reactors[next(self._turn) % len(self.reactors)]
+
+##=======================================================================
+
+def choose (r):
+    """
+    Given the "reactor" value from tcp_opts, pick the reactor that a new
+    connection should go on: True (or None) means the process-wide one,
+    and a ReactorGroup picks one of its own.
+    """
+    if r is True or r is None:
+        r = getDefault()
+    return r.pick()
+
+##=======================================================================
+
+_default = None
+_default_lock = threading.Lock()
+
+def getDefault ():
+    """Get the process-wide Reactor, starting it up the first time."""
+    global _default
+    _default_lock.acquire()
+    if not _default:
+        _default = Reactor()
+        _default.start()
+    _default_lock.release()
+    return _default
+
+##=======================================================================
@@ -1,4 +1,5 @@
 
+from collections import deque
 from err import RingError
 
 ##=======================================================================
@@ -6,72 +7,146 @@ from err import RingError
 class Ring (object):
     """
     A simple ring buffer for reading in data from network.
-    Every so often we'll compress smaller buffers into bigger
-    buffers, but try to limit that....
+
+    Incoming buffers are never sliced into new strings.  Instead, we
+    keep a read cursor into the head buffer and hand out memoryview
+    slices of it, so a frame that sits inside one recv() buffer gets
+    to the decoder without any copying at all.  Only a frame that
+    straddles two or more buffers forces a copy, and then just of
+    that frame's bytes.
     """
 
     def __init__ (self):
-        self._bufs = []
+        self._bufs = deque()
+        self._off = 0
         self._len = 0
+        self._n_copied = 0
 
     def buffer (self, b):
-        self._bufs.append(b)
-        self._len += len(b)
+        if len(b):
+            self._bufs.append(memoryview(b))
+            self._len += len(b)
+
+    def own (self):
+        """
+        Copy whatever is left in the ring into a buffer of our own, so that
+        buffers we were handed can be reused by their owner.
+        """
+        if self._len:
+            buf = bytearray()
+            for b in self.release():
+                buf += b
+            self._n_copied += len(buf)
+            self.buffer(buf)
 
     def __len__ (self):
         return self._len
 
+    def bytesCopied (self):
+        """The number of bytes this ring has copied in grab() so far;
+        useful for benchmarking."""
+        return self._n_copied
+
     #-----------------------------------------
 
     def grab (self, n_wanted):
         """Grab n_wanted bytes from the buffer as one continguous
-        bytearray.  This means we'll be concating a bunch of smaller
-        buffers into a bigger one.
+        memoryview.  If the bytes are split across several buffers,
+        we'll concat them into a new buffer, which then becomes the
+        new head of the ring.
         """
 
-        if n_wanted > len(self): 
-            buf = None
-        elif len(self._bufs) and len(self._bufs[0]) >= n_wanted: 
-            buf = self._bufs[0]
-        else:
-            n_grabbed = 0
-            num_bufs = 0
-
-            for b in self._bufs:
-                n_grabbed += len(b)
-                num_bufs += 1
-                if n_grabbed >= n_wanted:
-                    break
-
-            # now make a buffer that's potentially bigger than the one we
-            # wanted
-            buf = bytearray(0)
-
-            for b in self._bufs[0:num_bufs]:
+        if n_wanted > len(self):
+            return None
+
+        head = self._bufs[0]
+        off = self._off
+        if len(head) - off < n_wanted:
+
+            # Gather up exactly the bytes we need, starting at the read
+            # cursor of the head buffer.  The leftover part of the last
+            # buffer we touch stays where it is, as a memoryview slice.
+            buf = bytearray()
+            buf += head[off:]
+            self._bufs.popleft()
+            while len(buf) < n_wanted:
+                b = self._bufs.popleft()
+                need = n_wanted - len(buf)
+                if len(b) > need:
+                    self._bufs.appendleft(b[need:])
+                    b = b[0:need]
                 buf += b
 
-            # the first buffer we'll keep
-            first_pos = num_bufs - 1
-            self._bufs[first_pos] = buf
-            self._bufs = self._bufs[first_pos:]
+            self._n_copied += len(buf)
+            head = memoryview(buf)
+            off = self._off = 0
+            self._bufs.appendleft(head)
+
+        return head[off:off + n_wanted]
 
-        # Make sure to truncate the data and not to return too much....
-        ret = buf[0:n_wanted] if buf else None
+    #-----------------------------------------
+
+    def release (self):
+        """Empty out the ring, returning the buffers it held (as
+        memoryviews, in order)."""
+        ret = list(self._bufs)
+        if ret:
+            ret[0] = ret[0][self._off:]
+        self._bufs = deque()
+        self._off = 0
+        self._len = 0
         return ret
 
     #-----------------------------------------
-    
+
     def consume(self, n):
         """
         Consume n bytes from the buffer Ring. Assumes that grab(n)
-        has successfully been called, since it will only try to 
+        has successfully been called, since it will only try to
         remove the n bytes from one continguous array.
         """
-        if len(self._bufs) is 0 or len(self._bufs[0]) < n:
+        if len(self._bufs) is 0 or len(self._bufs[0]) - self._off < n:
             raise RingError("underflow; can't remove {0} bytes".format(n))
-        b = self._bufs[0]
-        if len(b) is n:
-            self._bufs = self._bufs[1:]
-        else:
-            self._bufs[0] = b[n:]
+        self._off += n
+        if self._off == len(self._bufs[0]):
+            self._bufs.popleft()
+            self._off = 0
         self._len -= n
+
+##=======================================================================
+
+class Arena (object):
+    """
+    A reusable buffer to recv_into.  The read size starts out small, and
+    doubles every time a read fills the whole thing, up to max_size; it
+    halves again after reads that fill less than a quarter of it.
+
+    Whoever reads into target() only borrows the buffer until the next
+    read, so anything that outlives that has to be copied out (see
+    Ring.own()).
+    """
+
+    def __init__ (self, min_size=0x1000, max_size=0x40000):
+        self._min = min_size
+        self._max = max(min_size, max_size)
+        self._size = min_size
+        self._buf = bytearray(min_size)
+
+    def size (self):
+        return self._size
+
+    def target (self):
+        """A writable view of the buffer, as big as the next read should be."""
+        return memoryview(self._buf)[0:self._size]
+
+    def adapt (self, n):
+        """Adjust the read size, given that the last read got n bytes."""
+        if n >= self._size and self._size < self._max:
+            self._size = min(self._size * 2, self._max)
+            if self._size > len(self._buf):
+                # Don't resize in place, since old views of the buffer
+                # might still be around.
+                self._buf = bytearray(self._size)
+        elif n < self._size // 4 and self._size > self._min:
+            self._size = max(self._size // 2, self._min)
+
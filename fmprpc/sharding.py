@@ -0,0 +1,173 @@
+import bisect
+import hashlib
+import struct
+import threading
+import log
+import transport
+import future
+
+##=======================================================================
+
+def _hash (s):
+    return struct.unpack(">Q", hashlib.md5(s).digest()[0:8])[0]
+
+##=======================================================================
+
+class HashRing (object):
+    """
+    A consistent-hash ring.  Each node gets vnodes points on the ring, and
+    a key belongs to the node with the first point at or after the key's
+    hash.  Adding or removing a node only moves the keys that it gains
+    or loses; everything else stays put.
+    """
+
+    def __init__ (self, vnodes=100):
+        self._vnodes = vnodes
+        self._points = []
+        self._owners = []
+        self._nodes = set()
+
+    def nodes (self):
+        return list(self._nodes)
+
+    def __len__ (self):
+        return len(self._nodes)
+
+    def add (self, node):
+        if node in self._nodes:
+            return
+        self._nodes.add(node)
+        for i in range(self._vnodes):
+            h = _hash("{0}#{1}".format(node, i))
+            j = bisect.bisect(self._points, h)
+            self._points.insert(j, h)
+            self._owners.insert(j, node)
+
+    def remove (self, node):
+        if node not in self._nodes:
+            return
+        self._nodes.remove(node)
+        keep = [ i for i in range(len(self._owners)) if self._owners[i] != node ]
+        self._points = [ self._points[i] for i in keep ]
+        self._owners = [ self._owners[i] for i in keep ]
+
+    def lookup (self, key):
+        """The node that owns the given key (a string), or None if the
+        ring is empty."""
+        if not self._points:
+            return None
+        i = bisect.bisect_left(self._points, _hash(key))
+        if i == len(self._points):
+            i = 0
+        return self._owners[i]
+
+##=======================================================================
+
+class ShardedClient (log.Base):
+    """
+    A Client for a cache-like service spread over several servers, where
+    each key has to go to the same server every time.  Each call names
+    its key, which is hashed onto a HashRing of the servers; each server
+    gets a RobustTransport.  Servers can come and go with addRemote()
+    and removeRemote(), and only the keys they gain or lose move.
+
+    remotes -- the servers' InternetAddresses.
+
+    program -- as for Client.
+
+    key_fn -- if given, key_fn(method, arg) picks the key for calls that
+        don't pass one.
+
+    Other keyword arguments go to the RobustTransports.
+    """
+
+    def __init__ (self, remotes, program=None, key_fn=None, vnodes=100,
+                  tcp_opts={}, log_obj=None, **kwargs):
+        self._program = program
+        self._key_fn = key_fn
+        self._tcp_opts = tcp_opts
+        self._kwargs = kwargs
+        self._ring = HashRing(vnodes)
+        self._transports = {}
+        self._lock = threading.Lock()
+        if not log_obj:
+            log_obj = log.newDefaultLogger()
+        log.Base.__init__(self, log_obj)
+        for r in remotes:
+            self.addRemote(r)
+
+    ##-----------------------------------------
+
+    def addRemote (self, remote):
+        """Add a server, and connect to it (in the background, if it
+        isn't up yet)."""
+        name = str(remote)
+        self._lock.acquire()
+        t = self._transports.get(name)
+        new = not t
+        if new:
+            # Making one doesn't connect it, so it's cheap enough in here
+            t = self._transports[name] = transport.RobustTransport(
+                remote = remote, tcp_opts = self._tcp_opts, **self._kwargs)
+            self._ring.add(name)
+        self._lock.release()
+        if new:
+            t.connect()
+        return t
+
+    def removeRemote (self, remote):
+        name = str(remote)
+        self._lock.acquire()
+        t = self._transports.pop(name, None)
+        self._ring.remove(name)
+        self._lock.release()
+        if t:
+            t.close()
+
+    def close (self):
+        self._lock.acquire()
+        ts = self._transports.values()
+        self._transports = {}
+        self._ring = HashRing(self._ring._vnodes)
+        self._lock.release()
+        for t in ts:
+            t.close()
+
+    ##-----------------------------------------
+
+    def transportFor (self, key):
+        """The transport that calls for the given key go out on."""
+        self._lock.acquire()
+        name = self._ring.lookup(str(key))
+        t = self._transports.get(name) if name else None
+        self._lock.release()
+        return t
+
+    ##-----------------------------------------
+
+    def __key (self, method, arg, key):
+        if key is None and self._key_fn:
+            key = self._key_fn(method, arg)
+        if key is None:
+            raise ValueError("no shard key for call to {0}".format(method))
+        return key
+
+    def invokeAsync (self, method, arg, key=None, timeout=None):
+        t = self.transportFor(self.__key(method, arg, key))
+        if not t:
+            ret = future.Future()
+            ret.complete(error = "no servers available")
+            return ret
+        return t.invokeAsync(program = self._program, method = method, arg = arg,
+                             timeout = timeout)
+
+    def invoke (self, method, arg, key=None, timeout=None):
+        return self.invokeAsync(method, arg, key, timeout).result()
+
+    def notify (self, method, arg, key=None):
+        t = self.transportFor(self.__key(method, arg, key))
+        if t:
+            t.invokeAsync(program = self._program, method = method, arg = arg,
+                          notify = True)
+
+##=======================================================================
@@ -0,0 +1,88 @@
+import heapq
+import itertools
+import threading
+import time
+import log
+
+##=======================================================================
+
+class Entry (object):
+    """Something scheduled on a TimerThread; cancel() it if it's no
+    longer needed."""
+
+    def __init__ (self, when, fn):
+        self.when = when
+        self.fn = fn
+
+    def cancel (self):
+        self.fn = None
+
+##=======================================================================
+
+class TimerThread (threading.Thread, log.Base):
+    """
+    One thread that runs all of the process's timeouts, rather than a
+    threading.Timer (and so a thread) apiece.  Callbacks run on this
+    thread, so they should be quick, and mustn't block.  One that raises
+    is logged, and doesn't hold up the rest.
+    """
+
+    def __init__ (self, log_obj=None):
+        threading.Thread.__init__(self)
+        log.Base.__init__(self, log_obj if log_obj else log.newDefaultLogger())
+        self.daemon = True
+        self._heap = []
+        self._order = itertools.count()
+        self._cond = threading.Condition()
+
+    def schedule (self, delay, fn):
+        """Call fn() in delay seconds; return an Entry."""
+        e = Entry(time.time() + delay, fn)
+        self._cond.acquire()
+        heapq.heappush(self._heap, (e.when, next(self._order), e))
+        if self._heap[0][2] is e:
+            self._cond.notify()
+        self._cond.release()
+        return e
+
+    def run (self):
+        self._cond.acquire()
+        while True:
+            now = time.time()
+            due = []
+            while self._heap and self._heap[0][0] <= now:
+                due.append(heapq.heappop(self._heap)[2])
+            if due:
+                self._cond.release()
+                for e in due:
+                    fn = e.fn
+                    if fn:
+                        try:
+                            fn()
+                        except Exception as ex:
+                            self.error("Uncaught exception in timer: {0}".format(ex))
+                self._cond.acquire()
+            elif self._heap:
+                self._cond.wait(self._heap[0][0] - now)
+            else:
+                self._cond.wait()
+
+##=======================================================================
+
+_default = None
+_default_lock = threading.Lock()
+
+def getDefault ():
+    """Get the process-wide TimerThread, starting it up the first time."""
+    global _default
+    _default_lock.acquire()
+    if not _default:
+        _default = TimerThread()
+        _default.start()
+    _default_lock.release()
+    return _default
+
+def schedule (delay, fn):
+    return getDefault().schedule(delay, fn)
+
+##=======================================================================
@@ -1,4 +1,6 @@
 import socket
+import errno
+import collections
 import log
 import dispatch
 import debug
@@ -10,49 +12,356 @@ import weakref
 import sys
 import address
 import err
+import ring
+import future
+import reactor
 
 ##=======================================================================
 
-class ConstantReader (threading.Thread, log.Base):
+class StreamReader (log.Base):
     """
-    A thread that will read on a socket, injecting any new data packets
-    into the packetizer.  It's important to note that this class doesn't
+    Reads whatever is waiting on a stream, and injects it into the
+    transport's packetizer.  It's important to note that this class doesn't
     get a real reference to the Transport it's working on behalf of, only
     a weak reference to it.  This way it won't keep a transport from
     going out of scope in the case of a client who has stop being 
     interested in a particular connection.
     """
-    def __init__ (self, wrapper):
+    def __init__ (self, wrapper, arena):
         self.wrapper = wrapper
         self.transport = wrapper.transport
+        self.arena = arena
         log.Base.__init__(self, self.transport().getLogger())
+
+    def readOnce (self):
+        """Do one read, and return False if the stream is done."""
+        t = self.transport()
+        if not t:
+            return False
+        go = True
+        op = None
+        n = 0
+        try:
+            # If the packetizer is assembling a big frame, read right
+            # into the frame's buffer.  Otherwise, read into our arena,
+            # and let the packetizer borrow from it.  If the stream can't
+            # read into a buffer, we have to settle for a copying read.
+            asm = t.packetizeTarget()
+            t = None
+            if asm:
+                n = self.wrapper.recvInto(asm.target())
+                op = lambda : self.transport().packetizeAssembled(asm, n)
+            elif self.wrapper.supportsRecvInto():
+                buf = self.arena.target()
+                n = self.wrapper.recvInto(buf)
+                op = lambda : self.transport().packetizeData(buf[0:n], borrowed = True)
+                self.arena.adapt(n)
+            else:
+                buf = self.wrapper.recv(self.arena.size())
+                n = len(buf) if buf else 0
+                op = lambda : self.transport().packetizeData(buf)
+                self.arena.adapt(n)
+            self.debug("Got {0} bytes".format(n))
+            if not n:
+                op = lambda : self.transport().handleClose(self.wrapper)
+                go = False
+        except IOError as e:
+            op = lambda : self.transport().handleError(e, self.wrapper)
+            go = False
+
+        # Any operations done on the transport should be atomic and protected
+        # by locks.  This includes shutting down the socket due to an EOF
+        # or an error.
+        if op and self.transport():
+            self.transport().atomicOp(op)
+        return go
+
+##=======================================================================
+
+class ConstantReader (threading.Thread, StreamReader):
+    """
+    A thread that reads on a socket for as long as it stays open.  This is
+    the default, and works for any kind of stream, at the cost of one
+    thread per connection.
+    """
+    def __init__ (self, wrapper):
+        opts = wrapper.transport()._tcp_opts
+        StreamReader.__init__(self, wrapper,
+            ring.Arena(opts.get("read_min", 0x1000), opts.get("read_max", 0x40000)))
         threading.Thread.__init__(self)
         self.daemon = True
 
+    def onReaderThread (self):
+        return threading.current_thread() is self
+
     def run (self):
         go = True
-
         while go and self.transport():
-            op = None
+            go = self.readOnce()
+        self.info("leave reader loop")
+
+##=======================================================================
+
+class ReactorReader (StreamReader):
+    """
+    Reads on a stream whenever a reactor.Reactor sees that it's readable,
+    so many connections can share one thread.  The socket stays in blocking
+    mode; we only ever read from it when a read won't block, and writes
+    go through a ReactorWriter (or a ConstantWriter), so they never block
+    the reactor.  All the readers on a reactor share its arena, since they
+    never read at the same time.
+    """
+    def __init__ (self, wrapper, r):
+        StreamReader.__init__(self, wrapper, r.arena)
+        self.reactor = r
+        self.fd = wrapper.readableFd()
+        self._registered = False
+
+    def onReaderThread (self):
+        return self.reactor.inLoop()
+
+    def start (self):
+        self._registered = True
+        self.reactor.register(self.fd, self, self.reactor.READ)
+
+    def stop (self, then):
+        """
+        Stop reading, and then call then(), on the reactor's thread.  We can
+        only close the socket after that, since otherwise its fd might get
+        reused by a new socket before the reactor lets go of it.
+        """
+        def op():
+            if self._registered:
+                self._registered = False
+                self.reactor.unregister(self.fd)
+            then()
+        if self.reactor.inLoop():
+            op()
+        else:
+            self.reactor.callSoon(op)
+
+    def onReadable (self):
+        if self._registered and not (self.transport() and self.readOnce()):
+            self.stop(lambda : None)
+
+    def onWritable (self):
+        w = self.wrapper.writer
+        if w:
+            w.flush()
+
+##=======================================================================
+
+class ReactorWriter (log.Base):
+    """
+    The writer for a stream read by a ReactorReader, so that no thread
+    ever blocks on a slow peer.  Senders, the reactor's own hooks and
+    callbacks among them, try a non-blocking send right away.  Whatever
+    doesn't fit waits in a queue, and the reactor sends it as the socket
+    has room.
+
+    hwm -- as for ConstantWriter: senders other than the reactor block in
+        waitForRoom() while more than this many bytes are queued.
+    """
+
+    # About the most we join up from small buffers for one send
+    SEND_CHUNK = 0x40000
+
+    _WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+    def __init__ (self, wrapper, r, fd, hwm):
+        self.wrapper = wrapper
+        self._reactor = r
+        self._fd = fd
+        self._hwm = hwm
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._off = 0
+        self._n_queued = 0
+        self._want_write = False
+        self._closed = False
+        log.Base.__init__(self, wrapper.getLogger())
+
+    @classmethod
+    def available (klass):
+        return hasattr(socket, "MSG_DONTWAIT")
+
+    def waitForRoom (self):
+        self._cond.acquire()
+        while self._n_queued > self._hwm and not self._closed:
+            self._cond.wait()
+        self._cond.release()
+
+    def enqueue (self, bufs):
+        """
+        Send the buffers, or as much of them as the socket takes, and
+        queue the rest; return False if the writer is stopped.  Raise an
+        IOError if the send fails, as a blocking write would.
+        """
+        self._cond.acquire()
+        ret = not self._closed
+        e = None
+        if ret:
+            self._queue.extend(bufs)
+            self._n_queued += sum([ len(b) for b in bufs ])
+            # If the reactor's waiting on room, it'll get to these in order
+            if not self._want_write:
+                e = self.__drain()
+        self._cond.release()
+        if e:
+            raise e
+        return ret
+
+    def flush (self):
+        """Send what's queued, on the reactor thread, once there's room."""
+        self._cond.acquire()
+        e = None if self._closed else self.__drain()
+        self._cond.release()
+        if e:
+            t = self.wrapper.transport()
+            if t:
+                t.atomicOp(lambda : t.handleError(e, self.wrapper))
+
+    def stop (self):
+        self._cond.acquire()
+        self._closed = True
+        self._queue.clear()
+        self._off = 0
+        self._n_queued = 0
+        self._cond.notifyAll()
+        self._cond.release()
+
+    def __drain (self):
+        # Call with the lock held; return the error if the send failed
+        s = self.wrapper.stream()
+        q = self._queue
+        e = None
+        while s and q:
+            data = util.nextSend(q, self._off, self.SEND_CHUNK)
             try:
-                buf = self.wrapper.recv(0x1000)
-                self.debug("Got data: {0}".format(util.formatRaw(buf)))
-                if buf:
-                    op = lambda : self.transport().packetizeData(buf)
-                else:
-                    op = lambda : self.transport().handleClose(self.wrapper)
-                    go = False
-            except IOError as e:
-                op = lambda : self.transport().handleError(e, self.wrapper)
-                go = False
+                n = s.send(data, socket.MSG_DONTWAIT)
+            except socket.error as err:
+                if err.errno not in self._WOULD_BLOCK:
+                    e = err
+                    break
+                n = 0
+            self._off = util.consumeSent(q, self._off, n)
+            self._n_queued -= n
+            if n < len(data):
+                break
+        if e:
+            q.clear()
+            self._off = 0
+            self._n_queued = 0
+        want = not not q
+        if want != self._want_write:
+            self._want_write = want
+            ev = self._reactor.READ
+            if want:
+                ev |= self._reactor.WRITE
+            self._reactor.modify(self._fd, ev)
+        if self._n_queued <= self._hwm:
+            self._cond.notifyAll()
+        return e
 
-            # Any operations done on the transport should be atomic and protected
-            # by locks.  This includes shutting down the socket due to an EOF
-            # or an error.
-            if op and self.transport():
-                self.transport().atomicOp(op)
+##=======================================================================
 
-        self.info("leave reader loop")
+class ConstantWriter (threading.Thread, log.Base):
+    """
+    A thread that owns all writes to one stream.  Senders just queue up
+    their buffers and return, rather than waiting on the socket while
+    holding the transport's lock.  Whatever has piled up in the queue
+    by the time the writer gets to it goes out in one vectored write.
+
+    hwm -- the high-water mark, in bytes.  Senders block in
+        waitForRoom() while more than this much data is queued, so a
+        slow peer can't make us buffer without bound.  They should do
+        that before taking the transport's lock, since enqueue() itself
+        never blocks.
+
+    flush_latency -- if nonzero, the number of seconds the writer will
+        hold on to a small write, waiting for more to join it.  Writes
+        of at least COALESCE bytes go out right away.
+    """
+
+    COALESCE = 0x10000
+
+    def __init__ (self, wrapper, hwm, flush_latency):
+        self.wrapper = wrapper
+        self._hwm = hwm
+        self._flush_latency = flush_latency
+        self._cond = threading.Condition()
+        self._queue = []
+        self._n_queued = 0
+        self._first_queued = 0
+        self._closed = False
+        log.Base.__init__(self, wrapper.getLogger())
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+    def waitForRoom (self):
+        self._cond.acquire()
+        while self._n_queued > self._hwm and not self._closed:
+            self._cond.wait()
+        self._cond.release()
+
+    def enqueue (self, bufs):
+        """Queue up the buffers; return False if the writer is stopped."""
+        self._cond.acquire()
+        ret = not self._closed
+        if ret:
+            if not self._queue:
+                self._first_queued = time.time()
+            self._queue.extend(bufs)
+            self._n_queued += sum([ len(b) for b in bufs ])
+            self._cond.notifyAll()
+        self._cond.release()
+        return ret
+
+    def stop (self):
+        self._cond.acquire()
+        self._closed = True
+        self._queue = []
+        self._n_queued = 0
+        self._cond.notifyAll()
+        self._cond.release()
+
+    def __grab (self):
+        """Wait for a batch of buffers to write; return None once stopped."""
+        self._cond.acquire()
+        while not self._queue and not self._closed:
+            self._cond.wait()
+        if self._flush_latency:
+            deadline = self._first_queued + self._flush_latency
+            now = time.time()
+            while (not self._closed and now < deadline and
+                   self._n_queued < self.COALESCE):
+                self._cond.wait(deadline - now)
+                now = time.time()
+        if self._closed:
+            ret = None
+        else:
+            ret = self._queue
+            self._queue = []
+            self._n_queued = 0
+            self._cond.notifyAll()
+        self._cond.release()
+        return ret
+
+    def run (self):
+        while True:
+            bufs = self.__grab()
+            if bufs is None:
+                break
+            try:
+                self.wrapper.writevNow(bufs)
+            except IOError as e:
+                t = self.wrapper.transport()
+                if t:
+                    t.atomicOp(lambda : t.handleError(e, self.wrapper))
+                break
+        # Make sure no sender is left blocked on a dead writer
+        self.stop()
+        self.info("leave writer loop")
 
 ##=======================================================================
 
@@ -61,6 +370,10 @@ class ClearStreamWrapper (log.Base):
     A shared wrapper around a socket, for which close() is idempotent. Of course,
     no encyrption on this interface.
     """
+
+    # The most buffers we'll hand to one sendmsg(2) call
+    IOV_MAX = 1024
+
     def __init__ (self, s, transport):
         # Disable Nagle by default on all sockets...
         s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
@@ -68,6 +381,8 @@ class ClearStreamWrapper (log.Base):
         self.generation = transport().nextGeneration()
         self.write_closed_warn = False
         self.reader = None
+        self.writer = None
+        self._write_lock = threading.Lock()
         self.transport = transport
         self._credentials = None
         log.Base.__init__(self, transport().getLogger())
@@ -81,14 +396,29 @@ class ClearStreamWrapper (log.Base):
     def start(self):
         """
         Activate this wrapper.  Do any necessary handshaking and also
-        start the persistent reading thread to gather incoming data.
+        start the persistent reading thread to gather incoming data,
+        and the writer thread if the transport wants one.
         """
-        self.__launchConstantReader()
+        opts = self.transport()._tcp_opts
+        r = opts.get("reactor")
+        r = reactor.choose(r) if r and self.readableFd() is not None else None
+        hwm = opts.get("write_hwm", 0x400000)
+        if opts.get("write_queue") or (r and not ReactorWriter.available()):
+            self.writer = ConstantWriter(self, hwm = hwm,
+                flush_latency = opts.get("flush_latency", 0))
+            self.writer.start()
+        elif r:
+            # Ready before the reader, since its hooks might reply at once
+            self.writer = ReactorWriter(self, r, self.readableFd(), hwm)
+        self.__launchReader(r)
         return True
 
-    def __launchConstantReader(self):
+    def __launchReader(self, r):
         if self.reader:
             self.error("Refusing to launch a second reader...")
+        elif r:
+            self.reader = ReactorReader(self, r)
+            self.reader.start()
         else:
             self.reader = ConstantReader(self)
             self.reader.start()
@@ -98,8 +428,12 @@ class ClearStreamWrapper (log.Base):
             # Force the shutdown in the case of an explicit close
             # or a transport going out of scope.  Shutting down
             # the socket with this call will cause the ConstantReader
-            # loop to see and EOF and to exit.
-            x.shutdown(socket.SHUT_RDWR)
+            # loop to see and EOF and to exit.  It might have been shut
+            # down already, if a handshake ran out of time.
+            try:
+                x.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
         x.close()
 
     def close (self, force):
@@ -111,12 +445,17 @@ class ClearStreamWrapper (log.Base):
             ret = True
             x = self._socket
             self._socket = None
+            if self.writer:
+                self.writer.stop()
             t = self.transport()
             if t:
                 t.dispatchReset()
                 t.packetizerReset()
 
-            self.shutdownStream(x, force)
+            if isinstance(self.reader, ReactorReader):
+                self.reader.stop(lambda : self.shutdownStream(x, force))
+            else:
+                self.shutdownStream(x, force)
         return ret
 
     def write (self, msg):
@@ -124,12 +463,67 @@ class ClearStreamWrapper (log.Base):
         Write the message to the socket, calling send(2) repeatedly
         until the buffer is flushed out.  Use low-level socket calls.
         """
-        self.debug("writing data: {0}".format(util.formatRaw(msg)))
-        if self.stream():
-            self.stream().sendall(msg)
+        self.writev([ msg ])
+
+    def writev (self, bufs):
+        """
+        Write the list of buffers to the stream, or if there's a
+        writer, hand them to it and return.
+        """
+        if self.writer:
+            return self.writer.enqueue(bufs)
+        else:
+            return self.writevNow(bufs)
+
+    def waitForRoom (self):
+        """
+        Block until the writer's queue is below its high-water mark.  The
+        reader thread never waits, since the writer might be waiting on
+        the peer, which might in turn be waiting on us to read.
+        """
+        if self.writer and not (self.reader and self.reader.onReaderThread()):
+            self.writer.waitForRoom()
+
+    def writevNow (self, bufs):
+        """
+        Write the list of buffers to the stream in as few system calls
+        as we can: with sendmsg(2) if the stream has it, and otherwise
+        with one sendall() of all the buffers joined together.  Either
+        way, TLS and SSH streams see one big write, not one per buffer.
+
+        Senders don't hold the transport's lock, so we have our own, to
+        keep writes from different threads from getting interleaved.
+        Return False if the stream was closed.
+        """
+        s = self.stream()
+        if s:
+            self.debug("writing {0} bytes in {1} buffers".format(
+                sum([ len(b) for b in bufs ]), len(bufs)))
+            self._write_lock.acquire()
+            try:
+                if hasattr(s, "sendmsg"):
+                    self.__sendmsgAll(s, bufs)
+                elif len(bufs) is 1:
+                    s.sendall(bufs[0])
+                else:
+                    s.sendall("".join(bufs))
+            finally:
+                self._write_lock.release()
+            return True
         elif not self.write_closed_warn:
             self.write_closed_warn = True
             self.warn("write on closed stream")
+        return False
+
+    def __sendmsgAll (self, s, bufs):
+        bufs = list(bufs)
+        while bufs:
+            n = s.sendmsg(bufs[0:self.IOV_MAX])
+            while bufs and n >= len(bufs[0]):
+                n -= len(bufs[0])
+                bufs.pop(0)
+            if n:
+                bufs[0] = memoryview(bufs[0])[n:]
 
     def recv(self, n):
         if self.stream():
@@ -138,6 +532,37 @@ class ClearStreamWrapper (log.Base):
             self.warn("calling recv on a closed socket")
             return None
 
+    def recvInto(self, buf):
+        """
+        Read into the given writable buffer, returning the number of
+        bytes read (0 on EOF).  If the stream can't read into a buffer
+        directly (see supportsRecvInto), fall back to a copying read.
+        """
+        s = self.stream()
+        if not s:
+            self.warn("calling recvInto on a closed socket")
+            return 0
+        elif self.supportsRecvInto():
+            return s.recv_into(buf)
+        else:
+            b = s.recv(len(buf))
+            buf[0:len(b)] = b
+            return len(b)
+
+    def supportsRecvInto(self):
+        """Subclasses whose stream() isn't a real socket should
+        return False here."""
+        return True
+
+    def readableFd(self):
+        """
+        The file descriptor a reactor can poll to know that a read on the
+        stream won't block.  Subclasses that buffer data above the socket
+        (like TLS or SSH) should return None here, and they'll get a
+        ConstantReader thread instead.
+        """
+        return self._socket.fileno() if self._socket else None
+
     def stream (self): return self._socket
     def isConnected (self): return not not self._socket
     def getGeneration (self): return self.generation
@@ -154,6 +579,33 @@ class ClearStreamWrapper (log.Base):
 class Transport (dispatch.Dispatch):
     """
     A wrapper around a TCP stream (given by the parameter socket).
+
+    tcp_opts is a dictionary of options for the stream; so far:
+
+    read_min, read_max -- the range of sizes for each read from the
+        stream.  Reads start at read_min (4 KB) and double each time
+        one fills the whole buffer, up to read_max (256 KB).
+
+    engine -- which packetizer engine decodes incoming data;
+        Packetizer.FRAME_ENGINE (the default) or Packetizer.UNPACKER_ENGINE.
+
+    write_queue -- if True, a ConstantWriter thread does all writes
+        to the stream, and senders just queue up their data.
+
+    write_hwm -- with write_queue, the number of queued bytes past
+        which senders block (4 MB by default).
+
+    flush_latency -- with write_queue, how many seconds a small write
+        may wait for others to coalesce with (0 by default).
+
+    reactor -- if set, read from the stream when this reactor.Reactor
+        finds it readable, instead of on a ConstantReader thread of its
+        own (True means the process-wide reactor).  A reactor.ReactorGroup
+        works too, and puts each connection on one of its reactors.  Only
+        streams with a readableFd() can do this; the rest get a thread.
+        Without write_queue, writes to such a stream never block either:
+        what the socket won't take right away waits for the reactor to
+        send it, and write_hwm applies as with write_queue.
     """
 
     def __init__ (self, remote=None, tcp_opts={}, 
@@ -174,6 +626,8 @@ class Transport (dispatch.Dispatch):
 
         self._remote = remote
         self._tcp_opts = tcp_opts
+        if tcp_opts.get("engine"):
+            self.setEngine(tcp_opts["engine"])
         self._explicit_close = False
         self._handshake_error = False
         self._parent = parent
@@ -366,8 +820,10 @@ class Transport (dispatch.Dispatch):
 
     def atomicOp(self,op):
         self._lock.acquire()
-        op()
-        self._lock.release()
+        try:
+            op()
+        finally:
+            self._lock.release()
    
     ##-----------------------------------------
 
@@ -474,10 +930,20 @@ class Transport (dispatch.Dispatch):
     # To fulfill the packetizer contract, the following...
   
     def rawWrite (self, msg):
-        if not self._stream_w:
+        self.rawWritev([ msg ])
+
+    def rawWritev (self, bufs):
+        w = self._stream_w
+        if not w:
             self.warn("write attempt with no active stream")
+            return False
         else:
-            self._stream_w.write(msg)
+            return w.writev(bufs)
+
+    def waitForRoom (self):
+        w = self._stream_w
+        if w:
+            w.waitForRoom()
  
     ##-----------------------------------------
 
@@ -530,6 +996,7 @@ class RobustTransport (Transport):
         self._error_threshhold = error_threshhold
         self._time_rpcs = (warn_threshhold or error_threshhold)
         self._condition = threading.Condition()
+        self._n_waiters = 0
    
     ##-----------------------------------------
 
@@ -565,7 +1032,11 @@ class RobustTransport (Transport):
                 if ok:
                     go = False
                 else:
+                    # Don't hold the lock while we wait, or an explicit
+                    # close() would be stuck behind us forever.
+                    self._lock.release()
                     time.sleep(self._reconnect_delay)
+                    self._lock.acquire()
 
         if self.isConnected():
             s = "" if (i is 1) else "s"
@@ -576,74 +1047,98 @@ class RobustTransport (Transport):
 
     ##-----------------------------------------
 
-    def __timedInvoke (self, program, method, arg, notify):
+    def __timedInvoke (self, **kwargs):
 
         eth = self._error_threshhold
         wth = self._warn_threshhold
-        timer = None
-        m = self.makeMethod(program,method)
-
-        def __do_timeout():
-            if inv:
-                self.error("RPC call to '{0}' is taking > {1}s".format(m, eth))
-                timer = None
-
-        if eth:
-            timer = threading.Timer(eth, __do_timeout)
+        m = self.makeMethod(kwargs.get("program"), kwargs.get("method"))
 
         start = time.time()
-        inv = self.newInvocation(program=program, method=method, arg=arg, notify=notify)
-        e,ret = inv.invoke()
-        if e: raise err.RpcCallError(e)
-        dur = time.time() - start
 
-        if eth and eth <= dur: fn = self.error
-        elif wth and wth <= dur: fn = self.warn
-        else: fn = None
-
-        if fn:
-            fn("RPC call to '{0}' finished in {1}s".format(m, dur))
-
-        if timer:
-            timer.cancel()
+        def __done (f):
+            dur = time.time() - start
+            if eth and eth <= dur: fn = self.error
+            elif wth and wth <= dur: fn = self.warn
+            else: fn = None
+            if fn:
+                fn("RPC call to '{0}' finished in {1}s".format(m, dur))
 
+        ret = Transport.invokeAsync(self, **kwargs)
+        ret.addCallback(__done)
         return ret
 
     ##-----------------------------------------
 
-    def __waitInQueue(self):
+    def __waitInQueue(self, deadline):
+        """Wait for a reconnect (or a close), until the deadline if there
+        is one; return False if it passed first."""
         self._condition.acquire()
         self._n_waiters += 1
-        self._condition.wait()
+        # Look again under the lock, so we can't miss the poke
+        if not (self.isConnected() or self._explicit_close):
+            self._condition.wait(None if deadline is None
+                                 else max(deadline - time.time(), 0))
         self._n_waiters -= 1
         self._condition.release()
+        return (deadline is None or self.isConnected() or self._explicit_close
+                or time.time() < deadline)
+
+    ##-----------------------------------------
+
+    def close(self):
+        Transport.close(self)
+        # No reconnect is coming for anyone in the queue
+        self.__pokeQueue()
 
     ##-----------------------------------------
 
-    def invoke(self, **kwargs):
+    def invokeAsync(self, **kwargs):
+        """
+        Like Transport.invokeAsync(), but if we're waiting on a reconnect,
+        block in the queue until we're connected again, or the call's
+        timeout is up.  Dispatch.invoke() calls this too, so it's robust
+        in the same way.  With queue=False, fail right away instead.  A
+        call we couldn't send fails with its future marked unsent.
+        """
         meth = self.makeMethod(kwargs.get("program"), kwargs.get("method"))
+        queue = kwargs.pop("queue", True)
+        timeout = kwargs.get("timeout")
+        deadline = None if timeout is None else time.time() + timeout
         ret = None
+        error = None
         go = True
         while go:
             go = False
             if self.isConnected():
+                if deadline is not None:
+                    # Whatever's left of it after our wait in the queue
+                    kwargs["timeout"] = max(deadline - time.time(), 0)
                 if self._time_rpcs:
                     ret = self.__timedInvoke(**kwargs)
                 else:
-                    ret = Transport.invoke(self, **kwargs)
+                    ret = Transport.invokeAsync(self, **kwargs)
             elif self._explicit_close:
                 self.warn("Invoked call to '{0}' after explicit close".format(meth))
-            elif self._n_waiters < self._queue_max:
-                self.__waitInQueue()
+                error = "transport closed"
+            elif not queue:
+                error = "not connected"
+            elif self._n_waiters >= self._queue_max:
+                self.warn("Queue overflow at '{0}'".format(meth))
+                error = "reconnect queue full"
+            elif self.__waitInQueue(deadline):
                 go = True
             else:
-                self.warn("Queue overflow at '{0}'".format(meth))
+                error = "timed out after {0}s".format(timeout)
+        if not ret:
+            ret = future.Future()
+            ret.setUnsent()
+            ret.complete(error = error)
         return ret
   
 ##=======================================================================
 
 def createTransport(**kwargs):
-    if kwargs.get('robust'):
+    if util.safepop(kwargs, 'robust'):
         ret = RobustTransport(**kwargs)
     else:
         ret = Transport(**kwargs)
@@ -0,0 +1,194 @@
+import threading
+import time
+import log
+import transport
+import future
+
+##=======================================================================
+
+class TransportPool (log.Base):
+    """
+    A handful of connections to the same remote, which together act like
+    one transport: hand the pool to a Client, and each call goes out on
+    the connection with the fewest calls outstanding.  That spreads the
+    load over several streams, reader threads and locks, which one
+    Transport can't do.
+
+    remote, tcp_opts, log_obj -- as for Transport.
+
+    robust -- make RobustTransports rather than plain Transports (with
+        any extra keyword arguments passed along to them).
+
+    min_size, max_size -- the pool keeps at least min_size connections
+        open, and opens more as needed, up to max_size.
+
+    grow_at -- open another connection when even the least busy one has
+        this many calls outstanding.
+
+    idle_timeout -- close connections beyond min_size that haven't had
+        a call in this many seconds.
+
+    A plain Transport that drops is thrown away, and a new one takes its
+    place if we're below min_size.  RobustTransports reconnect on their
+    own, and just don't get calls while they're down.
+    """
+
+    def __init__ (self, remote, min_size=1, max_size=8, grow_at=16,
+                  idle_timeout=60, robust=False, tcp_opts={}, log_obj=None,
+                  **kwargs):
+        self._remote = remote
+        self._min_size = min_size
+        self._max_size = max_size
+        self._grow_at = grow_at
+        self._idle_timeout = idle_timeout
+        self._robust = robust
+        self._tcp_opts = tcp_opts
+        self._kwargs = kwargs
+        self._transports = []
+        self._last_used = {}
+        self._n_opening = 0
+        self._last_reap = time.time()
+        self._closed = False
+        self._lock = threading.Lock()
+        if not log_obj:
+            log_obj = log.newDefaultLogger()
+            log_obj.setRemote(remote)
+        log.Base.__init__(self, log_obj)
+
+    ##-----------------------------------------
+
+    def size (self):
+        return len(self._transports)
+
+    def transports (self):
+        return list(self._transports)
+
+    def isConnected (self):
+        return any([ t.isConnected() for t in self._transports ])
+
+    ##-----------------------------------------
+
+    def connect (self):
+        """Open min_size connections; return True if any of them worked."""
+        self._lock.acquire()
+        n = self._min_size - len(self._transports) - self._n_opening
+        self._n_opening += max(n, 0)
+        self._lock.release()
+        for i in range(n):
+            self.__open()
+        return self.isConnected()
+
+    ##-----------------------------------------
+
+    def close (self):
+        self._lock.acquire()
+        self._closed = True
+        ts = self._transports
+        self._transports = []
+        self._last_used = {}
+        self._lock.release()
+        for t in ts:
+            t.close()
+
+    ##-----------------------------------------
+
+    def __open (self):
+        """
+        Open a new connection, and add it to the pool if it works (or if
+        it's robust, and will keep trying).  The caller should have counted
+        it in _n_opening.
+        """
+        t = transport.createTransport(remote = self._remote,
+            tcp_opts = self._tcp_opts, robust = self._robust, **self._kwargs)
+        ok = t.connect()
+        self._lock.acquire()
+        self._n_opening -= 1
+        added = not self._closed and (ok or self._robust)
+        if added:
+            self._transports.append(t)
+            self._last_used[t] = time.time()
+        self._lock.release()
+        if not added:
+            t.close()
+        return t if added else None
+
+    def __openInBackground (self):
+        th = threading.Thread(target = self.__open)
+        th.daemon = True
+        th.start()
+
+    ##-----------------------------------------
+
+    def __prune (self, now):
+        """Drop dead plain transports, and idle ones beyond min_size.
+        Call with the lock held; return the ones to close."""
+        dead = []
+        if not self._robust:
+            dead = [ t for t in self._transports if not t.isConnected() ]
+        if self._idle_timeout and now - self._last_reap > self._idle_timeout / 2.0:
+            self._last_reap = now
+            extra = len(self._transports) - len(dead) - self._min_size
+            for t in self._transports:
+                if extra <= 0:
+                    break
+                if (t not in dead and not t.outstanding() and
+                        now - self._last_used[t] > self._idle_timeout):
+                    dead.append(t)
+                    extra -= 1
+        for t in dead:
+            self._transports.remove(t)
+            del self._last_used[t]
+        return dead
+
+    ##-----------------------------------------
+
+    def __pick (self):
+        """Get the connection for the next call, opening one if need be."""
+        now = time.time()
+        self._lock.acquire()
+        dead = self.__prune(now)
+        live = [ t for t in self._transports if t.isConnected() ]
+        best = min(live, key = lambda t: t.outstanding()) if live else None
+        n = len(self._transports) + self._n_opening
+        grow = (n < self._max_size and
+                (n < self._min_size or not best or best.outstanding() >= self._grow_at))
+        if grow:
+            self._n_opening += 1
+        if best:
+            self._last_used[best] = now
+        self._lock.release()
+
+        for t in dead:
+            t.close()
+        if grow and best:
+            # Don't hold up this call; it can go on the best we've got
+            self.__openInBackground()
+        elif grow:
+            best = self.__open()
+            if best and not best.isConnected():
+                best = None
+        return best
+
+    ##-----------------------------------------
+
+    def invokeAsync (self, program=None, method=None, arg=None, notify=False,
+                     timeout=None):
+        """Like Transport.invokeAsync(), on the least busy connection."""
+        t = self.__pick()
+        if t:
+            ret = t.invokeAsync(program = program, method = method, arg = arg,
+                                notify = notify, timeout = timeout)
+        else:
+            ret = future.Future()
+            ret.setUnsent()
+            ret.complete(error = "not connected")
+        return ret
+
+    ##-----------------------------------------
+
+    def invoke (self, program=None, method=None, arg=None, notify=False,
+                timeout=None):
+        return self.invokeAsync(program = program, method = method,
+                                arg = arg, notify = notify, timeout = timeout).result()
+
+##=======================================================================
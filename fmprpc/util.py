@@ -1,6 +1,8 @@
 import re
 import datetime, time, functools, operator, types
 import binascii
+import itertools
+import msgpack
 
 ##=======================================================================
 
@@ -35,6 +37,59 @@ def safepop(d, k):
 
 ##=======================================================================
 
+def nextSend(bufs, off, limit):
+    """
+    What to hand to a non-blocking send(2) next, from a deque of buffers
+    waiting to go, off bytes into the first.  A first buffer of at least
+    limit bytes goes as it is; otherwise, small buffers are joined up to
+    about limit.  So each byte is copied at most once, however many
+    tries it takes to get it out.
+    """
+    first = bufs[0]
+    if len(first) - off >= limit or len(bufs) == 1:
+        return memoryview(first)[off:] if off else first
+    parts = [ first[off:] ]
+    n = len(parts[0])
+    for b in itertools.islice(bufs, 1, None):
+        if n + len(b) > limit and n:
+            break
+        parts.append(b)
+        n += len(b)
+    return "".join(parts)
+
+def consumeSent(bufs, off, n):
+    """Take n more sent bytes off the front of bufs; return the new offset."""
+    off += n
+    while bufs and off >= len(bufs[0]):
+        off -= len(bufs.popleft())
+    return off
+
+##=======================================================================
+
+def canonicalPack(obj):
+    """
+    msgpack obj with the keys of its dicts in sorted order, so that equal
+    objects always encode the same.  Good for keying on a call's arg.
+    """
+    p = msgpack.Packer(autoreset=False)
+    _packCanonical(p, obj)
+    return p.bytes()
+
+def _packCanonical(p, obj):
+    if isinstance(obj, dict):
+        p.pack_map_header(len(obj))
+        for k in sorted(obj.keys()):
+            _packCanonical(p, k)
+            _packCanonical(p, obj[k])
+    elif isinstance(obj, (list, tuple)):
+        p.pack_array_header(len(obj))
+        for x in obj:
+            _packCanonical(p, x)
+    else:
+        p.pack(obj)
+
+##=======================================================================
+
 default_fudge = datetime.timedelta(seconds=0, microseconds=0, days=0)
  
 def deep_eq(_v1, _v2, datetime_fudge=default_fudge, _assert=False):
@@ -0,0 +1,109 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import fmprpc.log as log
+import fmprpc.server as server
+import fmprpc.aio as aio
+from fmprpc.reactor import Reactor
+
+log.Levels.setDefault(log.Levels.WARN)
+
+class P_v1 (server.Handler):
+    def h_double (self, b):
+        b.reply(b.arg * 2)
+    def h_broken (self, b):
+        raise ValueError("broken")
+    def h_big (self, b):
+        b.reply("x" * b.arg)
+    def h_relay (self, b):
+        # Don't block the reactor; reply once the inner call comes back
+        f = self.server.relay.invokeAsync(program = "P.1", method = "double", arg = b.arg)
+        f.addCallback(lambda f: b.reply(f.result() + 1))
+
+class ThreadedServer(threading.Thread):
+    def __init__ (self, port, cond):
+        threading.Thread.__init__(self)
+        self.srv = server.ContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = port),
+            classes = { "P.1" : P_v1 })
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class AioTest(unittest.TestCase):
+
+    PORT = 50013
+    THREADED_PORT = 50014
+
+    @classmethod
+    def setUpClass(klass):
+        klass.reactor = Reactor()
+        klass.reactor.start()
+        klass.opts = { "reactor" : klass.reactor }
+        klass.srv = aio.AioContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = klass.PORT),
+            classes = { "P.1" : P_v1 },
+            tcp_opts = klass.opts)
+        klass.srv.listenRetry(2)
+
+        c = threading.Condition()
+        c.acquire()
+        klass.threaded = ThreadedServer(klass.THREADED_PORT, c)
+        klass.threaded.start()
+        c.wait()
+        c.release()
+
+        klass.srv.relay = aio.AioTransport(
+            remote = fmprpc.InternetAddress(port = klass.THREADED_PORT),
+            tcp_opts = klass.opts)
+        assert klass.srv.relay.connect()
+
+    def __volley(self, t):
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, "P.1")
+        futures = [ c.invokeAsync("double", i) for i in range(2000) ]
+        self.assertEqual([ f.result(timeout = 10) for f in futures ],
+            [ i * 2 for i in range(2000) ])
+        self.assertEqual(len(c.invoke("big", 0x200000)), 0x200000)
+        # Lots of big writes at once, so they back up and drain in pieces
+        args = [ chr(65 + i % 26) * 0x8000 for i in range(300) ]
+        futures = [ c.invokeAsync("double", a) for a in args ]
+        self.assertTrue(all([ f.result(timeout = 30) == a * 2
+                              for (f, a) in zip(futures, args) ]))
+        self.assertEqual(c.invoke("relay", 10), 21)
+        # A hook that raises on the reactor still answers
+        self.assertEqual(c.invokeAsync("broken", None).pair(5)[0],
+                         "uncaught exception in P.1.broken")
+        t.close()
+
+    def test_threaded_client(self):
+        self.__volley(fmprpc.Transport(
+            remote = fmprpc.InternetAddress(port = self.PORT)))
+
+    def test_aio_client(self):
+        self.__volley(aio.AioTransport(
+            remote = fmprpc.InternetAddress(port = self.PORT),
+            tcp_opts = self.opts))
+
+    def test_aio_client_threaded_server(self):
+        t = aio.AioTransport(
+            remote = fmprpc.InternetAddress(port = self.THREADED_PORT),
+            tcp_opts = self.opts)
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, "P.1")
+        self.assertEqual(c.invoke("double", 21), 42)
+        t.close()
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.srv.relay.close()
+        klass.srv.close()
+        klass.threaded.srv.close()
+        klass.reactor.stop()
+        klass.reactor.join(5)
+
+if __name__ == "__main__":
+    unittest.main()
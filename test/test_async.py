@@ -0,0 +1,102 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import fmprpc.log as log
+import fmprpc.server as server
+import fmprpc.err as err
+
+log.Levels.setDefault(log.Levels.WARN)
+
+class P_v1 (server.Handler):
+    def h_double (self, b):
+        b.reply(b.arg * 2)
+    def h_fail (self, b):
+        b.error("nope")
+    def h_poke (self, b):
+        self.server.poked.set()
+
+class ServerThread(threading.Thread):
+    def __init__ (self, port, prog, cond):
+        threading.Thread.__init__(self)
+        bindto = fmprpc.OpenServerAddress(port = port)
+        self.srv = server.ContextualServer(
+            bindto = bindto,
+            classes = { prog : P_v1 }
+        )
+        self.srv.poked = threading.Event()
+        self.daemon = True
+        self.cond = cond
+
+    def run(self):
+        self.srv.listenRetry(2,self.cond)
+
+    def stop(self):
+        self.srv.close()
+
+class AsyncTest(unittest.TestCase):
+
+    PORT = 50012
+    PROG = "P.1"
+
+    @classmethod
+    def setUpClass(klass):
+        c = threading.Condition()
+        c.acquire()
+        t = ServerThread(klass.PORT, klass.PROG, c)
+        klass.server_thread = t
+        t.start()
+        c.wait()
+        c.release()
+
+    def __run(self, t):
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, self.PROG)
+        got = []
+        futures = [ c.invokeAsync("double", i) for i in range(2000) ]
+        for f in futures:
+            f.addCallback(lambda f: got.append(f.result()))
+        self.assertEqual([ f.result(timeout = 10) for f in futures ],
+            [ i * 2 for i in range(2000) ])
+        self.assertEqual(sorted(got), [ i * 2 for i in range(2000) ])
+        self.assertRaises(err.RpcCallError, c.invokeAsync("fail", None).result)
+        self.assertEqual(c.invoke("double", 4), 8)
+        c.notify("poke", None)
+        self.assertTrue(self.server_thread.srv.poked.wait(5))
+        t.close()
+
+    def test_transport(self):
+        self.__run(fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT)))
+
+    def test_robust_transport(self):
+        self.__run(fmprpc.RobustTransport(remote = fmprpc.InternetAddress(port = self.PORT)))
+
+    def test_raising_callback(self):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT))
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, self.PROG)
+        got = []
+        f = c.invokeAsync("double", 1)
+        f.addCallback(lambda f: 1 / 0)
+        f.addCallback(lambda f: got.append(f.result()))
+        self.assertEqual(f.result(timeout = 2), 2)
+        # The rest of the callbacks ran, and the reader's still reading
+        self.assertEqual(c.invokeAsync("double", 3).result(timeout = 2), 6)
+        self.assertEqual(got, [ 2 ])
+        t.close()
+
+    def test_not_connected(self):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT))
+        c = fmprpc.Client(t, self.PROG)
+        f = c.invokeAsync("double", 1)
+        self.assertTrue(f.done())
+        self.assertRaises(err.RpcCallError, f.result)
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server_thread.stop()
+        del klass.server_thread
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,123 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+from fmprpc.balancer import Balancer
+from fmprpc.future import Future
+
+log.Levels.setDefault(log.Levels.ERROR)
+
+class P_v1 (server.Handler):
+    def h_work (self, b):
+        time.sleep(self.server.delay)
+        b.reply(self.server.port)
+
+class ServerThread(threading.Thread):
+    def __init__ (self, port, delay, cond):
+        threading.Thread.__init__(self)
+        self.srv = server.ContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = port),
+            classes = { "P.1" : P_v1 })
+        self.srv.port = port
+        self.srv.delay = delay
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class BalancerTest(unittest.TestCase):
+
+    PORTS = [ 50022, 50023, 50024 ]
+    DEAD_PORT = 50025
+    DELAYS = [ 0.001, 0.001, 0.05 ]
+
+    @classmethod
+    def setUpClass(klass):
+        klass.servers = []
+        for (port, delay) in zip(klass.PORTS, klass.DELAYS):
+            c = threading.Condition()
+            c.acquire()
+            t = ServerThread(port, delay, c)
+            t.start()
+            c.wait()
+            c.release()
+            klass.servers.append(t)
+
+    def test_spread(self):
+        remotes = [ fmprpc.InternetAddress(port = p) for p in self.PORTS + [ self.DEAD_PORT ] ]
+        b = Balancer(remotes, reconnect_delay = 0.1)
+        self.assertTrue(b.connect())
+        c = fmprpc.Client(b, "P.1")
+        counts = dict([ (p, 0) for p in self.PORTS ])
+        for i in range(20):
+            futures = [ c.invokeAsync("work", None) for j in range(10) ]
+            for f in futures:
+                counts[f.result(timeout = 10)] += 1
+        # The dead endpoint never gets a call, and the slow one gets few
+        self.assertEqual(sum(counts.values()), 200)
+        self.assertFalse(b.endpoints()[3].isUp())
+        self.assertTrue(counts[self.PORTS[2]] < counts[self.PORTS[0]])
+        self.assertTrue(counts[self.PORTS[2]] < counts[self.PORTS[1]])
+        b.close()
+
+    def test_none_up(self):
+        b = Balancer([ fmprpc.InternetAddress(port = self.DEAD_PORT) ], reconnect_delay = 0.1)
+        self.assertFalse(b.connect())
+        f = fmprpc.Client(b, "P.1").invokeAsync("work", None)
+        self.assertTrue(f.done())
+        self.assertEqual(f.error(), "no endpoints available")
+        b.close()
+
+    def test_failover(self):
+        b = Balancer([ fmprpc.InternetAddress(port = p) for p in self.PORTS[0:2] ])
+        self.assertTrue(b.connect())
+        def unsendable (**kwargs):
+            f = Future()
+            f.setUnsent()
+            f.complete(error = "whatever the wording")
+            return f
+        b.endpoints()[0].transport.invokeAsync = unsendable
+        c = fmprpc.Client(b, "P.1")
+        self.assertEqual([ c.invoke("work", None) for i in range(10) ], [ self.PORTS[1] ] * 10)
+
+        # A real call that can't go out says so
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.DEAD_PORT))
+        f = fmprpc.Client(t, "P.1").invokeAsync("work", None)
+        self.assertEqual((f.error(), f.wasSent()), ("not connected", False))
+        b.close()
+
+    def test_robust_unsent(self):
+        t = fmprpc.RobustTransport(remote = fmprpc.InternetAddress(port = self.DEAD_PORT),
+                                   reconnect_delay = 0.1)
+        self.assertFalse(t.connect())
+        c = fmprpc.Client(t, "P.1")
+        # A timeout bounds the wait for a reconnect
+        start = time.time()
+        f = c.invokeAsync("work", None, timeout = 0.2)
+        self.assertTrue(time.time() - start < 2)
+        self.assertEqual((f.error(), f.wasSent()), ("timed out after 0.2s", False))
+        f = t.invokeAsync(program = "P.1", method = "work", queue = False)
+        self.assertEqual((f.error(), f.wasSent()), ("not connected", False))
+        # A close lets go of those still waiting, and fails those to come
+        queued = []
+        w = threading.Thread(target = lambda: queued.append(c.invokeAsync("work", None)))
+        w.start()
+        time.sleep(0.2)
+        t.close()
+        w.join(2)
+        self.assertEqual([ (f.error(), f.wasSent()) for f in queued ],
+                         [ ("transport closed", False) ])
+        f = c.invokeAsync("work", None)
+        self.assertEqual((f.error(), f.wasSent()), ("transport closed", False))
+
+    @classmethod
+    def tearDownClass(klass):
+        for t in klass.servers:
+            t.srv.close()
+
+if __name__ == "__main__":
+    unittest.main()
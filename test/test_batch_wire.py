@@ -0,0 +1,120 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+
+log.Levels.setDefault(log.Levels.ERROR)
+
+NEW_PORT = 50030
+OLD_PORT = 50031
+
+class P_v1 (server.Handler):
+    def h_add (self, b):
+        b.reply(b.arg["x"] + b.arg["y"])
+    def h_fail (self, b):
+        b.error("failed {0}".format(b.arg))
+    def h_poke (self, b):
+        self.server.pokes.append(b.arg)
+
+class CountingTransport (fmprpc.Transport):
+    """Counts the frames that come in."""
+    def dispatch (self, msg):
+        self._parent.frames.append(msg[0])
+        fmprpc.Transport.dispatch(self, msg)
+
+class OldServer (server.ContextualServer):
+    """Like a server from before BATCH and the hello call."""
+    def gotNewConnection (self, c):
+        server.ContextualServer.gotNewConnection(self, c)
+        del c._handlers[c.HELLO_METHOD]
+
+class ServerThread(threading.Thread):
+    def __init__ (self, klass, port, cond):
+        threading.Thread.__init__(self)
+        self.srv = klass(
+            bindto = fmprpc.OpenServerAddress(port = port),
+            TransportClass = CountingTransport,
+            classes = { "P.1" : P_v1 })
+        self.srv.frames = []
+        self.srv.pokes = []
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class BatchWireTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(klass):
+        klass.servers = {}
+        for (k, port) in [ (server.ContextualServer, NEW_PORT), (OldServer, OLD_PORT) ]:
+            c = threading.Condition()
+            c.acquire()
+            t = ServerThread(k, port, c)
+            t.start()
+            c.wait()
+            c.release()
+            klass.servers[port] = t.srv
+
+    def go (self, port):
+        srv = self.servers[port]
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = port))
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, "P.1")
+        features = t.peerFeatures()
+        del srv.frames[:]
+        calls = [ ("add", { "x" : i, "y" : 1 }) for i in range(10) ] + [ ("fail", 7) ]
+        fs = c.invokeBatch(calls)
+        self.assertEqual([ f.result(timeout = 5) for f in fs[0:10] ], range(1, 11))
+        self.assertEqual(fs[10].pair(5), ("failed 7", None))
+        t.invokeBatch(program = "P.1", calls = [ ("poke", i) for i in range(3) ],
+                      notify = True)
+        self.assertEqual(c.invoke("add", { "x" : 1, "y" : 1 }), 2)
+        self.assertEqual(sorted(srv.pokes), range(3))
+        del srv.pokes[:]
+        frames = list(srv.frames)
+        t.close()
+        return (features, frames)
+
+    def test_batch(self):
+        (features, frames) = self.go(NEW_PORT)
+        self.assertTrue("batch" in features)
+        # A BATCH of calls, a BATCH of notifies, and one plain INVOKE
+        self.assertEqual(frames, [ 3, 3, 0 ])
+
+    def test_fallback(self):
+        (features, frames) = self.go(OLD_PORT)
+        self.assertEqual(features, [])
+        self.assertEqual(frames, [ 0 ] * 11 + [ 2 ] * 3 + [ 0 ])
+
+    def test_from_callback(self):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = NEW_PORT))
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, "P.1")
+        got = []
+        sent = threading.Event()
+        def cb (f):
+            # On the reader thread, before we know if the peer speaks BATCH
+            got.extend(c.invokeBatch([ ("add", { "x" : i, "y" : f.result() })
+                for i in range(3) ]))
+            sent.set()
+        c.invokeAsync("add", { "x" : 1, "y" : 1 }).addCallback(cb)
+        self.assertTrue(sent.wait(5))
+        self.assertEqual([ f.result(timeout = 5) for f in got ], [ 2, 3, 4 ])
+        # Later batches go as BATCH frames, once we've heard
+        self.assertTrue("batch" in t.peerFeatures())
+        fs = c.invokeBatch([ ("add", { "x" : 1, "y" : i }) for i in range(3) ])
+        self.assertEqual([ f.result(timeout = 5) for f in fs ], [ 1, 2, 3 ])
+        t.close()
+
+    @classmethod
+    def tearDownClass(klass):
+        for srv in klass.servers.values():
+            srv.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,124 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+from fmprpc import batching
+
+log.Levels.setDefault(log.Levels.ERROR)
+
+PORT = 50029
+
+class P_v1 (server.Handler):
+    @batching.batchHook
+    def h_square_batch (self, args):
+        self.server.batches.append(len(args))
+        return [ ValueError("negative") if a < 0 else a * a for a in args ]
+    @batching.batchHook
+    def h_broken_batch (self, args):
+        raise ValueError("no good")
+    def h_bogus_batch (self, b):
+        # Not a batchHook: the reply's the right length, but not pairs,
+        # or a pair short
+        if b.arg[0] == "flat":
+            b.reply(b.arg)
+        else:
+            b.reply([ [ None, 1 ] ] * (len(b.arg) - 1))
+    def h_nap_batch (self, b):
+        self.server.remaining.append(b.remaining())
+        time.sleep(0.3)
+        b.reply([ [ None, a ] for a in b.arg ])
+
+class ServerThread(threading.Thread):
+    def __init__ (self, cond):
+        threading.Thread.__init__(self)
+        self.srv = server.ContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = PORT),
+            classes = { "P.1" : P_v1 })
+        self.srv.batches = []
+        self.srv.remaining = []
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class BatchingTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(klass):
+        c = threading.Condition()
+        c.acquire()
+        klass.server = ServerThread(c)
+        klass.server.start()
+        c.wait()
+        c.release()
+
+    def setUp(self):
+        self.t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = PORT))
+        self.assertTrue(self.t.connect())
+        del self.server.srv.batches[:]
+
+    def tearDown(self):
+        self.t.close()
+
+    def test_count_window(self):
+        c = batching.BatchingClient(self.t, "P.1", window = None, max_batch = 10)
+        fs = [ c.invokeAsync("square", i) for i in range(25) ]
+        # Two full batches went out; the last five wait for a flush
+        self.assertEqual([ f.result(timeout = 5) for f in fs[0:20] ],
+                         [ i * i for i in range(20) ])
+        self.assertFalse(fs[24].done())
+        c.flush()
+        self.assertEqual(fs[24].result(timeout = 5), 24 * 24)
+        self.assertEqual(self.server.srv.batches, [ 10, 10, 5 ])
+        c.close()
+
+    def test_time_window(self):
+        c = batching.BatchingClient(self.t, "P.1", window = 0.05, max_batch = 1000)
+        fs = [ c.invokeAsync("square", i) for i in range(5) ]
+        self.assertEqual(c.invoke("square", 7), 49)
+        self.assertEqual([ f.result() for f in fs ], [ 0, 1, 4, 9, 16 ])
+        self.assertEqual(self.server.srv.batches, [ 6 ])
+        c.close()
+        self.assertEqual(c.invokeAsync("square", 1).error(), "client closed")
+
+    def test_errors(self):
+        c = batching.BatchingClient(self.t, "P.1", window = None, max_batch = 3)
+        fs = [ c.invokeAsync("square", i) for i in [ 2, -1, 3 ] ]
+        self.assertEqual([ f.pair(5) for f in fs ],
+                         [ (None, 4), ("negative", None), (None, 9) ])
+        fs = [ c.invokeAsync("broken", i) for i in range(3) ]
+        self.assertEqual([ f.pair(5)[0] for f in fs ], [ "no good" ] * 3)
+        for how in ("flat", "short"):
+            fs = [ c.invokeAsync("bogus", how) for i in range(3) ]
+            self.assertEqual([ f.pair(5)[0] for f in fs ], [ "bad batch reply" ] * 3)
+        fs = [ c.invokeAsync("nope", i) for i in range(3) ]
+        self.assertTrue(fs[0].pair(5)[0].startswith("unknown method"))
+        c.close()
+
+    def test_timeouts(self):
+        self.t.peerFeatures()
+        c = batching.BatchingClient(self.t, "P.1", window = None, max_batch = 2)
+        # One that times out before it goes doesn't go at all
+        f = c.invokeAsync("nap", 0, timeout = 0.05)
+        self.assertEqual(f.pair(2), ("timed out after 0.05s", None))
+        c.flush()
+        (f1, f2) = [ c.invokeAsync("nap", i, timeout = t) for (i, t) in
+                     [ (1, 0.1), (2, 2) ] ]
+        # One caller giving up doesn't hold up the other
+        self.assertEqual(f1.pair(2), ("timed out after 0.1s", None))
+        self.assertEqual(f2.pair(2), (None, 2))
+        # The batch went out good for as long as its last caller waits
+        [ r ] = self.server.srv.remaining
+        self.assertTrue(1 < r <= 2)
+        c.close()
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server.srv.close()
+
+if __name__ == "__main__":
+    unittest.main()
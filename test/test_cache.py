@@ -0,0 +1,201 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+from fmprpc import cache
+
+log.Levels.setDefault(log.Levels.ERROR)
+
+PORT = 50033
+
+class P_v1 (server.Handler):
+    @cache.cached
+    def h_square (self, b):
+        self.server.calls.append(b.arg)
+        if b.arg["x"] < 0:
+            b.error("negative")
+        else:
+            b.reply({ "sq" : b.arg["x"] ** 2, "pad" : "x" * b.arg.get("pad", 0) })
+    @cache.cached(ttl = 0.1)
+    def h_brief (self, b):
+        self.server.calls.append(b.arg)
+        b.reply(b.arg)
+    def h_plain (self, b):
+        self.server.calls.append(b.arg)
+        b.reply(b.arg)
+
+class ServerThread(threading.Thread):
+    def __init__ (self, cond):
+        threading.Thread.__init__(self)
+        self.srv = server.ContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = PORT),
+            classes = { "P.1" : P_v1 })
+        self.srv.calls = []
+        self.srv.setResponseCache(cache.ResponseCache(max_bytes = 4096))
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class ResponseCacheTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(klass):
+        c = threading.Condition()
+        c.acquire()
+        klass.server = ServerThread(c)
+        klass.server.start()
+        c.wait()
+        c.release()
+
+    def setUp(self):
+        self.t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = PORT))
+        self.assertTrue(self.t.connect())
+        self.c = fmprpc.Client(self.t, "P.1")
+        self.srv = self.server.srv
+        self.srv._response_cache.clear()
+        del self.srv.calls[:]
+
+    def tearDown(self):
+        self.t.close()
+
+    def test_hits(self):
+        rc = self.srv._response_cache
+        before = rc.stats()
+        for i in range(5):
+            self.assertEqual(self.c.invoke("square", { "x" : 3, "pad" : 1 })["sq"], 9)
+            self.assertEqual(self.c.invoke("square", { "pad" : 1, "x" : 3 })["sq"], 9)
+            self.assertEqual(self.c.invoke("plain", 1), 1)
+        self.assertEqual(len(self.srv.calls), 6)
+        s = rc.stats()
+        self.assertEqual(s["hits"] - before["hits"], 9)
+        self.assertEqual(s["misses"] - before["misses"], 1)
+        # Errors aren't cached, and neither are batches' replies to them
+        for i in range(3):
+            self.assertEqual(self.c.invokeAsync("square", { "x" : -1 }).pair(5),
+                             ("negative", None))
+        fs = self.c.invokeBatch([ ("square", { "x" : 3, "pad" : 1 }), ("square", { "x" : 4 }) ])
+        self.assertEqual([ f.result(5)["sq"] for f in fs ], [ 9, 16 ])
+        self.assertEqual(len(self.srv.calls), 10)
+
+    def test_ttl(self):
+        self.c.invoke("brief", 1)
+        self.c.invoke("brief", 1)
+        time.sleep(0.15)
+        self.c.invoke("brief", 1)
+        self.assertEqual(len(self.srv.calls), 2)
+        self.assertTrue(self.srv._response_cache.stats()["expirations"] >= 1)
+
+    def test_budget(self):
+        rc = self.srv._response_cache
+        before = rc.evictions
+        for i in range(20):
+            self.c.invoke("square", { "x" : i, "pad" : 500 })
+        self.assertTrue(rc.stats()["bytes"] <= 4096)
+        self.assertTrue(rc.evictions - before >= 12)
+        # The most recent are still there; the oldest are gone
+        del self.srv.calls[:]
+        self.c.invoke("square", { "x" : 19, "pad" : 500 })
+        self.c.invoke("square", { "x" : 0, "pad" : 500 })
+        self.assertEqual(self.srv.calls, [ { "x" : 0, "pad" : 500 } ])
+
+class Store_v1 (server.Handler):
+    def h_get (self, b):
+        self.server.calls.append(b.arg)
+        b.reply(self.server.store.get(b.arg))
+    def h_fail (self, b):
+        self.server.calls.append(b.arg)
+        b.error("nope")
+    def h_set (self, b):
+        self.server.store[b.arg["k"]] = b.arg["v"]
+        cache.pushInvalidation(self.transport, "P.1", "get", b.arg["k"])
+        b.reply(True)
+    def h_flush (self, b):
+        cache.pushInvalidation(self.transport, "P.1", b.arg)
+        b.reply(True)
+
+class CachingClientTest(unittest.TestCase):
+
+    PORT = 50034
+
+    @classmethod
+    def setUpClass(klass):
+        c = threading.Condition()
+        c.acquire()
+        klass.server = ServerThread(c)
+        klass.server.srv = server.ContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = klass.PORT),
+            classes = { "P.1" : Store_v1 })
+        klass.server.srv.calls = []
+        klass.server.srv.store = { "a" : 1, "b" : 2 }
+        klass.server.start()
+        c.wait()
+        c.release()
+
+    def setUp(self):
+        self.t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT))
+        self.assertTrue(self.t.connect())
+        self.c = cache.CachingClient(self.t, "P.1", ttls = { "get" : 10, "fail" : 10 })
+        self.srv = self.server.srv
+        del self.srv.calls[:]
+
+    def tearDown(self):
+        self.t.close()
+
+    def test_hits(self):
+        for i in range(5):
+            self.assertEqual(self.c.invoke("get", "a"), 1)
+            self.assertEqual(self.c.invoke("get", "b"), 2)
+        self.assertEqual(self.srv.calls, [ "a", "b" ])
+        self.assertEqual(self.c.stats()["hits"], 8)
+        # Errors go right back out
+        for i in range(2):
+            self.assertEqual(self.c.invokeAsync("fail", 1).pair(5), ("nope", None))
+        self.assertEqual(len(self.srv.calls), 4)
+
+    def test_invalidate(self):
+        self.assertEqual(self.c.invoke("get", "a"), 1)
+        self.assertEqual(self.c.invoke("get", "b"), 2)
+        self.assertTrue(self.c.invoke("set", { "k" : "a", "v" : 10 }))
+        # The notify goes out before the reply, on the same connection
+        self.assertEqual(self.c.invoke("get", "a"), 10)
+        self.assertEqual(self.c.invoke("get", "b"), 2)
+        self.assertEqual(self.srv.calls, [ "a", "b", "a" ])
+        self.c.invoke("flush", "get")
+        self.c.invoke("get", "b")
+        self.assertEqual(self.srv.calls, [ "a", "b", "a", "b" ])
+        self.c.setTtl("get", None)
+        self.c.invoke("get", "b")
+        self.assertEqual(len(self.srv.calls), 5)
+
+    def test_ttl(self):
+        c = cache.CachingClient(self.t, "P.1", ttls = { "get" : 0.1 })
+        c.invoke("get", "a")
+        c.invoke("get", "a")
+        time.sleep(0.15)
+        c.invoke("get", "a")
+        self.assertEqual(self.srv.calls, [ "a", "a" ])
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server.srv.close()
+
+class LruTest(unittest.TestCase):
+
+    def test_lru(self):
+        rc = cache.ResponseCache(max_entries = 2)
+        rc.put("a", "1")
+        rc.put("b", "2")
+        self.assertEqual(rc.get("a"), "1")
+        rc.put("c", "3")
+        self.assertEqual(rc.get("b"), None)
+        self.assertEqual(rc.get("a"), "1")
+        self.assertEqual(rc.get("c"), "3")
+        self.assertEqual(rc.stats()["evictions"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,198 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+import fmprpc.batching as batching
+from fmprpc.cache import CachingClient
+
+log.Levels.setDefault(log.Levels.ERROR)
+
+PORT = 50037
+OLD_PORT = 50038
+
+class P_v1 (server.Handler):
+    def h_spin (self, b):
+        """Work in little steps until told to stop, or 2s are up."""
+        # Hang onto this test's state, in case we outlive it
+        s = self.server.state
+        b.onCancel(lambda x: s.hooked.append(x.arg))
+        s.running.set()
+        for i in range(200):
+            if b.isCancelled():
+                s.stopped.append(b.arg)
+                s.done.set()
+                return
+            time.sleep(0.01)
+        s.finished.append(b.arg)
+        s.done.set()
+        b.reply(b.arg)
+    def h_echo (self, b):
+        b.reply(b.arg)
+    @batching.batchHook
+    def h_echo_batch (self, args):
+        self.server.state.batches.append(len(args))
+        return args
+
+class State (object):
+    def __init__ (self):
+        self.running = threading.Event()
+        self.done = threading.Event()
+        self.stopped = []
+        self.finished = []
+        self.hooked = []
+        self.batches = []
+
+class OldServer (server.ContextualServer):
+    """A server that doesn't know about cancels."""
+    def gotNewConnection (self, c):
+        server.ContextualServer.gotNewConnection(self, c)
+        c.FEATURES = [ "batch", "deadline" ]
+
+class ServerThread(threading.Thread):
+    def __init__ (self, klass, port, cond):
+        threading.Thread.__init__(self)
+        self.srv = klass(
+            bindto = fmprpc.OpenServerAddress(port = port),
+            classes = { "P.1" : P_v1 })
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class CancelTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(klass):
+        klass.servers = {}
+        for (k, port) in [ (server.ContextualServer, PORT), (OldServer, OLD_PORT) ]:
+            c = threading.Condition()
+            c.acquire()
+            t = ServerThread(k, port, c)
+            t.start()
+            c.wait()
+            c.release()
+            klass.servers[port] = t.srv
+
+    def setUp (self):
+        self.state = self.servers[PORT].state = State()
+
+    def connect (self, port = PORT):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = port))
+        self.assertTrue(t.connect())
+        t.peerFeatures()
+        return (t, fmprpc.Client(t, "P.1"))
+
+    def test_cancel(self):
+        (t, c) = self.connect()
+        f = c.invokeAsync("spin", 1)
+        self.assertTrue(self.state.running.wait(2))
+        self.assertTrue(f.cancel())
+        self.assertEqual(f.pair(), ("cancelled", None))
+        self.assertFalse(f.cancel())
+        self.assertTrue(self.state.done.wait(2))
+        self.assertEqual(self.state.stopped, [ 1 ])
+        self.assertEqual(self.state.hooked, [ 1 ])
+        # The connection's still good for more
+        self.assertEqual(c.invoke("echo", 2), 2)
+        t.close()
+
+    def test_timeout(self):
+        (t, c) = self.connect()
+        f = c.invokeAsync("spin", 3, timeout = 0.1)
+        self.assertEqual(f.pair(2), ("timed out after 0.1s", None))
+        self.assertTrue(self.state.done.wait(2))
+        self.assertEqual(self.state.stopped, [ 3 ])
+        t.close()
+
+    def test_hangup(self):
+        (t, c) = self.connect()
+        f = c.invokeAsync("spin", 4)
+        self.assertTrue(self.state.running.wait(2))
+        t.close()
+        self.assertEqual(f.pair(2), ("cancelled", None))
+        self.assertTrue(self.state.done.wait(2))
+        self.assertEqual(self.state.stopped, [ 4 ])
+
+    def test_batch(self):
+        (t, c) = self.connect()
+        [ f1, f2 ] = c.invokeBatch([ ("spin", 7), ("echo", 8) ])
+        self.assertTrue(self.state.running.wait(2))
+        f1.cancel()
+        # Its batch's reply still goes out, without waiting on the spin
+        self.assertEqual(f2.pair(2), (None, 8))
+        self.assertTrue(self.state.done.wait(2))
+        self.assertEqual(self.state.stopped, [ 7 ])
+        t.close()
+
+    def test_caching_client(self):
+        (t, c) = self.connect()
+        cc = CachingClient(t, "P.1", ttls = { "spin" : 60 })
+        f = cc.invokeAsync("spin", 9)
+        self.assertTrue(self.state.running.wait(2))
+        self.assertTrue(f.cancel())
+        self.assertEqual(f.pair(2), ("cancelled", None))
+        self.assertTrue(self.state.done.wait(2))
+        self.assertEqual(self.state.stopped, [ 9 ])
+        t.close()
+
+    def test_coalesced(self):
+        (t, c) = self.connect()
+        c.setCoalescing("spin")
+        (f1, f2) = [ c.invokeAsync("spin", 10) for i in range(2) ]
+        self.assertTrue(self.state.running.wait(2))
+        # One caller leaving doesn't stop the call for the other ...
+        self.assertTrue(f1.cancel())
+        self.assertEqual(f1.pair(), ("cancelled", None))
+        self.assertFalse(self.state.done.wait(0.1))
+        self.assertFalse(f2.done())
+        # ... but the last one does
+        self.assertTrue(f2.cancel())
+        self.assertTrue(self.state.done.wait(2))
+        self.assertEqual(self.state.stopped, [ 10 ])
+        t.close()
+
+    def test_batching_client(self):
+        (t, c) = self.connect()
+        b = batching.BatchingClient(t, "P.1", window = None)
+        (f1, f2) = [ b.invokeAsync("echo", i) for i in range(2) ]
+        # Cancelled before it goes, it doesn't go at all
+        self.assertTrue(f1.cancel())
+        self.assertEqual(f1.pair(), ("cancelled", None))
+        b.flush()
+        self.assertEqual(f2.result(timeout = 2), 1)
+        self.assertEqual(self.state.batches, [ 1 ])
+        b.close()
+        t.close()
+
+    def test_abandoned_expire(self):
+        (t, c) = self.connect()
+        t.CANCEL_GRACE = 0.2
+        futures = [ c.invokeAsync("spin", i, timeout = 0.01) for i in range(50) ]
+        for f in futures:
+            self.assertEqual(f.pair(2), ("timed out after 0.01s", None))
+        # The server won't reply to any of them, so we stop waiting on it
+        deadline = time.time() + 3
+        while t._abandoned and time.time() < deadline:
+            time.sleep(0.05)
+        self.assertEqual(len(t._abandoned), 0)
+        self.assertEqual(c.invoke("echo", 11), 11)
+        t.close()
+
+    def test_old_server(self):
+        st = self.servers[OLD_PORT].state = State()
+        (t, c) = self.connect(OLD_PORT)
+        self.assertFalse(t.peerSupports("cancel"))
+        f = c.invokeAsync("spin", 5, timeout = 0.1)
+        self.assertEqual(f.pair(2), ("timed out after 0.1s", None))
+        # No CANCEL went out, so it runs to the end
+        self.assertTrue(st.done.wait(3))
+        self.assertEqual(st.finished, [ 5 ])
+        self.assertEqual(c.invoke("echo", 6), 6)
+        t.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+from fmprpc.util import canonicalPack
+
+log.Levels.setDefault(log.Levels.ERROR)
+
+PORT = 50032
+
+class P_v1 (server.Handler):
+    def h_lookup (self, b):
+        self.server.calls.append(b.arg)
+        time.sleep(0.1)
+        b.reply({ "arg" : b.arg, "n" : len(self.server.calls) })
+
+class ServerThread(threading.Thread):
+    def __init__ (self, cond):
+        threading.Thread.__init__(self)
+        self.srv = server.ContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = PORT),
+            classes = { "P.1" : P_v1 })
+        self.srv.calls = []
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class CoalesceTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(klass):
+        c = threading.Condition()
+        c.acquire()
+        klass.server = ServerThread(c)
+        klass.server.start()
+        c.wait()
+        c.release()
+
+    def setUp(self):
+        self.t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = PORT))
+        self.assertTrue(self.t.connect())
+        del self.server.srv.calls[:]
+
+    def tearDown(self):
+        self.t.close()
+
+    def test_canonical(self):
+        a = dict([ (str(i), i) for i in range(20) ])
+        b = dict([ (str(i), i) for i in reversed(range(20)) ])
+        self.assertEqual(canonicalPack({ "x" : [ a, 1 ] }), canonicalPack({ "x" : ( b, 1 ) }))
+        self.assertNotEqual(canonicalPack({ "x" : 1 }), canonicalPack({ "x" : 2 }))
+
+    def test_coalesce(self):
+        c = fmprpc.Client(self.t, "P.1")
+        c.setCoalescing("lookup")
+        fs = [ c.invokeAsync("lookup", { "k" : 1, "j" : 2 }) for i in range(50) ]
+        fs += [ c.invokeAsync("lookup", { "j" : 2, "k" : 1 }) for i in range(50) ]
+        other = c.invokeAsync("lookup", { "k" : 2 })
+        res = [ f.result(timeout = 5) for f in fs ]
+        self.assertEqual(res, [ res[0] ] * 100)
+        self.assertEqual(other.result(timeout = 5)["arg"], { "k" : 2 })
+        self.assertEqual(len(self.server.srv.calls), 2)
+        # Once the reply is in, the next call goes out afresh
+        self.assertEqual(c.invoke("lookup", { "k" : 1, "j" : 2 })["n"], 3)
+
+    def test_timeouts(self):
+        c = fmprpc.Client(self.t, "P.1")
+        c.setCoalescing("lookup")
+        slow = c.invokeAsync("lookup", 5)
+        quick = c.invokeAsync("lookup", 5, timeout = 0.02)
+        # The joiner gives up on its own; the first caller still gets its reply
+        self.assertEqual(quick.pair(1), ("timed out after 0.02s", None))
+        self.assertFalse(slow.done())
+        self.assertEqual(slow.result(timeout = 5)["arg"], 5)
+        self.assertEqual(len(self.server.srv.calls), 1)
+
+    def test_off(self):
+        c = fmprpc.Client(self.t, "P.1")
+        fs = [ c.invokeAsync("lookup", 1) for i in range(5) ]
+        [ f.result(timeout = 5) for f in fs ]
+        self.assertEqual(len(self.server.srv.calls), 5)
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server.srv.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,105 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+import fmprpc.timer as timer
+from fmprpc.pool import WorkerPool
+
+log.Levels.setDefault(log.Levels.ERROR)
+
+PORT = 50035
+OLD_PORT = 50036
+
+class P_v1 (server.Handler):
+    def h_slow (self, b):
+        self.server.started.append((b.arg, b.remaining()))
+        time.sleep(0.2)
+        b.reply(b.arg)
+
+class OldServer (server.ContextualServer):
+    """A server that doesn't speak deadlines."""
+    def gotNewConnection (self, c):
+        server.ContextualServer.gotNewConnection(self, c)
+        c.FEATURES = [ "batch" ]
+
+class ServerThread(threading.Thread):
+    def __init__ (self, klass, port, cond):
+        threading.Thread.__init__(self)
+        self.srv = klass(
+            bindto = fmprpc.OpenServerAddress(port = port),
+            classes = { "P.1" : P_v1 })
+        self.srv.started = []
+        # Just one worker, so that calls queue up behind each other
+        self.srv.setHandlerPool(WorkerPool(n_workers = 1))
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class DeadlineTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(klass):
+        klass.servers = {}
+        for (k, port) in [ (server.ContextualServer, PORT), (OldServer, OLD_PORT) ]:
+            c = threading.Condition()
+            c.acquire()
+            t = ServerThread(k, port, c)
+            t.start()
+            c.wait()
+            c.release()
+            klass.servers[port] = t.srv
+
+    def go (self, port):
+        srv = self.servers[port]
+        del srv.started[:]
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = port))
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, "P.1")
+        t.peerFeatures()
+        fs = [ c.invokeAsync("slow", i, timeout = 0.3) for i in range(6) ]
+        res = [ f.pair(5) for f in fs ]
+        # The first one makes it; the ones stuck in the queue don't
+        self.assertEqual(res[0], (None, 0))
+        for (e, r) in res[2:]:
+            self.assertEqual(e, "timed out after 0.3s")
+        self.assertEqual(c.invoke("slow", 10), 10)
+        started = list(srv.started)
+        t.close()
+        return started
+
+    def test_server_drops(self):
+        started = self.go(PORT)
+        # The queued calls expired before the worker got to them
+        self.assertEqual([ a for (a, r) in started ], [ 0, 1, 10 ])
+        self.assertTrue(0 < started[0][1] <= 0.3)
+        self.assertEqual(started[2][1], None)
+
+    def test_old_server(self):
+        started = self.go(OLD_PORT)
+        # No deadlines on the wire, so it does all the work regardless
+        self.assertEqual([ a for (a, r) in started ], range(6) + [ 10 ])
+
+    @classmethod
+    def tearDownClass(klass):
+        for srv in klass.servers.values():
+            srv.close()
+
+class TimerTest(unittest.TestCase):
+
+    def test_raising_callback(self):
+        t = timer.TimerThread()
+        t.start()
+        ran = threading.Event()
+        t.schedule(0, lambda: 1 / 0)
+        t.schedule(0.05, ran.set)
+        # The first one's exception doesn't take the thread down with it
+        self.assertTrue(ran.wait(2))
+        self.assertTrue(t.is_alive())
+
+if __name__ == "__main__":
+    unittest.main()
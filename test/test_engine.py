@@ -0,0 +1,104 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import msgpack
+import fmprpc.log as log
+import fmprpc.server as server
+from fmprpc.packetizer import Packetizer
+
+log.Levels.setDefault(log.Levels.WARN)
+
+class P_v1 (server.Handler):
+    def h_reflect (self, b):
+        b.reply(b.arg)
+
+class ServerThread(threading.Thread):
+    def __init__ (self, port, prog, cond):
+        threading.Thread.__init__(self)
+        bindto = fmprpc.OpenServerAddress(port = port)
+        self.srv = server.ContextualServer(
+            bindto = bindto,
+            classes = { prog : P_v1 },
+            tcp_opts = { "engine" : Packetizer.UNPACKER_ENGINE }
+        )
+        self.daemon = True
+        self.cond = cond
+
+    def run(self):
+        self.srv.listenRetry(2,self.cond)
+
+    def stop(self):
+        self.srv.close()
+
+class Sink (Packetizer):
+    def __init__ (self):
+        Packetizer.__init__(self, log.newDefaultLogger())
+        self.setEngine(self.UNPACKER_ENGINE)
+        self.msgs = []
+        self.errors = []
+    def dispatch (self, msg): self.msgs.append(msg)
+    def packetizeError (self, e): self.errors.append(e)
+
+def frame (m, pad = 0):
+    b = msgpack.packb(m)
+    return msgpack.packb(len(b) + pad) + b
+
+class UnpackerEngineTest(unittest.TestCase):
+
+    PORT = 50009
+    PROG = "P.1"
+
+    @classmethod
+    def setUpClass(klass):
+        c = threading.Condition()
+        c.acquire()
+        t = ServerThread(klass.PORT, klass.PROG, c)
+        klass.server_thread = t
+        t.start()
+        c.wait()
+        c.release()
+
+    def test_chunks(self):
+        msgs = [ [ 1, i, None, "z" * i ] for i in range(100) ]
+        msgs.append([ 2, "big", "y" * 200000 ])
+        data = "".join([ frame(m) for m in msgs ])
+        for chunk in (1, 13, 0x1000):
+            p = Sink()
+            for i in range(0, len(data), chunk):
+                p.packetizeData(data[i:i+chunk])
+            self.assertEqual(p.msgs, msgs)
+            self.assertEqual(p.errors, [])
+
+    def test_bad_length(self):
+        p = Sink()
+        p.packetizeData(frame([ 2, "a", 1 ]) + frame([ 2, "b", 2 ], pad = 1))
+        self.assertEqual(p.msgs, [ [ 2, "a", 1 ] ])
+        self.assertEqual(len(p.errors), 1)
+
+    def test_bad_types(self):
+        p = Sink()
+        p.packetizeData(msgpack.packb("x"))
+        self.assertEqual(len(p.errors), 1)
+        p = Sink()
+        p.packetizeData(frame({ "a" : 1 }))
+        self.assertEqual(len(p.errors), 1)
+
+    def test_reflect(self):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT),
+            tcp_opts = { "engine" : Packetizer.UNPACKER_ENGINE })
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, self.PROG)
+        for n in (10, 3000000):
+            arg = { "s" : "q" * n, "n" : n }
+            self.assertEqual(c.invoke("reflect", arg), arg)
+        t.close()
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server_thread.stop()
+        del klass.server_thread
+
+if __name__ == "__main__":
+    unittest.main()
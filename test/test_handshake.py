@@ -0,0 +1,114 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import socket
+import threading
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+import fmprpc.transport as transport
+from fmprpc.pool import WorkerPool
+
+log.Levels.setDefault(log.Levels.ERROR)
+
+class HelloServerWrapper (transport.ClearStreamWrapper):
+    """A stand-in for a TLS or SSH handshake: wait for the client's hello."""
+    def start (self):
+        if self._socket.recv(5) != "hello":
+            return False
+        return transport.ClearStreamWrapper.start(self)
+
+class HelloClientWrapper (transport.ClearStreamWrapper):
+    def start (self):
+        self._socket.sendall("hello")
+        return transport.ClearStreamWrapper.start(self)
+
+class HelloServerTransport (transport.Transport):
+    def __init__ (self, **kwargs):
+        transport.Transport.__init__(self, **kwargs)
+        self.setWrapperClass(HelloServerWrapper)
+
+class P_v1 (server.Handler):
+    def h_double (self, b):
+        b.reply(b.arg * 2)
+
+class ServerThread(threading.Thread):
+    def __init__ (self, port, cond):
+        threading.Thread.__init__(self)
+        self.srv = server.ContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = port),
+            classes = { "P.1" : P_v1 },
+            TransportClass = HelloServerTransport)
+        self.pool = WorkerPool(n_workers = 3, queue_max = 1)
+        self.srv.setHandshakePool(self.pool, deadline = 1)
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class HandshakeTest(unittest.TestCase):
+
+    PORT = 50020
+
+    @classmethod
+    def setUpClass(klass):
+        c = threading.Condition()
+        c.acquire()
+        klass.server_thread = ServerThread(klass.PORT, c)
+        klass.server_thread.start()
+        c.wait()
+        c.release()
+
+    def __stall(self):
+        """Connect, and never say hello.  Give a worker time to pick it
+        up, since the pool's queue is tiny."""
+        s = socket.create_connection(("127.0.0.1", self.PORT))
+        s.settimeout(5)
+        time.sleep(0.05)
+        return s
+
+    def __client(self):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT))
+        t.setWrapperClass(HelloClientWrapper)
+        self.assertTrue(t.connect())
+        return t
+
+    def test_stalled_handshakes(self):
+        # Two stalled clients hold two workers, but others still get in
+        stalled = [ self.__stall() for i in range(2) ]
+        time.sleep(0.1)
+        # Their deadlines wait on the shared timer, not a thread apiece
+        self.assertFalse([ x for x in threading.enumerate()
+                           if isinstance(x, threading._Timer) ])
+        start = time.time()
+        t = self.__client()
+        self.assertEqual(fmprpc.Client(t, "P.1").invoke("double", 4), 8)
+        self.assertTrue(time.time() - start < 0.5)
+        t.close()
+
+        # ... and the deadline cuts the stalled ones off
+        for s in stalled:
+            self.assertEqual(s.recv(1), "")
+            self.assertTrue(time.time() - start < 2)
+            s.close()
+
+    def test_pool_full(self):
+        # 3 workers stalled, and 1 in the queue; the next is dropped
+        stalled = [ self.__stall() for i in range(4) ]
+        time.sleep(0.1)
+        s = self.__stall()
+        start = time.time()
+        self.assertEqual(s.recv(1), "")
+        self.assertTrue(time.time() - start < 0.5)
+        for s in stalled + [ s ]:
+            s.close()
+        time.sleep(1.2)
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server_thread.srv.close()
+        klass.server_thread.pool.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,82 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import msgpack
+import fmprpc.log as log
+import fmprpc.server as server
+from fmprpc.packetizer import Packetizer
+
+log.Levels.setDefault(log.Levels.WARN)
+
+class P_v1 (server.Handler):
+    def h_reflect (self, b):
+        b.reply(b.arg)
+
+class ServerThread(threading.Thread):
+    def __init__ (self, port, prog, cond):
+        threading.Thread.__init__(self)
+        bindto = fmprpc.OpenServerAddress(port = port)
+        self.srv = server.ContextualServer(
+            bindto = bindto,
+            classes = { prog : P_v1 }
+        )
+        self.daemon = True
+        self.cond = cond
+
+    def run(self):
+        self.srv.listenRetry(2,self.cond)
+
+    def stop(self):
+        self.srv.close()
+
+class Sink (Packetizer):
+    def __init__ (self):
+        Packetizer.__init__(self, log.newDefaultLogger())
+        self.msgs = []
+    def dispatch (self, msg): self.msgs.append(msg)
+    def packetizeError (self, e): raise Exception(e)
+
+class LargeFrameTest(unittest.TestCase):
+
+    PORT = 50008
+    PROG = "P.1"
+
+    @classmethod
+    def setUpClass(klass):
+        c = threading.Condition()
+        c.acquire()
+        t = ServerThread(klass.PORT, klass.PROG, c)
+        klass.server_thread = t
+        t.start()
+        c.wait()
+        c.release()
+
+    def test_assembly_chunks(self):
+        msgs = [ [ 2, "a", "x" * 10 ], [ 2, "b", "y" * 300000 ], [ 2, "c", "z" ] ]
+        data = ""
+        for m in msgs:
+            b = msgpack.packb(m)
+            data += msgpack.packb(len(b)) + b
+        p = Sink()
+        for i in range(0, len(data), 0x1000):
+            p.packetizeData(data[i:i+0x1000])
+        self.assertEqual(p.msgs, msgs)
+
+    def test_big_reflect(self):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT))
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, self.PROG)
+        for n in (10, 0x20000, 3000000):
+            arg = { "s" : "q" * n, "n" : n }
+            self.assertEqual(c.invoke("reflect", arg), arg)
+        t.close()
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server_thread.stop()
+        del klass.server_thread
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,233 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import time
+import os
+import fmprpc.log as log
+import fmprpc.server as server
+import fmprpc.err as err
+from fmprpc.pool import WorkerPool, ProcessPool, inline, inProcess
+from fmprpc.pipeliner import Pipeliner
+
+log.Levels.setDefault(log.Levels.ERROR)
+
+def crunch (n):
+    return (os.getpid(), sum(range(n)))
+
+def boom (arg):
+    raise ValueError("boom")
+
+def die (arg):
+    os._exit(1)
+
+def unpicklable (arg):
+    return threading.Lock()
+
+def nap (arg):
+    time.sleep(arg)
+    return arg
+
+class P_v1 (server.Handler):
+    def h_slow (self, b):
+        time.sleep(0.2)
+        b.reply(b.arg)
+    @inline
+    def h_fast (self, b):
+        b.reply(threading.current_thread().name)
+    def h_where (self, b):
+        b.reply(threading.current_thread().name)
+    @inline
+    def h_broken (self, b):
+        raise ValueError("broken")
+    def h_broken_pooled (self, b):
+        raise ValueError("broken")
+    h_crunch = inProcess(crunch)
+    h_boom = inProcess(boom)
+
+class ServerThread(threading.Thread):
+    def __init__ (self, port, prog, cond):
+        threading.Thread.__init__(self)
+        bindto = fmprpc.OpenServerAddress(port = port)
+        self.srv = server.ContextualServer(
+            bindto = bindto,
+            classes = { prog : P_v1 }
+        )
+        self.pool = WorkerPool(n_workers = 2, queue_max = 2)
+        self.srv.setHandlerPool(self.pool)
+        self.daemon = True
+        self.cond = cond
+
+    def run(self):
+        self.srv.listenRetry(2,self.cond)
+
+    def stop(self):
+        self.srv.close()
+        self.pool.close()
+
+class WorkerPoolTest(unittest.TestCase):
+
+    PORT = 50011
+    PROG = "P.1"
+
+    @classmethod
+    def setUpClass(klass):
+        c = threading.Condition()
+        c.acquire()
+        t = ServerThread(klass.PORT, klass.PROG, c)
+        klass.server_thread = t
+        t.start()
+        c.wait()
+        c.release()
+
+    def test_overflow_policies(self):
+        for (policy, want) in ((WorkerPool.REJECT, False), (WorkerPool.INLINE, True)):
+            p = WorkerPool(n_workers = 1, queue_max = 1, overflow = policy)
+            ev = threading.Event()
+            ran = []
+            self.assertTrue(p.submit(lambda x: ev.wait(), None))
+            time.sleep(0.05)
+            self.assertTrue(p.submit(ran.append, 1))
+            self.assertEqual(p.submit(ran.append, 2), want)
+            ev.set()
+            p.close()
+            time.sleep(0.05)
+            self.assertEqual(sorted(ran), [ 1, 2 ] if want else [ 1 ])
+
+    def test_broken_hooks(self):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT))
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, self.PROG)
+        for m in ("broken", "broken_pooled"):
+            (e, res) = c.invokeAsync(m, None).pair(2)
+            self.assertEqual(e, "uncaught exception in P.1.{0}".format(m))
+        # The reader survived, and the connection still works
+        for i in range(2):
+            self.assertEqual(c.invokeAsync("slow", i).pair(2), (None, i))
+        t.close()
+
+        # Nor does a hook run inline on overflow get out of submit()
+        p = WorkerPool(n_workers = 1, queue_max = 1, overflow = WorkerPool.INLINE)
+        ev = threading.Event()
+        p.submit(lambda x: ev.wait(), None)
+        time.sleep(0.05)
+        p.submit(lambda x: None, None)
+        self.assertTrue(p.submit(boom, None))
+        ev.set()
+        p.close()
+
+    def test_pool(self):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT))
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, self.PROG)
+        reader = c.invoke("fast", None)
+        self.assertNotEqual(reader, c.invoke("where", None))
+
+        # 2 running plus 2 queued go through; the rest are rejected
+        errors = []
+        def call(i):
+            try:
+                c.invoke("slow", i)
+            except err.RpcCallError as e:
+                errors.append(str(e))
+        p = Pipeliner(10)
+        p.start()
+        for i in range(10):
+            p.push(lambda i=i: call(i))
+        p.flush()
+        self.assertEqual(len(errors), 6)
+        self.assertTrue(errors[0].find("server busy") >= 0)
+        t.close()
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server_thread.stop()
+        del klass.server_thread
+
+class ProcessPoolTest(unittest.TestCase):
+
+    PORT = 50019
+    PROG = "P.1"
+
+    @classmethod
+    def setUpClass(klass):
+        klass.pool = ProcessPool(n_procs = 2, max_tasks_per_child = 5)
+        c = threading.Condition()
+        c.acquire()
+        t = ServerThread(klass.PORT, klass.PROG, c)
+        t.srv.setProcessPool(klass.pool)
+        klass.server_thread = t
+        t.start()
+        c.wait()
+        c.release()
+
+    def test_in_process(self):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT))
+        self.assertTrue(t.connect())
+        c = fmprpc.Client(t, self.PROG)
+        futures = [ c.invokeAsync("crunch", 1000) for i in range(20) ]
+        res = [ f.result(timeout = 10) for f in futures ]
+        self.assertEqual(set([ r[1] for r in res ]), set([ sum(range(1000)) ]))
+        # Served elsewhere, and by fresh processes after 5 calls apiece
+        pids = set([ r[0] for r in res ])
+        self.assertFalse(os.getpid() in pids)
+        self.assertTrue(len(pids) > 2)
+        self.assertRaises(err.RpcCallError, c.invoke, "boom", None)
+        t.close()
+
+    def test_without_pool(self):
+        # With no process pool, the hook runs like any other
+        got = []
+        class B (object):
+            arg = 0
+            def reply (self, res): got.append(res)
+            def error (self, e): got.append(e)
+        inProcess(nap)(B())
+        inProcess(boom)(B())
+        self.assertEqual(got, [ 0, "boom" ])
+
+    def test_queue_max(self):
+        p = ProcessPool(n_procs = 1, queue_max = 2)
+        got = []
+        class B (object):
+            arg = 0.2
+            def reply (self, res): got.append(res)
+        self.assertTrue(p.submit(nap, B()))
+        self.assertTrue(p.submit(nap, B()))
+        self.assertFalse(p.submit(nap, B()))
+        p.close()
+        self.assertEqual(got, [ 0.2, 0.2 ])
+
+    def test_failures(self):
+        p = ProcessPool(n_procs = 1, queue_max = 3)
+        got = []
+        done = threading.Event()
+        class B (object):
+            arg = 0
+            def reply (self, res): self.error(res)
+            def error (self, e):
+                got.append(e)
+                if len(got) == 3: done.set()
+        self.assertTrue(p.submit(unpicklable, B()))
+        self.assertTrue(p.submit(lambda x: x, B()))
+        self.assertTrue(p.submit(die, B()))
+        # Each gets an error, and gives back its place in the queue
+        self.assertTrue(done.wait(5))
+        self.assertEqual(p.outstanding(), 0)
+        got.sort()
+        self.assertTrue(got[0].startswith("Can't pickle"))
+        self.assertTrue(got[1].startswith("can't send the result back"))
+        self.assertEqual(got[2], "worker process died")
+        self.assertTrue(p.submit(nap, B()))
+        p.close()
+        self.assertEqual(got[3], 0)
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server_thread.stop()
+        klass.pool.close()
+        del klass.server_thread
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,91 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import os
+import signal
+import subprocess
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+
+log.Levels.setDefault(log.Levels.WARN)
+
+class P_v1 (server.Handler):
+    def h_pid (self, b):
+        b.reply(os.getpid())
+
+def serve (port, reuse_port):
+    srv = server.ContextualServer(
+        bindto = fmprpc.OpenServerAddress(port = port),
+        classes = { "P.1" : P_v1 })
+    srv.setWorkers(3, reuse_port = reuse_port, grace = 1)
+    srv.listenRetry(1)
+
+class PreforkTest(unittest.TestCase):
+
+    PORT = 50017
+
+    def __pid(self, port):
+        """Ask some worker for its pid, retrying while workers come up."""
+        for i in range(100):
+            t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = port))
+            if t.connect():
+                # A worker that's just been killed might reset us
+                (e, ret) = t.invokeAsync(program = "P.1", method = "pid").pair()
+                t.close()
+                if not e:
+                    return ret
+            time.sleep(0.05)
+        return None
+
+    def __pids(self, port, n):
+        """Keep connecting until we've heard from n different workers."""
+        pids = set()
+        deadline = time.time() + 10
+        while len(pids) < n and time.time() < deadline:
+            pids.add(self.__pid(port))
+        return pids
+
+    def __run(self, port, reuse_port):
+        p = subprocess.Popen([ sys.executable, os.path.splitext(__file__)[0] + ".py", "serve", str(port), reuse_port ])
+        try:
+            first = self.__pids(port, 3)
+            self.assertEqual(len(first), 3)
+
+            # A worker that dies gets replaced
+            victim = first.pop()
+            os.kill(victim, signal.SIGKILL)
+            deadline = time.time() + 10
+            pids = set()
+            while time.time() < deadline and not (pids - first - set([ victim ])):
+                pids.add(self.__pid(port))
+            self.assertTrue(pids - first - set([ victim ]))
+            self.assertFalse(victim in pids)
+
+            # A rolling restart replaces them all, without dropping the port
+            before = self.__pids(port, 3)
+            p.send_signal(signal.SIGHUP)
+            deadline = time.time() + 20
+            pids = set()
+            while time.time() < deadline and len(pids - before) < 3:
+                pid = self.__pid(port)
+                self.assertTrue(pid)
+                pids.add(pid)
+            self.assertEqual(len(pids - before), 3)
+        finally:
+            p.send_signal(signal.SIGTERM)
+            p.wait()
+        self.assertEqual(p.returncode, 0)
+
+    def test_reuse_port(self):
+        self.__run(self.PORT, "1")
+
+    def test_shared_socket(self):
+        self.__run(self.PORT + 1, "")
+
+if __name__ == "__main__":
+    if sys.argv[1:2] == [ "serve" ]:
+        serve(int(sys.argv[2]), not not sys.argv[3])
+    else:
+        unittest.main()
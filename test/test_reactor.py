@@ -0,0 +1,136 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+import fmprpc.pool as pool
+import fmprpc.aio as aio
+from fmprpc.reactor import Reactor, ReactorGroup
+from fmprpc.transport import ReactorWriter
+
+log.Levels.setDefault(log.Levels.WARN)
+
+class P_v1 (server.Handler):
+    @pool.inline
+    def h_double (self, b):
+        b.reply(b.arg * 2)
+    def h_big (self, b):
+        b.reply("x" * b.arg)
+
+class ServerThread(threading.Thread):
+    def __init__ (self, port, opts, cond):
+        threading.Thread.__init__(self)
+        self.srv = server.ContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = port),
+            classes = { "P.1" : P_v1 },
+            tcp_opts = opts)
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class ReactorTest(unittest.TestCase):
+
+    PORT = 50015
+
+    @classmethod
+    def setUpClass(klass):
+        klass.reactor = Reactor()
+        klass.reactor.start()
+        klass.opts = { "reactor" : klass.reactor }
+        c = threading.Condition()
+        c.acquire()
+        klass.server_thread = ServerThread(klass.PORT, klass.opts, c)
+        klass.server_thread.start()
+        c.wait()
+        c.release()
+
+    def __connect(self, opts):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT),
+                             tcp_opts = opts)
+        self.assertTrue(t.connect())
+        return t
+
+    def test_no_thread_per_connection(self):
+        before = threading.active_count()
+        ts = [ self.__connect(self.opts) for i in range(100) ]
+        for (i, t) in enumerate(ts):
+            self.assertEqual(fmprpc.Client(t, "P.1").invoke("double", i), 2 * i)
+        # 100 clients and 100 server connections, with no reader threads
+        self.assertTrue(threading.active_count() - before < 10)
+        for t in ts:
+            t.close()
+        deadline = time.time() + 5
+        while self.reactor.numHandlers() > 0 and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(self.reactor.numHandlers(), 0)
+
+    def test_write_queue(self):
+        opts = { "reactor" : self.reactor, "write_queue" : True, "write_hwm" : 0x1000 }
+        t = self.__connect(opts)
+        c = fmprpc.Client(t, "P.1")
+        futures = [ c.invokeAsync("double", i) for i in range(2000) ]
+        self.assertEqual([ f.result(timeout = 10) for f in futures ],
+            [ i * 2 for i in range(2000) ])
+        self.assertEqual(len(c.invoke("big", 0x200000)), 0x200000)
+        t.close()
+
+    def test_big_inline_replies(self):
+        # Client and server both on the one reactor thread, replying to
+        # each other from it with far more than the sockets can hold
+        t = self.__connect(self.opts)
+        self.assertTrue(isinstance(t._stream_w.writer, ReactorWriter))
+        c = fmprpc.Client(t, "P.1")
+        arg = "y" * 0x400000
+        futures = [ c.invokeAsync("double", arg) for i in range(4) ]
+        # And a reply that sends another call, from the reactor thread
+        chained = threading.Event()
+        futures[0].addCallback(lambda f:
+            c.invokeAsync("double", f.result()).addCallback(lambda g: chained.set()))
+        for f in futures:
+            self.assertEqual(len(f.result(timeout = 10)), 0x800000)
+        self.assertTrue(chained.wait(10))
+        t.close()
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server_thread.srv.close()
+        klass.reactor.stop()
+        klass.reactor.join(5)
+
+class ReactorGroupTest(unittest.TestCase):
+
+    PORT = 50016
+
+    def test_round_robin(self):
+        g = ReactorGroup(4)
+        self.assertEqual([ g.pick() for i in range(8) ], g.reactors * 2)
+
+    def test_least_connections(self):
+        g = ReactorGroup(4, ReactorGroup.LEAST_CONNECTIONS)
+        g.start()
+        srv = aio.AioContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = self.PORT),
+            classes = { "P.1" : P_v1 },
+            tcp_opts = { "reactor" : g })
+        srv.listenRetry(2)
+        ts = []
+        for i in range(39):
+            t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT))
+            self.assertTrue(t.connect())
+            ts.append(t)
+        for (i, t) in enumerate(ts):
+            self.assertEqual(fmprpc.Client(t, "P.1").invoke("double", i), 2 * i)
+        # 39 connections plus the listening socket, spread evenly
+        self.assertEqual([ r.numHandlers() for r in g.reactors ], [ 10 ] * 4)
+        for t in ts:
+            t.close()
+        srv.close()
+        g.stop()
+        g.join(5)
+
+if __name__ == "__main__":
+    unittest.main()
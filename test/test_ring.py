@@ -0,0 +1,86 @@
+import sys
+sys.path.append("../")
+import unittest
+import msgpack
+import fmprpc.log as log
+from fmprpc.ring import Ring, Arena
+from fmprpc.packetizer import Packetizer
+from fmprpc.err import RingError
+
+class Sink (Packetizer):
+    def __init__ (self):
+        Packetizer.__init__(self, log.newDefaultLogger())
+        self.msgs = []
+    def dispatch (self, msg): self.msgs.append(msg)
+    def packetizeError (self, e): raise Exception(e)
+
+class RingTest(unittest.TestCase):
+
+    def test_no_copy_within_buffer(self):
+        r = Ring()
+        r.buffer("abcdefgh")
+        self.assertEqual(r.grab(3).tobytes(), "abc")
+        r.consume(3)
+        self.assertEqual(r.grab(5).tobytes(), "defgh")
+        r.consume(5)
+        self.assertEqual(len(r), 0)
+        self.assertEqual(r.bytesCopied(), 0)
+
+    def test_straddle(self):
+        r = Ring()
+        for b in ("ab", "cd", "efgh"):
+            r.buffer(b)
+        self.assertEqual(r.grab(9), None)
+        self.assertEqual(r.grab(5).tobytes(), "abcde")
+        self.assertEqual(r.bytesCopied(), 5)
+        r.consume(5)
+        self.assertEqual(r.grab(3).tobytes(), "fgh")
+        r.consume(3)
+        self.assertRaises(RingError, r.consume, 1)
+
+    def test_packetize_chunks(self):
+        msgs = [ [ 1, i, None, { "y" : "z" * i } ] for i in range(200) ]
+        data = ""
+        for m in msgs:
+            b = msgpack.packb(m)
+            data += msgpack.packb(len(b)) + b
+        for chunk in (1, 7, 0x1000):
+            p = Sink()
+            for i in range(0, len(data), chunk):
+                p.packetizeData(data[i:i+chunk])
+            self.assertEqual(p.msgs, msgs)
+
+    def test_borrowed(self):
+        msgs = [ [ 1, i, None, { "y" : "z" * i } ] for i in range(200) ]
+        data = ""
+        for m in msgs:
+            b = msgpack.packb(m)
+            data += msgpack.packb(len(b)) + b
+        p = Sink()
+        a = Arena(16, 64)
+        i = 0
+        while i < len(data):
+            buf = a.target()
+            n = min(len(buf), len(data) - i)
+            buf[0:n] = data[i:i+n]
+            p.packetizeData(buf[0:n], borrowed = True)
+            a.adapt(n)
+            i += n
+        self.assertEqual(p.msgs, msgs)
+
+class ArenaTest(unittest.TestCase):
+
+    def test_adapt(self):
+        a = Arena(0x1000, 0x4000)
+        self.assertEqual(len(a.target()), 0x1000)
+        a.adapt(0x1000)
+        a.adapt(0x2000)
+        a.adapt(0x4000)
+        self.assertEqual(a.size(), 0x4000)
+        a.adapt(0x10)
+        self.assertEqual(a.size(), 0x2000)
+        a.adapt(0x1800)
+        self.assertEqual(a.size(), 0x2000)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import sys
+sys.path.append("../")
+import unittest
+import threading
+import fmprpc.log as log
+from fmprpc.packetizer import Packetizer
+from fmprpc.transport import ClearStreamWrapper
+
+class Loopback (Packetizer):
+    """Whatever we send comes right back to us, and we count the writes."""
+    def __init__ (self):
+        Packetizer.__init__(self, log.newDefaultLogger())
+        self.msgs = []
+        self.writes = 0
+    def rawWritev (self, bufs):
+        self.writes += 1
+        self.packetizeData("".join(bufs))
+    def dispatch (self, msg): self.msgs.append(msg)
+    def packetizeError (self, e): raise Exception(e)
+
+class Dribbler (object):
+    """A fake stream with sendmsg(), that only takes a few bytes at a time."""
+    def __init__ (self):
+        self.data = ""
+        self.calls = 0
+    def sendmsg (self, bufs):
+        self.calls += 1
+        b = "".join([ str(bytearray(x)) for x in bufs ])[0:5]
+        self.data += b
+        return len(b)
+
+class SendTest(unittest.TestCase):
+
+    def test_one_write_per_frame(self):
+        p = Loopback()
+        p.send([ 2, "a", 1 ])
+        self.assertEqual(p.writes, 1)
+        self.assertEqual(p.msgs, [ [ 2, "a", 1 ] ])
+
+    def test_send_many(self):
+        p = Loopback()
+        msgs = [ [ 2, "m", i ] for i in range(50) ]
+        p.sendMany(msgs)
+        self.assertEqual(p.writes, 1)
+        self.assertEqual(p.msgs, msgs)
+
+    def test_sendmsg_partial(self):
+        w = ClearStreamWrapper.__new__(ClearStreamWrapper)
+        w.log_obj = log.newDefaultLogger()
+        w._socket = Dribbler()
+        w.writer = None
+        w._write_lock = threading.Lock()
+        bufs = [ "abc", "", "defghij", "k", "lmnopqrstuvwxyz" ]
+        w.writev(bufs)
+        self.assertEqual(w._socket.data, "".join(bufs))
+        self.assertEqual(w._socket.calls, 6)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,134 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+from fmprpc.sharding import HashRing, ShardedClient
+
+log.Levels.setDefault(log.Levels.ERROR)
+
+class P_v1 (server.Handler):
+    def h_put (self, b):
+        self.server.store[b.arg["key"]] = b.arg["val"]
+        b.reply(self.server.port)
+    def h_get (self, b):
+        b.reply(self.server.store.get(b.arg["key"]))
+    def h_touch (self, b):
+        self.server.store[b.arg["key"]] = True
+
+class ServerThread(threading.Thread):
+    def __init__ (self, port, cond):
+        threading.Thread.__init__(self)
+        self.srv = server.ContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = port),
+            classes = { "P.1" : P_v1 })
+        self.srv.port = port
+        self.srv.store = {}
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class HashRingTest(unittest.TestCase):
+
+    KEYS = [ "key-{0}".format(i) for i in range(5000) ]
+
+    def owners (self, ring):
+        return dict([ (k, ring.lookup(k)) for k in self.KEYS ])
+
+    def test_spread(self):
+        r = HashRing()
+        for n in "abcd":
+            r.add(n)
+        counts = {}
+        for v in self.owners(r).values():
+            counts[v] = counts.get(v, 0) + 1
+        self.assertEqual(sorted(counts.keys()), list("abcd"))
+        for v in counts.values():
+            self.assertTrue(v > 5000 / 4 / 2)
+
+    def test_minimal_movement(self):
+        r = HashRing()
+        for n in "abcd":
+            r.add(n)
+        before = self.owners(r)
+        r.add("e")
+        after = self.owners(r)
+        moved = [ k for k in self.KEYS if before[k] != after[k] ]
+        # Only keys that now belong to the new node move, about 1/5 of them
+        self.assertTrue(all([ after[k] == "e" for k in moved ]))
+        self.assertTrue(len(moved) < 5000 * 0.3)
+        r.remove("b")
+        gone = self.owners(r)
+        moved = [ k for k in self.KEYS if after[k] != gone[k] ]
+        self.assertTrue(all([ after[k] == "b" for k in moved ]))
+        self.assertTrue("b" not in gone.values())
+
+    def test_empty(self):
+        r = HashRing()
+        self.assertEqual(r.lookup("x"), None)
+        r.add("a")
+        r.remove("a")
+        self.assertEqual(r.lookup("x"), None)
+
+class ShardedClientTest(unittest.TestCase):
+
+    PORTS = [ 50026, 50027, 50028 ]
+
+    @classmethod
+    def setUpClass(klass):
+        klass.servers = []
+        for port in klass.PORTS:
+            c = threading.Condition()
+            c.acquire()
+            t = ServerThread(port, c)
+            t.start()
+            c.wait()
+            c.release()
+            klass.servers.append(t)
+
+    def test_sticky(self):
+        remotes = [ fmprpc.InternetAddress(port = p) for p in self.PORTS ]
+        c = ShardedClient(remotes, "P.1", key_fn = lambda m, a: a["key"])
+        seen = set()
+        for i in range(50):
+            k = "k{0}".format(i)
+            port = c.invoke("put", { "key" : k, "val" : i })
+            self.assertEqual(port, c.invoke("put", { "key" : k, "val" : i }))
+            self.assertEqual(c.invoke("get", { "key" : k }), i)
+            seen.add(port)
+        self.assertEqual(len(seen), 3)
+        c.notify("touch", { "key" : "poke" })
+        c.invoke("get", { "key" : "poke" })
+        self.assertTrue(any([ s.srv.store.get("poke") is True for s in self.servers ]))
+        c.close()
+
+    def test_remove(self):
+        remotes = [ fmprpc.InternetAddress(port = p) for p in self.PORTS ]
+        c = ShardedClient(remotes, "P.1")
+        # Adding one we have already is a no-op
+        t = c.transportFor("x")
+        self.assertTrue(c.addRemote(fmprpc.InternetAddress(port = t.remote().port)) is t)
+        before = dict([ (i, c.invoke("put", { "key" : i, "val" : i }, key = i))
+                        for i in range(50) ])
+        c.removeRemote(remotes[0])
+        for i in range(50):
+            port = c.invoke("put", { "key" : i, "val" : i }, key = i)
+            if before[i] != self.PORTS[0]:
+                self.assertEqual(port, before[i])
+            else:
+                self.assertNotEqual(port, self.PORTS[0])
+        self.assertRaises(ValueError, c.invoke, "get", { "key" : 1 })
+        c.close()
+        self.assertEqual(c.invokeAsync("get", {}, key = 1).error(), "no servers available")
+
+    @classmethod
+    def tearDownClass(klass):
+        for t in klass.servers:
+            t.srv.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import time
+import fmprpc.log as log
+import fmprpc.server as server
+from fmprpc.transport_pool import TransportPool
+
+log.Levels.setDefault(log.Levels.ERROR)
+
+class P_v1 (server.Handler):
+    def h_slow (self, b):
+        time.sleep(b.arg)
+        b.reply(id(self.transport))
+    def h_drop (self, b):
+        self.transport.close()
+
+class ServerThread(threading.Thread):
+    def __init__ (self, port, cond):
+        threading.Thread.__init__(self)
+        self.srv = server.ContextualServer(
+            bindto = fmprpc.OpenServerAddress(port = port),
+            classes = { "P.1" : P_v1 })
+        self.daemon = True
+        self.cond = cond
+    def run(self):
+        self.srv.listenRetry(2, self.cond)
+
+class TransportPoolTest(unittest.TestCase):
+
+    PORT = 50021
+
+    @classmethod
+    def setUpClass(klass):
+        c = threading.Condition()
+        c.acquire()
+        klass.server_thread = ServerThread(klass.PORT, c)
+        klass.server_thread.start()
+        c.wait()
+        c.release()
+
+    def __pool(self, **kwargs):
+        p = TransportPool(fmprpc.InternetAddress(port = self.PORT), **kwargs)
+        self.assertTrue(p.connect())
+        return p
+
+    def test_grow_and_reap(self):
+        p = self.__pool(min_size = 1, max_size = 4, grow_at = 2, idle_timeout = 0.3)
+        c = fmprpc.Client(p, "P.1")
+        self.assertEqual(p.size(), 1)
+        futures = []
+        for i in range(40):
+            futures.append(c.invokeAsync("slow", 0.05))
+            time.sleep(0.005)
+        conns = set([ f.result(timeout = 10) for f in futures ])
+        self.assertEqual(p.size(), 4)
+        self.assertEqual(len(conns), 4)
+
+        # Once they've been idle a while, the extras get closed
+        time.sleep(0.4)
+        c.invoke("slow", 0)
+        time.sleep(0.2)
+        c.invoke("slow", 0)
+        self.assertEqual(p.size(), 1)
+        p.close()
+
+    def test_fewest_outstanding(self):
+        p = self.__pool(min_size = 2, max_size = 2)
+        c = fmprpc.Client(p, "P.1")
+        busy = c.invokeAsync("slow", 0.3)
+        time.sleep(0.05)
+        # The busy connection has a call out, so these all go to the other
+        quick = set([ c.invoke("slow", 0) for i in range(5) ])
+        self.assertEqual(len(quick), 1)
+        self.assertFalse(busy.result() in quick)
+        p.close()
+
+    def test_replace_dropped(self):
+        p = self.__pool(min_size = 2, max_size = 2)
+        c = fmprpc.Client(p, "P.1")
+        before = set(p.transports())
+        c.notify("drop", None)
+        time.sleep(0.2)
+        for i in range(10):
+            self.assertTrue(c.invoke("slow", 0))
+        time.sleep(0.2)
+        self.assertEqual(p.size(), 2)
+        self.assertTrue(all([ t.isConnected() for t in p.transports() ]))
+        self.assertEqual(len(before & set(p.transports())), 1)
+        p.close()
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server_thread.srv.close()
+
+if __name__ == "__main__":
+    unittest.main()
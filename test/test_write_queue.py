@@ -0,0 +1,79 @@
+import sys
+sys.path.append("../")
+import unittest
+import fmprpc
+import threading
+import fmprpc.log as log
+import fmprpc.server as server
+import random_json
+from fmprpc.pipeliner import Pipeliner
+
+log.Levels.setDefault(log.Levels.WARN)
+
+def random_object ():
+    return random_json.obj(6)
+
+OPTS = { "write_queue" : True, "write_hwm" : 0x1000, "flush_latency" : 0.001 }
+
+class P_v1 (server.Handler):
+    def h_reflect (self, b):
+        b.reply(b.arg)
+
+class ServerThread(threading.Thread):
+    def __init__ (self, port, prog, cond):
+        threading.Thread.__init__(self)
+        bindto = fmprpc.OpenServerAddress(port = port)
+        self.srv = server.ContextualServer(
+            bindto = bindto,
+            classes = { prog : P_v1 },
+            tcp_opts = OPTS
+        )
+        self.daemon = True
+        self.cond = cond
+
+    def run(self):
+        self.srv.listenRetry(2,self.cond)
+
+    def stop(self):
+        self.srv.close()
+
+class WriteQueueTest(unittest.TestCase):
+
+    PORT = 50010
+    PROG = "P.1"
+
+    @classmethod
+    def setUpClass(klass):
+        c = threading.Condition()
+        c.acquire()
+        t = ServerThread(klass.PORT, klass.PROG, c)
+        klass.server_thread = t
+        t.start()
+        c.wait()
+        c.release()
+
+    def __call(self, p, t, arg):
+        def f ():
+            c = fmprpc.Client(t, self.PROG)
+            self.assertEqual(c.invoke("reflect", arg), arg)
+        p.push(f)
+
+    def test_volley(self):
+        t = fmprpc.Transport(remote = fmprpc.InternetAddress(port = self.PORT),
+            tcp_opts = OPTS)
+        self.assertTrue(t.connect())
+        p = Pipeliner(50)
+        p.start()
+        for i in range(300):
+            self.__call(p, t, random_object())
+        self.__call(p, t, { "big" : "x" * 1000000 })
+        p.flush()
+        t.close()
+
+    @classmethod
+    def tearDownClass(klass):
+        klass.server_thread.stop()
+        del klass.server_thread
+
+if __name__ == "__main__":
+    unittest.main()